@@ -0,0 +1,118 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Admission control shared by every worker process on the host, through two small
+# files (put them on tmpfs, e.g. /dev/shm):
+#
+# <path>.buckets  a memory-mapped table of per-client token buckets, updated under
+#                 an exclusive flock
+# <path>.slots    one byte per concurrent request allowed; a request holds a POSIX
+#                 lock on a free byte while it runs. The kernel drops the locks of a
+#                 process that dies, so a crashed worker never leaks its slots.
+
+# key hash, tokens, updated (time.time())
+BUCKET = struct.Struct('<Qdd')
+# Slots probed for a client before the stalest of them is taken over
+PROBES = 8
+
+
+class Admission:
+    """Token buckets of `burst` requests refilled at `rate` per second for each
+    client, and at most `max_concurrent` admitted requests at a time across
+    processes."""
+
+    def __init__(self, path, rate, burst, max_concurrent, buckets=4096):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.buckets = buckets
+        # POSIX locks belong to the process, so threads coordinate here first
+        self.lock = threading.Lock()
+        self.held = set()
+        self.pid = None
+
+    def open(self):
+        # Files are opened per process: descriptors and locks do not survive a fork usefully
+        if self.pid == os.getpid():
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        size = self.buckets * BUCKET.size
+        self.bucket_fd = os.open(self.path + '.buckets', os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.bucket_fd).st_size < size:
+            os.ftruncate(self.bucket_fd, size)
+        self.table = mmap.mmap(self.bucket_fd, size)
+        self.slot_fd = os.open(self.path + '.slots', os.O_RDWR | os.O_CREAT, 0o600)
+        self.held = set()
+        self.pid = os.getpid()
+
+    @staticmethod
+    def key(client):
+        # Never 0, which marks an empty bucket
+        return int.from_bytes(hashlib.blake2b(client.encode(), digest_size=8).digest(), 'little') or 1
+
+    def take(self, client, now=None):
+        # (admitted, seconds until a token is available); spends a token when admitted
+        now = time.time() if now is None else now
+        key = self.key(client)
+        with self.lock:
+            self.open()
+            fcntl.flock(self.bucket_fd, fcntl.LOCK_EX)
+            try:
+                offset = self.find(key)
+                stored, tokens, updated = BUCKET.unpack_from(self.table, offset)
+                if stored != key:
+                    tokens, updated = float(self.burst), now
+                tokens = min(float(self.burst), tokens + max(now - updated, 0.0) * self.rate)
+                admitted = tokens >= 1.0
+                if admitted:
+                    tokens -= 1.0
+                BUCKET.pack_into(self.table, offset, key, tokens, now)
+            finally:
+                fcntl.flock(self.bucket_fd, fcntl.LOCK_UN)
+        return admitted, 0.0 if admitted else (1.0 - tokens) / self.rate
+
+    def find(self, key):
+        # Offset of the client's bucket, or of the empty or stalest one among its probes
+        start = key % self.buckets
+        stalest = None
+        for i in range(PROBES):
+            offset = (start + i) % self.buckets * BUCKET.size
+            stored, tokens, updated = BUCKET.unpack_from(self.table, offset)
+            if stored == key or stored == 0:
+                return offset
+            if stalest is None or updated < stalest[0]:
+                stalest = (updated, offset)
+        return stalest[1]
+
+    def acquire(self):
+        # A slot number to pass to release(), or None when max_concurrent are running
+        with self.lock:
+            self.open()
+            for slot in range(self.max_concurrent):
+                if slot in self.held:
+                    continue
+                try:
+                    fcntl.lockf(self.slot_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+                except OSError:
+                    continue
+                self.held.add(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        with self.lock:
+            if self.pid != os.getpid() or slot not in self.held:
+                return
+            fcntl.lockf(self.slot_fd, fcntl.LOCK_UN, 1, slot)
+            self.held.discard(slot)
+
+    def in_flight(self):
+        # Slots held by this process
+        with self.lock:
+            return len(self.held)
@@ -5,17 +5,58 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context, send_from_directory, send_file, template_rendered
 from flask_moment import Moment
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 from forms import *
 import re
-from datetime import datetime
+import math
+import functools
+import time
+import hmac
+import base64
+import io
+import os
+import random
+import socket
+import traceback
+import click
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, date
 from operator import itemgetter
+from itertools import groupby, islice
+import sqlite3
+import shutil
+from sqlalchemy import event, bindparam, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import MethodNotAllowed
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+from matching import MatchIndex, Entry as MatchEntry
+from readmodel import ReadModel
+import geo
+import trending
+import search
+import imagecache
+import sitemap
+import dedupe
+import threading
+from contextlib import contextmanager
+import profiler
+import memtrace
+import compression
+import admission
+import querybudget
+from querybudget import QueryBudgetExceeded
+from metrics import Metrics
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -26,6 +67,8 @@ app.config.from_object('config')
 db = SQLAlchemy(app)
 #initialize migration
 migrate = Migrate(app, db)
+# Per-process counters served at /_metrics
+metrics = Metrics()
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -35,21 +78,26 @@ class Genre(db.Model):
     __tablename__ = 'Genre'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, index=True)
 
 # Association tables for Artist to Genre and Venue to Genre
+# Rows are removed by the database (ON DELETE CASCADE) when either side is deleted
 artist_genre_table = db.Table('artist_genre_table',
-  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
-  db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True)
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+  db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
 )
 venue_genre_table = db.Table('venue_genre_table',
-  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
-  db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True)
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+  db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
 )
 
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        # The duplicate check on create, and the dedupe report's walk through each place
+        db.Index('ix_Venue_dedupe', 'city_key', 'state', 'name_key'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -60,14 +108,32 @@ class Venue(db.Model):
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     # link the associative table for the m2m relationship with genre
-    genres = db.relationship('Genre', secondary=venue_genre_table, backref=db.backref('venues'))
+    # passive_deletes leaves the association rows to the database cascade
+    genres = db.relationship('Genre', secondary=venue_genre_table, backref=db.backref('venues', passive_deletes=True), passive_deletes=True)
     # add missing information
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120))
+    # Optional coordinates; geohash is derived from them on flush for nearby searches
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
+    # Forward-decayed booking activity for /trending; see trending.py
+    trend_score = db.Column(db.Float, nullable=False, default=0, server_default='0', index=True)
+    # Last edit, genres included; the sitemap's lastmod
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    # Name, city and phone normalized for spotting duplicates (see dedupe.py); set on flush
+    name_key = db.Column(db.String)
+    city_key = db.Column(db.String(120))
+    phone_key = db.Column(db.String(20), index=True)
+    # Bumped by every UPDATE and checked by it, so a stale edit fails (see Edits)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     # Venue is the parent a Show
     # In the parent is where we put the db.relationship in SQLAlchemy
-    shows = db.relationship('Show', backref='venue', lazy=True) 
+    # Shows are deleted by the database cascade, so the ORM never loads them on delete
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete', passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
       return f'<Venue {self.id} {self.name}>'
@@ -75,6 +141,9 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_dedupe', 'city_key', 'state', 'name_key'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -84,12 +153,20 @@ class Artist(db.Model):
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     # link the associative table for the m2m relationship with genre
-    genres = db.relationship('Genre', secondary=artist_genre_table, backref=db.backref('artists'))
+    genres = db.relationship('Genre', secondary=artist_genre_table, backref=db.backref('artists', passive_deletes=True), passive_deletes=True)
     # add missing info
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(120))
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    trend_score = db.Column(db.Float, nullable=False, default=0, server_default='0', index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    name_key = db.Column(db.String)
+    city_key = db.Column(db.String(120))
+    phone_key = db.Column(db.String(20), index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete', passive_deletes=True)
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
       return f'<Artist {self.id} {self.name}>'
@@ -97,13 +174,1739 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # Detail pages and calendars read one venue's or artist's shows by time
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)    # Start time required field
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)  
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    # Set for occurrences of a recurring booking
+    series_id = db.Column(db.Integer, db.ForeignKey('show_series.id', ondelete='SET NULL'), index=True)
+    # When it was booked; trending scores count bookings from this time
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+      return f'<Show {self.id} {self.start_time} artist_id={self.artist_id} venue_id={self.venue_id}>'
+
+
+class ShowSeries(db.Model):
+    # A recurring booking; its occurrences are ordinary Show rows carrying series_id
+    __tablename__ = 'show_series'
+
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False, index=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False, index=True)
+    # weekly, biweekly or dates
+    rule = db.Column(db.String(20), nullable=False)
+    first_start = db.Column(db.DateTime, nullable=False)
+    until = db.Column(db.Date)
+    dates = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    shows = db.relationship('Show', backref='series', lazy=True, passive_deletes=True)
+
+    def __repr__(self):
+      return f'<ShowSeries {self.id} {self.rule} artist_id={self.artist_id} venue_id={self.venue_id}>'
+
+
+class GenreFacet(db.Model):
+    # Precomputed per-genre counts so facet rendering is one read of a small table.
+    # Kept current by the flush hooks in the Genre facets section below.
+    __tablename__ = 'genre_facet'
+
+    genre_id = db.Column(db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True)
+    artist_count = db.Column(db.Integer, nullable=False, default=0)
+    venue_count = db.Column(db.Integer, nullable=False, default=0)
+    # Upcoming shows by artists of this genre; shows that have started drop out on refresh
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
+    genre = db.relationship('Genre', backref=db.backref('facet', uselist=False, passive_deletes=True))
+
+    def __repr__(self):
+      return f'<GenreFacet {self.genre_id} artists={self.artist_count} venues={self.venue_count}>'
+
+class ShowArchiveSummary(db.Model):
+    # Show counts kept for monthly Show partitions that have been archived
+    __tablename__ = 'show_archive_summary'
+
+    month = db.Column(db.Date, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True, index=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True, index=True)
+    show_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+      return f'<ShowArchiveSummary {self.month} venue_id={self.venue_id} artist_id={self.artist_id} {self.show_count}>'
+
+
+class Job(db.Model):
+    # Background work queued in the database and run by 'flask jobs work'
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    # queued -> running -> done, or back to queued with a later run_at until max_attempts, then failed
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    # Refreshed by the worker while the job runs; a stale one means the worker is gone
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Float)
+    worker = db.Column(db.String(120))
+    error = db.Column(db.Text)
+
+    def __repr__(self):
+      return f'<Job {self.id} {self.name} {self.status}>'
+
+
+class ChangeEvent(db.Model):
+    # Transactional outbox: one row per venue/artist/show/genre change, written in the
+    # transaction that made it. Ids are assigned and committed in order. Deleting a
+    # venue or artist also deletes its shows, which get no events of their own.
+    __tablename__ = 'change_event'
+    # Without AUTOINCREMENT SQLite would hand out ids again once pruning empties the table
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    op = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.JSON, nullable=False, default=dict)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+    def __repr__(self):
+      return f'<ChangeEvent {self.id} {self.kind} {self.op} {self.entity_id}>'
+
+class ChangeConsumer(db.Model):
+    # How far each named outbox consumer has got
+    __tablename__ = 'change_consumer'
+
+    name = db.Column(db.String(120), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
 
     def __repr__(self):
-      return f'<Show {self.id} {self.start_time} artist_id={artist_id} venue_id={venue_id}>'
+      return f'<ChangeConsumer {self.name} {self.position}>'
+
+class TrendState(db.Model):
+    # A single row: the landmark time trend scores are currently stored against
+    __tablename__ = 'trend_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    landmark = db.Column(db.DateTime, nullable=False)
+
+class SearchDocument(db.Model):
+    # One row per searchable venue, artist, show and genre, rebuilt by the change hooks
+    # in the Search section. The full-text index itself (a tsvector column on Postgres,
+    # an FTS5 table on SQLite) is created from search.INDEX_DDL.
+    __tablename__ = 'search_document'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'entity_id', name='uq_search_document_kind_entity'),
+        # Date-phrase searches read one kind's documents by start time
+        db.Index('ix_search_document_kind_starts_at', 'kind', 'starts_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # Set on venue and artist documents and on the documents of their shows, whose
+    # text includes their names, so a change to either finds everything to rebuild
+    venue_id = db.Column(db.Integer, index=True)
+    artist_id = db.Column(db.Integer, index=True)
+    title = db.Column(db.String, nullable=False)
+    subtitle = db.Column(db.String)
+    body = db.Column(db.Text)
+    starts_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+      return f'<SearchDocument {self.kind} {self.entity_id} {self.title}>'
+
+@event.listens_for(SearchDocument.__table__, 'after_create')
+def create_search_index(target, connection, **kw):
+    for statement in search.INDEX_DDL.get(connection.dialect.name, []):
+        connection.execute(db.text(statement))
+
+# SQLite only honours ON DELETE CASCADE when foreign keys are switched on per connection
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+@event.listens_for(db.session, 'before_flush')
+def sync_venue_geohash(session, flush_context, instances):
+  for obj in list(session.new) + list(session.dirty):
+      if isinstance(obj, Venue):
+          has_location = obj.latitude is not None and obj.longitude is not None
+          geohash = geo.encode(obj.latitude, obj.longitude) if has_location else None
+          if obj.geohash != geohash:
+              obj.geohash = geohash
+
+@event.listens_for(db.session, 'before_flush')
+def sync_dedupe_keys(session, flush_context, instances):
+  for obj in list(session.new) + list(session.dirty):
+      if isinstance(obj, (Venue, Artist)):
+          keys = (dedupe.name_key(obj.name), dedupe.city_key(obj.city), dedupe.phone_key(obj.phone))
+          if (obj.name_key, obj.city_key, obj.phone_key) != keys:
+              obj.name_key, obj.city_key, obj.phone_key = keys
+
+@event.listens_for(db.session, 'before_flush')
+def stamp_updated_at(session, flush_context, instances):
+  # An onupdate default would miss edits that only change genres, which update no column
+  now = datetime.now()
+  for obj in session.dirty:
+      if isinstance(obj, (Venue, Artist)) and session.is_modified(obj):
+          obj.updated_at = now
+
+#----------------------------------------------------------------------------#
+# Genre facets.
+#----------------------------------------------------------------------------#
+
+def genres_named(names):
+  # Genre rows for form values like ['Alternative', 'Classical'] in one query, adding
+  # the ones that do not exist yet. Looked up without autoflush, so the half-built
+  # venue or artist is not flushed early.
+  with db.session.no_autoflush:
+      existing = {genre.name: genre for genre in db.session.execute(
+          db.select(Genre).where(Genre.name.in_(names))).scalars()}
+  genres = []
+  for name in names:
+      if name not in existing:
+          existing[name] = Genre(name=name)
+          db.session.add(existing[name])
+      genres.append(existing[name])
+  return genres
+
+# Correlated counts against the facet row being updated, narrowed by optional criteria
+def facet_artist_count(*criteria):
+    return db.select(db.func.count()).select_from(artist_genre_table) \
+        .where(artist_genre_table.c.genre_id == GenreFacet.genre_id, *criteria).scalar_subquery()
+
+def facet_venue_count(*criteria):
+    return db.select(db.func.count()).select_from(venue_genre_table) \
+        .where(venue_genre_table.c.genre_id == GenreFacet.genre_id, *criteria).scalar_subquery()
+
+def facet_upcoming_count(now, *criteria):
+    return db.select(db.func.count(Show.id)) \
+        .join(artist_genre_table, artist_genre_table.c.artist_id == Show.artist_id) \
+        .where(artist_genre_table.c.genre_id == GenreFacet.genre_id, Show.start_time > now, *criteria).scalar_subquery()
+
+def refresh_genre_facets():
+  # Full rebuild. Association changes are applied incrementally, so this only needs to run
+  # periodically (flask genres refresh) to drop shows that have since started.
+  now = datetime.now()
+  missing = db.select(Genre.id).where(~db.exists().where(GenreFacet.genre_id == Genre.id))
+  db.session.execute(db.insert(GenreFacet).from_select(['genre_id'], missing))
+  db.session.execute(db.update(GenreFacet).values(
+      artist_count=facet_artist_count(),
+      venue_count=facet_venue_count(),
+      upcoming_show_count=facet_upcoming_count(now),
+      refreshed_at=now
+  ))
+  db.session.commit()
+
+def release_genre_counts(venue_ids=(), artist_ids=(), show_ids=()):
+  # Bulk DELETEs bypass the ORM and the database cascades the association and Show rows,
+  # so decrement the facets first, in the same transaction, while those rows still exist.
+  venue_ids, artist_ids, show_ids = list(venue_ids), list(artist_ids), list(show_ids)
+  if not (venue_ids or artist_ids or show_ids):
+      return
+  shows_going = or_(Show.id.in_(show_ids), Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids))
+  db.session.execute(db.update(GenreFacet).values(
+      artist_count=GenreFacet.artist_count - facet_artist_count(artist_genre_table.c.artist_id.in_(artist_ids)),
+      venue_count=GenreFacet.venue_count - facet_venue_count(venue_genre_table.c.venue_id.in_(venue_ids)),
+      upcoming_show_count=GenreFacet.upcoming_show_count - facet_upcoming_count(datetime.now(), shows_going)
+  ))
+
+@event.listens_for(db.session, 'before_flush')
+def track_genre_changes(session, flush_context, instances):
+  # Collect association deltas from attribute history; they are applied in after_flush,
+  # once new genres have ids.
+  deltas = session.info['genre_deltas'] = []
+  now = datetime.now()
+  for obj in list(session.new):
+      if isinstance(obj, Genre):
+          session.add(GenreFacet(genre=obj))
+      elif isinstance(obj, Show) and obj.start_time and obj.start_time > now:
+          deltas.append(('show', obj.artist_id, None, 1))
+  for obj in list(session.new) + list(session.dirty):
+      if isinstance(obj, (Venue, Artist)):
+          kind = 'venue' if isinstance(obj, Venue) else 'artist'
+          history = db.inspect(obj).attrs.genres.history
+          deltas.extend((kind, obj, genre, 1) for genre in history.added)
+          deltas.extend((kind, obj, genre, -1) for genre in history.deleted)
+  deleted = list(session.deleted)
+  release_genre_counts(
+      venue_ids=[obj.id for obj in deleted if isinstance(obj, Venue)],
+      artist_ids=[obj.id for obj in deleted if isinstance(obj, Artist)],
+      show_ids=[obj.id for obj in deleted if isinstance(obj, Show)]
+  )
+
+@event.listens_for(db.session, 'after_flush')
+def apply_genre_deltas(session, flush_context):
+  deltas = session.info.pop('genre_deltas', None)
+  if not deltas:
+      return
+  counts = {}  # genre_id -> [artists, venues, upcoming shows]
+  upcoming_by_artist = {}
+  new_shows_by_artist = {}
+  for kind, owner, genre, delta in deltas:
+      if kind == 'show':
+          new_shows_by_artist[owner] = new_shows_by_artist.get(owner, 0) + delta
+          continue
+      row = counts.setdefault(genre.id, [0, 0, 0])
+      if kind == 'venue':
+          row[1] += delta
+      else:
+          row[0] += delta
+          # Moving an artist between genres moves their upcoming shows with them
+          if owner.id not in upcoming_by_artist:
+              upcoming_by_artist[owner.id] = session.execute(
+                  db.select(db.func.count(Show.id))
+                  .where(Show.artist_id == owner.id, Show.start_time > datetime.now())
+              ).scalar()
+          row[2] += delta * upcoming_by_artist[owner.id]
+
+  facets = GenreFacet.__table__
+  if counts:
+      session.execute(
+          db.update(facets).where(facets.c.genre_id == bindparam('b_genre_id')).values(
+              artist_count=facets.c.artist_count + bindparam('b_artists'),
+              venue_count=facets.c.venue_count + bindparam('b_venues'),
+              upcoming_show_count=facets.c.upcoming_show_count + bindparam('b_upcoming')
+          ),
+          [{'b_genre_id': genre_id, 'b_artists': a, 'b_venues': v, 'b_upcoming': u}
+           for genre_id, (a, v, u) in counts.items()]
+      )
+  add_upcoming_show_counts(session, new_shows_by_artist)
+
+def add_upcoming_show_counts(session, shows_by_artist):
+  # shows_by_artist: artist_id -> upcoming shows added (or removed, if negative)
+  if not shows_by_artist:
+      return
+  facets = GenreFacet.__table__
+  session.execute(
+      db.update(facets).where(facets.c.genre_id.in_(
+          db.select(artist_genre_table.c.genre_id)
+          .where(artist_genre_table.c.artist_id == bindparam('b_artist_id')).scalar_subquery()
+      )).values(upcoming_show_count=facets.c.upcoming_show_count + bindparam('b_shows')),
+      [{'b_artist_id': int(artist_id), 'b_shows': n} for artist_id, n in shows_by_artist.items()]
+  )
+
+genre_cli = AppGroup('genres', help='Maintain the genre facet counts.')
+
+@genre_cli.command('refresh')
+def refresh_genre_facets_command():
+  refresh_genre_facets()
+  print('Genre facets refreshed.')
+
+app.cli.add_command(genre_cli)
+
+#----------------------------------------------------------------------------#
+# Trending.
+#----------------------------------------------------------------------------#
+
+# Venue.trend_score and Artist.trend_score are forward-decayed booking counts (see
+# trending.py) stored against the landmark in trend_state. Bookings add to them in the
+# transaction that makes them and deletes take the same amounts back out, so /trending
+# reads the top rows off an index. 'decay_trend_scores' moves the landmark up.
+
+def trend_rate():
+  return trending.decay_rate(app.config.get('TRENDING_HALF_LIFE_DAYS', 7))
+
+def trend_landmark(session, for_update=False):
+  # Readers take a shared lock, so the decay job cannot rescale the scores between
+  # them reading the landmark and adding against it. SQLite serializes writers anyway.
+  states = TrendState.__table__
+  landmark = session.execute(
+      db.select(states.c.landmark).where(states.c.id == 1).with_for_update(read=not for_update)
+  ).scalar()
+  if landmark is None:
+      landmark = datetime.now()
+      session.execute(db.insert(states).values(id=1, landmark=landmark))
+  return landmark
+
+def add_trend_scores(session, shows, sign=1):
+  # shows: (venue_id, artist_id, created_at, start_time) of shows booked, or with
+  # sign=-1 of shows going away
+  shows = list(shows)
+  if not shows:
+      return
+  venues, artists = trending.show_contributions(
+      shows, trend_landmark(session), trend_rate(), app.config.get('TRENDING_UPCOMING_DAYS', 30),
+      app.config.get('TRENDING_UPCOMING_BONUS', 1.0), sign)
+  for model, deltas in ((Venue, venues), (Artist, artists)):
+      table = model.__table__
+      session.execute(
+          db.update(table).where(table.c.id == bindparam('b_id'))
+          .values(trend_score=table.c.trend_score + bindparam('b_delta')),
+          [{'b_id': int(entity_id), 'b_delta': delta} for entity_id, delta in deltas.items()]
+      )
+
+def release_trend_scores(venue_ids=(), artist_ids=(), show_ids=()):
+  # Like release_genre_counts: called before bulk DELETEs, while the shows still exist.
+  # The deleted venue or artist takes its own score with it; this reaches the other side.
+  venue_ids, artist_ids, show_ids = list(venue_ids), list(artist_ids), list(show_ids)
+  if not (venue_ids or artist_ids or show_ids):
+      return
+  shows = db.session.execute(
+      db.select(Show.venue_id, Show.artist_id, Show.created_at, Show.start_time)
+      .where(or_(Show.id.in_(show_ids), Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids)))
+  ).all()
+  add_trend_scores(db.session, shows, sign=-1)
+
+@event.listens_for(db.session, 'before_flush')
+def release_deleted_trend_scores(session, flush_context, instances):
+  deleted = list(session.deleted)
+  release_trend_scores(
+      venue_ids=[obj.id for obj in deleted if isinstance(obj, Venue)],
+      artist_ids=[obj.id for obj in deleted if isinstance(obj, Artist)],
+      show_ids=[obj.id for obj in deleted if isinstance(obj, Show)]
+  )
+
+@event.listens_for(db.session, 'after_flush')
+def add_new_show_trend_scores(session, flush_context):
+  add_trend_scores(session, [(obj.venue_id, obj.artist_id, obj.created_at, obj.start_time)
+                             for obj in session.new if isinstance(obj, Show)])
+
+def decay_trend_scores():
+  # Rescale every score to a landmark of now; rankings do not change. Scores that
+  # decayed to nothing are zeroed so they drop out of /trending.
+  now = datetime.now()
+  landmark = trend_landmark(db.session, for_update=True)
+  factor = math.exp(-trend_rate() * (now - landmark).total_seconds())
+  for model in (Venue, Artist):
+      table = model.__table__
+      db.session.execute(db.update(table).where(table.c.trend_score != 0).values(
+          trend_score=db.case((table.c.trend_score * factor < 1e-6, 0.0), else_=table.c.trend_score * factor)))
+  db.session.execute(db.update(TrendState.__table__).where(TrendState.id == 1).values(landmark=now))
+  db.session.commit()
+
+def rebuild_trend_scores():
+  # From scratch, out of every show's booking time; for backfills and repairs
+  now = datetime.now()
+  db.session.execute(db.delete(TrendState.__table__))
+  db.session.execute(db.insert(TrendState.__table__).values(id=1, landmark=now))
+  for model in (Venue, Artist):
+      db.session.execute(db.update(model.__table__).values(trend_score=0))
+  shows = stream_rows(db.select(Show.venue_id, Show.artist_id, Show.created_at, Show.start_time))
+  while True:
+      batch = list(islice(shows, STREAM_BATCH_SIZE * 20))
+      if not batch:
+          break
+      add_trend_scores(db.session, batch)
+  db.session.commit()
+
+def current_trend_landmark():
+  # None until the first booking or decay writes the trend_state row
+  return db.session.scalar(db.select(TrendState.landmark).where(TrendState.id == 1))
+
+# Default for trending_entities' landmark: None is a landmark already looked up
+LANDMARK_NOT_READ = object()
+
+def trending_entities(kind, limit, landmark=LANDMARK_NOT_READ, now=None):
+  # The top venues or artists as (id, name, city, state, image_link, score now) rows
+  model = Venue if kind == 'venue' else Artist
+  if landmark is LANDMARK_NOT_READ:
+      landmark = current_trend_landmark()
+  rows = db.session.execute(
+      db.select(model.id, model.name, model.city, model.state, model.image_link, model.trend_score)
+      .where(model.trend_score > 0).order_by(model.trend_score.desc()).limit(limit)
+  ).all()
+  rate = trend_rate()
+  now = now or datetime.now()
+  return [(entity_id, name, city, state, image_link, trending.decayed(score, landmark, now, rate) if landmark else score)
+          for entity_id, name, city, state, image_link, score in rows]
+
+trending_cli = AppGroup('trending', help='Maintain the trending venue and artist scores.')
+
+@trending_cli.command('decay')
+def decay_trend_scores_command():
+  decay_trend_scores()
+  print('Trend scores decayed.')
+
+@trending_cli.command('rebuild')
+def rebuild_trend_scores_command():
+  rebuild_trend_scores()
+  print('Trend scores rebuilt.')
+
+app.cli.add_command(trending_cli)
+
+#----------------------------------------------------------------------------#
+# Change notifications.
+#----------------------------------------------------------------------------#
+
+# In-process subscribers called after each commit with a list of
+# (kind, op, id, data) tuples, e.g. ('show', 'create', 12, {'artist_id': 1, 'venue_id': 3}).
+# The same tuples are written to the change_event outbox in the committing
+# transaction, for consumers in other processes (see consume_changes).
+change_listeners = []
+
+# Postgres advisory lock serializing outbox writers, so event ids commit in order
+OUTBOX_LOCK_KEY = 0x6f7574626f78
+
+CHANGE_KINDS = {Venue: 'venue', Artist: 'artist', Show: 'show', Genre: 'genre'}
+
+def change_data(obj):
+  # The fields in-process projections need, so they can update without a query
+  if isinstance(obj, Show):
+      return {'artist_id': int(obj.artist_id), 'venue_id': int(obj.venue_id), 'start_time': obj.start_time.isoformat()}
+  if isinstance(obj, Venue):
+      return {'name': obj.name, 'city': obj.city, 'state': obj.state}
+  if isinstance(obj, Artist):
+      return {'name': obj.name, 'image_link': obj.image_link}
+  return {}
+
+def write_outbox(session, changes):
+  if not changes:
+      return
+  connection = session.connection()
+  if connection.dialect.name == 'postgresql' and not session.info.get('outbox_locked'):
+      # Held until commit: a transaction cannot take event ids until the one before it
+      # has committed, so a consumer reading past its checkpoint never skips an id
+      # that becomes visible later. SQLite already serializes writers.
+      connection.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': OUTBOX_LOCK_KEY})
+      session.info['outbox_locked'] = True
+  now = datetime.now()
+  connection.execute(db.insert(ChangeEvent), [
+      {'kind': kind, 'op': op, 'entity_id': entity_id, 'data': data, 'created_at': now}
+      for kind, op, entity_id, data in changes
+  ])
+
+def record_changes(kind, op, ids, data=None):
+  # For Core statements (bulk deletes and the like) that never pass through a flush
+  record_change_events([(kind, op, int(i), data or {}) for i in ids])
+
+def record_change_events(changes):
+  # As record_changes, for (kind, op, id, data) tuples with per-row data
+  write_outbox(db.session, changes)
+  index_search_changes(db.session, changes)
+  db.session.info.setdefault('changes', []).extend(changes)
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changes(session, flush_context):
+  changes = []
+  for op, objects in (('create', session.new), ('update', session.dirty), ('delete', session.deleted)):
+      for obj in objects:
+          kind = CHANGE_KINDS.get(type(obj))
+          if kind and (op != 'update' or session.is_modified(obj)):
+              changes.append((kind, op, obj.id, change_data(obj)))
+  write_outbox(session, changes)
+  index_search_changes(session, changes, show_document_owners(session))
+  session.info.setdefault('changes', []).extend(changes)
+
+@event.listens_for(db.session, 'after_commit')
+def publish_changes(session):
+  session.info.pop('outbox_locked', None)
+  changes = session.info.pop('changes', None)
+  if changes:
+      for listener in change_listeners:
+          listener(changes)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changes(session):
+  session.info.pop('outbox_locked', None)
+  session.info.pop('changes', None)
+
+def fetch_changes(after, limit):
+  # Outbox events with id > after, oldest first, as (id, kind, op, entity_id, data) rows
+  return db.session.execute(
+      db.select(ChangeEvent.id, ChangeEvent.kind, ChangeEvent.op, ChangeEvent.entity_id, ChangeEvent.data)
+      .where(ChangeEvent.id > after).order_by(ChangeEvent.id).limit(limit)
+  ).all()
+
+def consume_changes(name, handler, batch_size=None, max_batches=None):
+  # Hands each batch of events the named consumer has not seen to handler(changes),
+  # as (kind, op, id, data) tuples like change_listeners get, and moves its checkpoint
+  # in the same transaction as anything the handler wrote. A handler that raises
+  # leaves the checkpoint where it was, so the batch is delivered again.
+  batch_size = batch_size or app.config.get('OUTBOX_BATCH_SIZE', 500)
+  handled = 0
+  while max_batches is None or max_batches > 0:
+      consumer = db.session.execute(
+          db.select(ChangeConsumer).where(ChangeConsumer.name == name).with_for_update()
+      ).scalar_one_or_none()
+      if consumer is None:
+          consumer = ChangeConsumer(name=name, position=0)
+          db.session.add(consumer)
+      events = fetch_changes(consumer.position, batch_size)
+      if not events:
+          db.session.commit()
+          break
+      try:
+          handler([(kind, op, entity_id, data) for event_id, kind, op, entity_id, data in events])
+          consumer.position = events[-1].id
+          consumer.updated_at = datetime.now()
+          db.session.commit()
+      except Exception:
+          db.session.rollback()
+          raise
+      handled += len(events)
+      if max_batches is not None:
+          max_batches -= 1
+      if len(events) < batch_size:
+          break
+  return handled
+
+def prune_changes(retain_days=None):
+  # Events every registered consumer has passed and that are older than the retention
+  retain_days = app.config.get('OUTBOX_RETAIN_DAYS', 7) if retain_days is None else retain_days
+  query = db.delete(ChangeEvent).where(ChangeEvent.created_at < datetime.now() - timedelta(days=retain_days))
+  slowest = db.session.scalar(db.select(db.func.min(ChangeConsumer.position)))
+  if slowest is not None:
+      query = query.where(ChangeEvent.id <= slowest)
+  deleted = db.session.execute(query).rowcount
+  db.session.commit()
+  return deleted
+
+outbox_cli = AppGroup('outbox', help='Inspect and prune the change_event outbox.')
+
+@outbox_cli.command('status')
+def outbox_status_command():
+  head = db.session.scalar(db.select(db.func.max(ChangeEvent.id))) or 0
+  click.echo(f'head: {head}')
+  for consumer in db.session.execute(db.select(ChangeConsumer).order_by(ChangeConsumer.name)).scalars():
+      click.echo(f'{consumer.name}: {consumer.position} ({head - consumer.position} behind)')
+
+@outbox_cli.command('prune')
+@click.option('--retain-days', type=int, default=None, help='Keep events newer than this (default OUTBOX_RETAIN_DAYS).')
+def outbox_prune_command(retain_days):
+  click.echo(f'Deleted {prune_changes(retain_days)} events.')
+
+app.cli.add_command(outbox_cli)
+
+#----------------------------------------------------------------------------#
+# Matching.
+#----------------------------------------------------------------------------#
+
+# Artists seeking venues and venues seeking talent, held in memory per worker
+artists_seeking_venues = MatchIndex()
+venues_seeking_talent = MatchIndex()
+RECENT_ACTIVITY_DAYS = 90
+
+def match_entries(model, ids=None):
+  # Seeking entities with genre names and recent show counts: three queries for the whole side
+  if model is Artist:
+      seeking, association, owner, show_owner = Artist.seeking_venue, artist_genre_table, artist_genre_table.c.artist_id, Show.artist_id
+  else:
+      seeking, association, owner, show_owner = Venue.seeking_talent, venue_genre_table, venue_genre_table.c.venue_id, Show.venue_id
+  entities = db.select(model.id, model.name, model.city, model.state).where(seeking.is_(True))
+  genres = db.select(owner, Genre.name).join(Genre, Genre.id == association.c.genre_id) \
+      .join(model, model.id == owner).where(seeking.is_(True))
+  activity = db.select(show_owner, db.func.count(Show.id)) \
+      .where(Show.start_time >= datetime.now() - timedelta(days=RECENT_ACTIVITY_DAYS)).group_by(show_owner)
+  if ids is not None:
+      entities = entities.where(model.id.in_(ids))
+      genres = genres.where(owner.in_(ids))
+      activity = activity.where(show_owner.in_(ids))
+
+  genre_names = {}
+  for entity_id, name in db.session.execute(genres):
+      genre_names.setdefault(entity_id, []).append(name)
+  counts = dict(db.session.execute(activity).all())
+  return [MatchEntry(entity_id, name, city, state, genre_names.get(entity_id, ()), counts.get(entity_id, 0))
+          for entity_id, name, city, state in db.session.execute(entities)]
+
+def match_index_for(model):
+  # Built on first use and rebuilt after MATCH_INDEX_MAX_AGE seconds, which also picks up
+  # edits made by other workers; edits seen by this worker are applied before each query.
+  index = artists_seeking_venues if model is Artist else venues_seeking_talent
+  with index.lock, uncounted_queries():
+      if index.loaded_at is None or time.monotonic() - index.loaded_at > app.config.get('MATCH_INDEX_MAX_AGE', 3600):
+          index.clear()
+          for entry in match_entries(model):
+              index.upsert(entry)
+          index.loaded_at = time.monotonic()
+      elif index.pending:
+          ids = list(index.pending)
+          index.pending.clear()
+          for entity_id in ids:
+              index.remove(entity_id)
+          for entry in match_entries(model, ids):
+              index.upsert(entry)
+  return index
+
+def track_match_changes(changes):
+  for kind, op, entity_id, data in changes:
+      if kind == 'artist':
+          with artists_seeking_venues.lock:
+              artists_seeking_venues.pending.add(entity_id)
+      elif kind == 'venue':
+          with venues_seeking_talent.lock:
+              venues_seeking_talent.pending.add(entity_id)
+      elif kind == 'show' and op == 'create':
+          artists_seeking_venues.add_activity(data['artist_id'])
+          venues_seeking_talent.add_activity(data['venue_id'])
+
+change_listeners.append(track_match_changes)
+
+def match_response(matches, id_key):
+  return [{
+      id_key: entry.id,
+      "name": entry.name,
+      "score": round(score, 3),
+      "shared_genres": sorted(shared)
+  } for entry, score, shared in matches]
+
+#----------------------------------------------------------------------------#
+# Read model.
+#----------------------------------------------------------------------------#
+
+# Optional (READ_MODEL_ENABLED) in-process copy of what the list pages show. This
+# worker's own changes apply on commit; other workers' arrive from the outbox at most
+# READ_MODEL_SYNC_INTERVAL seconds later. Applying an event twice is harmless.
+read_model = ReadModel()
+read_model.position = 0
+read_model.synced_at = 0
+# Held by the one thread loading or syncing; read_model.lock is only taken to swap the
+# result in, so list pages keep being served from the current model meanwhile
+read_model.refreshing = threading.Lock()
+list_facets_cache = {'rows': None, 'at': 0}
+
+def load_read_model():
+  # Events after this position may already be in the rows read below; replaying them is harmless
+  read_model.position = db.session.scalar(db.select(db.func.max(ChangeEvent.id))) or 0
+  venues = db.session.execute(db.select(Venue.id, Venue.name, Venue.city, Venue.state))
+  artists = db.session.execute(db.select(Artist.id, Artist.name, Artist.image_link))
+  shows = stream_rows(db.select(Show.id, Show.venue_id, Show.artist_id, Show.start_time).order_by(Show.start_time, Show.id))
+  read_model.load(venues, artists, ((show_id, venue_id, artist_id, int(start_time.timestamp()))
+                                    for show_id, venue_id, artist_id, start_time in shows))
+  read_model.loaded_at = read_model.synced_at = time.monotonic()
+
+def sync_read_model():
+  batch_size = app.config.get('OUTBOX_BATCH_SIZE', 500)
+  while True:
+      events = fetch_changes(read_model.position, batch_size)
+      if events:
+          read_model.apply([(kind, op, entity_id, data) for event_id, kind, op, entity_id, data in events])
+          read_model.position = events[-1].id
+      if len(events) < batch_size:
+          break
+  read_model.synced_at = time.monotonic()
+
+def current_read_model():
+  # None when the read model is switched off; list pages then query the database
+  if not app.config.get('READ_MODEL_ENABLED'):
+      return None
+  max_age = app.config.get('READ_MODEL_MAX_AGE')
+  def expired():
+      return read_model.loaded_at is None or (max_age and time.monotonic() - read_model.loaded_at > max_age)
+  def behind():
+      return time.monotonic() - read_model.synced_at > app.config.get('READ_MODEL_SYNC_INTERVAL', 1.0)
+  # Only the first load makes others wait; later, whoever finds another thread
+  # refreshing serves the model as it is
+  if (expired() or behind()) and read_model.refreshing.acquire(blocking=read_model.loaded_at is None):
+      try:
+          with uncounted_queries():
+              if expired():
+                  load_read_model()
+              elif behind():
+                  sync_read_model()
+      finally:
+          read_model.refreshing.release()
+  return read_model
+
+def list_facets():
+  # List pages served from the read model reuse facet rows for READ_MODEL_FACET_TTL seconds
+  if current_read_model() is None:
+      return genre_facets()
+  if list_facets_cache['rows'] is None or time.monotonic() - list_facets_cache['at'] > app.config.get('READ_MODEL_FACET_TTL', 60):
+      with uncounted_queries():
+          list_facets_cache['rows'] = genre_facets()
+      list_facets_cache['at'] = time.monotonic()
+  return list_facets_cache['rows']
+
+def apply_read_model_changes(changes):
+  if read_model.loaded_at is not None:
+      read_model.apply(changes)
+
+change_listeners.append(apply_read_model_changes)
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+SEARCH_KINDS = ('venue', 'artist', 'show', 'genre')
+SEARCH_BATCH_SIZE = 1000
+
+def genre_names(table, owner_column, ids):
+  # owner id -> its genre names
+  names = {}
+  for owner_id, name in db.session.execute(
+      db.select(owner_column, Genre.name).join(Genre, Genre.id == table.c.genre_id).where(owner_column.in_(ids))
+  ):
+      names.setdefault(owner_id, []).append(name)
+  return names
+
+def build_search_documents(venues=None, artists=None, shows=None, genres=None):
+  # Document rows for the venues, artists, shows and genres matching each criterion;
+  # a criterion of None builds none of that kind. Reads in batches so a full rebuild
+  # never holds every row in memory.
+  if venues is not None:
+      query = db.select(Venue.id, Venue.name, Venue.city, Venue.state, Venue.address).where(venues)
+      for batch in stream_rows(query).partitions(SEARCH_BATCH_SIZE):
+          names = genre_names(venue_genre_table, venue_genre_table.c.venue_id, [row[0] for row in batch])
+          for row in batch:
+              yield search.venue_document(*row, names.get(row[0], []))
+  if artists is not None:
+      query = db.select(Artist.id, Artist.name, Artist.city, Artist.state).where(artists)
+      for batch in stream_rows(query).partitions(SEARCH_BATCH_SIZE):
+          names = genre_names(artist_genre_table, artist_genre_table.c.artist_id, [row[0] for row in batch])
+          for row in batch:
+              yield search.artist_document(*row, names.get(row[0], []))
+  if shows is not None:
+      query = db.select(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Artist.name, Venue.name, Venue.city, Venue.state) \
+          .join(Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id).where(shows)
+      for batch in stream_rows(query).partitions(SEARCH_BATCH_SIZE):
+          names = genre_names(artist_genre_table, artist_genre_table.c.artist_id, list({row[2] for row in batch}))
+          for row in batch:
+              yield search.show_document(*row, names.get(row[2], []))
+  if genres is not None:
+      for genre_id, name in db.session.execute(db.select(Genre.id, Genre.name).where(genres)):
+          yield search.genre_document(genre_id, name)
+
+def write_search_documents(session, documents):
+  batch = []
+  for document in documents:
+      batch.append(document)
+      if len(batch) == SEARCH_BATCH_SIZE:
+          session.execute(db.insert(SearchDocument.__table__), batch)
+          batch = []
+  if batch:
+      session.execute(db.insert(SearchDocument.__table__), batch)
+
+def replace_search_documents(session, venue_ids=(), artist_ids=(), show_ids=(), genre_ids=()):
+  # Replaces the given entities' own documents. Deleted entities simply get no new one.
+  documents = SearchDocument.__table__
+  ids = {'venue': list(venue_ids), 'artist': list(artist_ids), 'show': list(show_ids), 'genre': list(genre_ids)}
+  if not any(ids.values()):
+      return
+  session.execute(db.delete(documents).where(or_(*(
+      db.and_(documents.c.kind == kind, documents.c.entity_id.in_(kind_ids)) for kind, kind_ids in ids.items() if kind_ids
+  ))))
+  write_search_documents(session, build_search_documents(
+      venues=Venue.id.in_(ids['venue']) if ids['venue'] else None,
+      artists=Artist.id.in_(ids['artist']) if ids['artist'] else None,
+      shows=Show.id.in_(ids['show']) if ids['show'] else None,
+      genres=Genre.id.in_(ids['genre']) if ids['genre'] else None
+  ))
+
+def reindex_show_documents(session, venue_ids=(), artist_ids=()):
+  # Rebuilds the documents of every show of the given venues and artists, which copy
+  # their names, place and genres. Can be many rows (see SEARCH_SHOW_REINDEX_JOB).
+  documents = SearchDocument.__table__
+  venue_ids, artist_ids = list(venue_ids), list(artist_ids)
+  if not (venue_ids or artist_ids):
+      return
+  session.execute(db.delete(documents).where(documents.c.kind == 'show', or_(
+      documents.c.venue_id.in_(venue_ids), documents.c.artist_id.in_(artist_ids))))
+  write_search_documents(session, build_search_documents(
+      shows=or_(Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids))))
+
+def reindex_search(session, venue_ids=(), artist_ids=(), show_ids=(), genre_ids=()):
+  # Replaces the documents of the given entities and of the shows of the given venues
+  # and artists, all at once (snapshot exports)
+  replace_search_documents(session, venue_ids, artist_ids, show_ids, genre_ids)
+  reindex_show_documents(session, venue_ids, artist_ids)
+
+# The venue and artist fields show documents copy; only a change to one of them
+# rebuilds their shows' documents
+SHOW_DOCUMENT_FIELDS = {Venue: ('name', 'city', 'state'), Artist: ('name', 'genres')}
+
+def show_document_owners(session):
+  # (kind, id) of the flushed venues and artists whose shows' documents are outdated
+  owners = []
+  for obj in session.dirty:
+      fields = SHOW_DOCUMENT_FIELDS.get(type(obj))
+      if fields:
+          state = db.inspect(obj)
+          if any(state.attrs[field].history.has_changes() for field in fields):
+              owners.append((CHANGE_KINDS[type(obj)], obj.id))
+  return owners
+
+def index_search_changes(session, changes, show_owners=()):
+  # Called with every batch of change tuples, inside the transaction that made them.
+  # A venue or artist that is gone takes its shows' documents with it in one DELETE;
+  # the shows of one whose name, place or genres changed are rebuilt here too, or by
+  # the reindex_show_documents job with SEARCH_SHOW_REINDEX_JOB (a worker must run).
+  if not changes or not app.config.get('SEARCH_INDEX_ENABLED', True):
+      return
+  ids = {kind: set() for kind in SEARCH_KINDS}
+  gone = {kind: set() for kind in SEARCH_KINDS}
+  for kind, op, entity_id, data in changes:
+      (gone if op == 'delete' else ids)[kind].add(entity_id)
+  documents = SearchDocument.__table__
+  if gone['venue'] or gone['artist']:
+      session.execute(db.delete(documents).where(or_(
+          documents.c.venue_id.in_(gone['venue']), documents.c.artist_id.in_(gone['artist']))))
+  replace_search_documents(session, ids['venue'] - gone['venue'], ids['artist'] - gone['artist'],
+                           ids['show'] | gone['show'], ids['genre'] | gone['genre'])
+  venue_ids = sorted({entity_id for kind, entity_id in show_owners if kind == 'venue'} - gone['venue'])
+  artist_ids = sorted({entity_id for kind, entity_id in show_owners if kind == 'artist'} - gone['artist'])
+  if not (venue_ids or artist_ids):
+      return
+  if app.config.get('SEARCH_SHOW_REINDEX_JOB'):
+      enqueue_during_flush(session, 'reindex_show_documents', {'venue_ids': venue_ids, 'artist_ids': artist_ids})
+  else:
+      reindex_show_documents(session, venue_ids, artist_ids)
+
+def rebuild_search_index():
+  # Full rebuild in one transaction, so searches see the old index until it commits
+  db.session.execute(db.delete(SearchDocument.__table__))
+  write_search_documents(db.session, build_search_documents(venues=db.true(), artists=db.true(), shows=db.true(), genres=db.true()))
+  db.session.commit()
+
+def search_documents(text, kind=None, page=1, per_page=20, now=None):
+  # One page of documents ranked by relevance across all kinds, as
+  # (kind, entity_id, venue_id, artist_id, title, subtitle, starts_at, rank) rows,
+  # plus whether another page follows. A date phrase ("next week") limits the search
+  # to shows in that window, and on its own lists them by start time.
+  terms, window = search.parse_query(text, now)
+  if not terms and not window:
+      return [], False
+  query = db.select(SearchDocument.kind, SearchDocument.entity_id, SearchDocument.venue_id, SearchDocument.artist_id,
+                    SearchDocument.title, SearchDocument.subtitle, SearchDocument.starts_at)
+  rank = db.literal(0.0)
+  if terms:
+      if db.session.get_bind().dialect.name == 'postgresql':
+          document = db.literal_column('search_document.document')
+          matches = db.func.to_tsquery('simple', search.tsquery(terms))
+          query = query.where(document.op('@@')(matches))
+          rank = db.func.ts_rank_cd(document, matches)
+      else:
+          fts = db.table('search_fts', db.column('rowid'))
+          query = query.join(fts, fts.c.rowid == SearchDocument.id) \
+              .where(db.literal_column('search_fts').op('MATCH')(search.fts5_query(terms)))
+          # bm25 is lower for better matches; weights follow title, subtitle, body
+          rank = -db.func.bm25(db.literal_column('search_fts'), 10.0, 4.0, 1.0)
+  if window:
+      query = query.where(SearchDocument.kind == 'show', SearchDocument.starts_at >= window[0],
+                          SearchDocument.starts_at < window[1])
+  if kind:
+      query = query.where(SearchDocument.kind == kind)
+  rank = rank.label('rank')
+  # Without terms every match ranks the same; leave the order to the (kind, starts_at) index
+  order = (rank.desc(),) if terms else ()
+  query = query.add_columns(rank).order_by(*order, SearchDocument.starts_at, SearchDocument.title) \
+      .limit(per_page + 1).offset((page - 1) * per_page)
+  rows = db.session.execute(query).all()
+  return rows[:per_page], len(rows) > per_page
+
+search_cli = AppGroup('search', help='Maintain the full-text search index.')
+
+@search_cli.command('reindex')
+def reindex_search_command():
+  rebuild_search_index()
+  click.echo(f'Indexed {db.session.scalar(db.select(db.func.count(SearchDocument.id)))} documents.')
+
+app.cli.add_command(search_cli)
+
+#----------------------------------------------------------------------------#
+# Edits.
+#----------------------------------------------------------------------------#
+
+# Venues and artists carry a version that the mapper (version_id_col) bumps on every
+# UPDATE and checks in its WHERE clause. Edit forms send back the version they were
+# rendered from: a stale one is refused before anything is written, and an edit that
+# lost the race after that check matches no row and raises StaleDataError. Either
+# way no lock is held while the editor fills in the form.
+
+def submitted_version(form):
+  try:
+      return int(form.version.data)
+  except (TypeError, ValueError):
+      return None
+
+def apply_edit(obj, values, genre_names):
+  # Sets only the columns whose value differs and adds or removes only the genres that
+  # changed, so the flush writes just those rows. Returns whether anything changed.
+  # Without autoflush, loading the genres cannot write the columns early, which would
+  # take a second UPDATE and version at commit.
+  changed = False
+  with db.session.no_autoflush:
+      for key, value in values.items():
+          if getattr(obj, key) != value:
+              setattr(obj, key, value)
+              changed = True
+      current = {genre.name: genre for genre in obj.genres}
+      wanted = dict.fromkeys(genre_names)
+      for name in current.keys() - wanted.keys():
+          obj.genres.remove(current[name])
+          changed = True
+      added = [name for name in wanted if name not in current]
+      if added:
+          obj.genres.extend(genres_named(added))
+          changed = True
+  return changed
+
+def refuse_stale_edit(kind, name, edit_url):
+  metrics.increment('edit_conflicts_total', kind=kind)
+  flash(f'{kind.capitalize()} {name} was changed by someone else while you were editing. '
+        'Review the current details and make your changes again.')
+  return redirect(edit_url)
+
+#----------------------------------------------------------------------------#
+# Duplicates.
+#----------------------------------------------------------------------------#
+
+# Venues and artists carry normalized name, city and phone keys (see dedupe.py). On
+# create, a listing with the same name key in the same city and state is refused
+# after one lookup on the dedupe index, and similar ones are offered for the user to
+# check first. 'flask dedupe report' finds likely duplicates across a whole table.
+DEDUPE_KINDS = {'venues': Venue, 'artists': Artist}
+
+def dedupe_record(entity_id, name, city, state, phone):
+  return dedupe.Record(entity_id, dedupe.name_key(name), dedupe.city_key(city), state, dedupe.phone_key(phone))
+
+def find_duplicate(model, record):
+  # (id, name) of a listing with the record's name key, city and state, or None
+  if record.name_key is None:
+      return None
+  return db.session.execute(
+      db.select(model.id, model.name)
+      .where(model.city_key == record.city_key, model.state == record.state, model.name_key == record.name_key)
+      .limit(1)
+  ).first()
+
+def near_duplicates(model, record, limit=5):
+  # Listings that may be the record under another spelling, best first, as
+  # (id, name, city, state, score): the record's neighbours by name key within its
+  # place, which is what the dedupe report compares it with, and any sharing its phone
+  window = app.config.get('DEDUPE_WINDOW', 10)
+  threshold = app.config.get('DEDUPE_THRESHOLD', 0.6)
+  columns = (model.id, model.name, model.city, model.state, model.name_key, model.city_key, model.phone_key)
+  place = (model.city_key == record.city_key, model.state == record.state)
+  queries = []
+  if record.name_key is not None:
+      queries.append(db.select(*columns).where(*place, model.name_key >= record.name_key).order_by(model.name_key).limit(window))
+      queries.append(db.select(*columns).where(*place, model.name_key < record.name_key).order_by(model.name_key.desc()).limit(window))
+  if record.phone_key is not None:
+      queries.append(db.select(*columns).where(model.phone_key == record.phone_key).limit(window))
+  matches = {}
+  for query in queries:
+      for entity_id, name, city, state, name_key, city_key, phone_key in db.session.execute(query):
+          score = dedupe.match_score(record, dedupe.Record(entity_id, name_key, city_key, state, phone_key))
+          if score >= threshold:
+              matches[entity_id] = (entity_id, name, city, state, score)
+  return sorted(matches.values(), key=lambda match: -match[4])[:limit]
+
+def dedupe_records(model, order, *criteria):
+  rows = stream_rows(db.select(model.id, model.name_key, model.city_key, model.state, model.phone_key)
+                     .where(*criteria).order_by(*order))
+  return (dedupe.Record(*row) for row in rows)
+
+def dedupe_report(model, window=None, threshold=None):
+  # Groups of ids that are likely one listing, largest first, and {(id, id): score}.
+  # Two sorted passes read off indexes: by place and name, and by phone number.
+  pairs = dedupe.sorted_neighborhood([
+      dedupe_records(model, (model.city_key, model.state, model.name_key, model.id)),
+      dedupe_records(model, (model.phone_key, model.id), model.phone_key.is_not(None)),
+  ], window or app.config.get('DEDUPE_WINDOW', 10), threshold or app.config.get('DEDUPE_THRESHOLD', 0.6))
+  return dedupe.clusters(pairs), pairs
+
+def fill_dedupe_keys(model):
+  # For rows written before the keys existed; the flush hook keeps them from then on
+  table = model.__table__
+  update = db.update(table).where(table.c.id == bindparam('b_id')).values(
+      name_key=bindparam('b_name_key'), city_key=bindparam('b_city_key'), phone_key=bindparam('b_phone_key'))
+  rows = stream_rows(db.select(model.id, model.name, model.city, model.state, model.phone))
+  filled = 0
+  while True:
+      batch = list(islice(rows, STREAM_BATCH_SIZE * 20))
+      if not batch:
+          break
+      records = [dedupe_record(*row) for row in batch]
+      db.session.execute(update, [{'b_id': record.id, 'b_name_key': record.name_key, 'b_city_key': record.city_key,
+                                   'b_phone_key': record.phone_key} for record in records])
+      filled += len(records)
+  db.session.commit()
+  return filled
+
+dedupe_cli = AppGroup('dedupe', help='Find venues and artists listed more than once.')
+
+@dedupe_cli.command('keys')
+def fill_dedupe_keys_command():
+  for kind, model in DEDUPE_KINDS.items():
+      print(f'{kind}: {fill_dedupe_keys(model)} rows keyed.')
+
+@dedupe_cli.command('report')
+@click.option('--kind', type=click.Choice(sorted(DEDUPE_KINDS)), default=None, help='Only venues or only artists.')
+@click.option('--window', type=int, default=None, help='Neighbours each listing is compared with (DEDUPE_WINDOW).')
+@click.option('--threshold', type=float, default=None, help='Lowest score reported (DEDUPE_THRESHOLD).')
+@click.option('--limit', type=int, default=100, help='Most groups listed per kind.')
+def dedupe_report_command(kind, window, threshold, limit):
+  for name, model in DEDUPE_KINDS.items():
+      if kind and kind != name:
+          continue
+      groups, pairs = dedupe_report(model, window, threshold)
+      print(f'{name}: {len(groups)} groups of likely duplicates')
+      shown = groups[:limit]
+      ids = [entity_id for group in shown for entity_id in group]
+      listings = {}
+      for start in range(0, len(ids), SEARCH_BATCH_SIZE):
+          listings.update((row[0], row[1:]) for row in db.session.execute(
+              db.select(model.id, model.name, model.city, model.state).where(model.id.in_(ids[start:start + SEARCH_BATCH_SIZE]))))
+      group_of = {entity_id: n for n, group in enumerate(shown) for entity_id in group}
+      best = {}
+      for (first, second), score in pairs.items():
+          if first in group_of:
+              best[group_of[first]] = max(score, best.get(group_of[first], 0.0))
+      for n, group in enumerate(shown):
+          print(f'  score {best[n]:.2f}')
+          for entity_id in group:
+              listing_name, city, state = listings.get(entity_id, ('?', '?', '?'))
+              print(f'    {entity_id}  {listing_name} ({city}, {state})')
+
+app.cli.add_command(dedupe_cli)
+
+#----------------------------------------------------------------------------#
+# Show partitions.
+#----------------------------------------------------------------------------#
+
+# On Postgres "Show" is range-partitioned by start_time into monthly tables named
+# Show_pYYYY_MM, plus Show_default for anything outside them (see the migration).
+# Queries for upcoming shows only touch the current and future partitions.
+SHOW_PARTITION_NAME = re.compile(r'Show_p(\d{4})_(\d{2})')
+
+def add_months(day, months):
+  month = day.month - 1 + months
+  return date(day.year + month // 12, month % 12 + 1, 1)
+
+def show_partitions():
+  # {month: partition name} for the monthly partitions currently attached
+  names = db.session.execute(db.text(
+      'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+      'WHERE i.inhparent = \'"Show"\'::regclass'
+  )).scalars()
+  partitions = {}
+  for name in names:
+      match = SHOW_PARTITION_NAME.fullmatch(name)
+      if match:
+          partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+  return partitions
+
+def ensure_show_partitions(months_ahead=None):
+  # Creates the partitions for this month and the next months_ahead months. Rows that
+  # already landed in Show_default for a new month are moved into it before it is attached.
+  if db.engine.dialect.name != 'postgresql':
+      return []
+  if months_ahead is None:
+      months_ahead = app.config.get('SHOW_PARTITIONS_AHEAD', 3)
+  existing = show_partitions()
+  this_month = datetime.now().date().replace(day=1)
+  created = []
+  for offset in range(months_ahead + 1):
+      lower, upper = add_months(this_month, offset), add_months(this_month, offset + 1)
+      if lower in existing:
+          continue
+      name = f'Show_p{lower:%Y_%m}'
+      bounds = {'lower': lower, 'upper': upper}
+      db.session.execute(db.text(f'CREATE TABLE "{name}" (LIKE "Show" INCLUDING DEFAULTS)'))
+      db.session.execute(db.text(
+          f'WITH moved AS (DELETE FROM "Show_default" WHERE start_time >= :lower AND start_time < :upper RETURNING *) '
+          f'INSERT INTO "{name}" SELECT * FROM moved'
+      ), bounds)
+      db.session.execute(db.text(
+          f'ALTER TABLE "Show" ATTACH PARTITION "{name}" FOR VALUES FROM (\'{lower}\') TO (\'{upper}\')'
+      ))
+      db.session.commit()
+      created.append(name)
+  return created
+
+def archive_show_partitions(before, drop=False):
+  # Detaches every monthly partition that ends on or before `before` (a month start),
+  # keeping per venue/artist counts in show_archive_summary. Detached tables move to the
+  # show_archive schema, or are dropped with drop=True.
+  if db.engine.dialect.name != 'postgresql':
+      return []
+  archived = []
+  for month, name in sorted(show_partitions().items()):
+      if month >= before:
+          continue
+      db.session.execute(db.text(
+          f'INSERT INTO show_archive_summary (month, venue_id, artist_id, show_count) '
+          f'SELECT :month, venue_id, artist_id, count(*) FROM "{name}" GROUP BY venue_id, artist_id'
+      ), {'month': month})
+      db.session.execute(db.text(f'ALTER TABLE "Show" DETACH PARTITION "{name}"'))
+      if drop:
+          db.session.execute(db.text(f'DROP TABLE "{name}"'))
+      else:
+          db.session.execute(db.text('CREATE SCHEMA IF NOT EXISTS show_archive'))
+          db.session.execute(db.text(f'ALTER TABLE "{name}" SET SCHEMA show_archive'))
+      db.session.commit()
+      archived.append(name)
+  return archived
+
+shows_cli = AppGroup('shows', help='Maintain the partitioned Show table.')
+
+@shows_cli.command('partitions')
+@click.option('--ahead', type=int, default=None, help='Months to create ahead, SHOW_PARTITIONS_AHEAD by default.')
+def partitions_command(ahead):
+  if db.engine.dialect.name != 'postgresql':
+      print('Show partitioning needs Postgres; nothing to do.')
+      return
+  created = ensure_show_partitions(ahead)
+  print(f'Created {len(created)} partitions: {", ".join(created)}' if created else 'Partitions are up to date.')
+
+@shows_cli.command('archive')
+@click.option('--before', required=True, help='Archive partitions for months before YYYY-MM.')
+@click.option('--drop', is_flag=True, help='Drop detached partitions instead of keeping them in show_archive.')
+def archive_command(before, drop):
+  cutoff = datetime.strptime(before, '%Y-%m').date()
+  if cutoff > add_months(datetime.now().date().replace(day=1), -1):
+      raise click.BadParameter('Only months that have fully passed can be archived.', param_hint='--before')
+  archived = archive_show_partitions(cutoff, drop=drop)
+  print(f'Archived {len(archived)} partitions: {", ".join(archived)}' if archived else 'Nothing to archive.')
+
+app.cli.add_command(shows_cli)
+
+#----------------------------------------------------------------------------#
+# Snapshots.
+#----------------------------------------------------------------------------#
+
+# 'flask snapshot export' copies venues, artists, genres, shows and the projections
+# read alongside them (genre facets, trend scores, search documents) into a SQLite
+# file with the same schema, so every view runs on it unchanged. A node started with
+# READ_ONLY=1 opens that file immutable and memory-mapped instead of DATABASE_URL.
+#
+# The file records the outbox position it was exported at, and the source database
+# keeps a 'snapshot' outbox consumer at the same position, so pruning never removes
+# the events a later export needs. The next export then copies only the rows those
+# events name, into a copy of the previous file. Each export is built beside the
+# target and moved over it, so readers never see a half-written file.
+SNAPSHOT_CONSUMER = 'snapshot'
+SNAPSHOT_BATCH_SIZE = 1000
+# In dependency order. Association rows, facets, trend state, archive summaries and
+# series are small or change without outbox events; they are replaced on every export.
+SNAPSHOT_ENTITIES = ((Genre, 'genre'), (Venue, 'venue'), (Artist, 'artist'))
+SNAPSHOT_TABLES = (Genre.__table__, Venue.__table__, Artist.__table__, ShowSeries.__table__, Show.__table__,
+                   venue_genre_table, artist_genre_table, GenreFacet.__table__, ShowArchiveSummary.__table__,
+                   TrendState.__table__, SearchDocument.__table__)
+# POST views that only read, and so still work on a read-only node
+READ_ONLY_ENDPOINTS = {'search_venues', 'search_artists'}
+
+def copy_rows(target, table, criterion=None, upsert=False):
+  # Copies the source rows of table matching criterion into the snapshot connection,
+  # replacing rows with the same primary key when upsert is set
+  query = db.select(table)
+  if criterion is not None:
+      query = query.where(criterion)
+  statement = sqlite_insert(table)
+  if upsert:
+      statement = statement.on_conflict_do_update(
+          index_elements=list(table.primary_key.columns),
+          set_={column.name: statement.excluded[column.name] for column in table.columns if not column.primary_key})
+  copied = 0
+  for batch in stream_rows(query).partitions(SNAPSHOT_BATCH_SIZE):
+      target.execute(statement, [dict(row._mapping) for row in batch])
+      copied += len(batch)
+  return copied
+
+def replace_rows(target, table):
+  target.execute(db.delete(table))
+  return copy_rows(target, table)
+
+def snapshot_position(path):
+  # The outbox position recorded in the snapshot file, or None if there is no usable one
+  if not os.path.exists(path):
+      return None
+  try:
+      connection = sqlite3.connect(path)
+      try:
+          row = connection.execute('SELECT position FROM change_consumer WHERE name = ?', (SNAPSHOT_CONSUMER,)).fetchone()
+      finally:
+          connection.close()
+  except sqlite3.Error:
+      return None
+  return row[0] if row else None
+
+def export_full_snapshot(target):
+  target.exec_driver_sql('PRAGMA foreign_keys=OFF')
+  db.metadata.create_all(target)
+  return {table.name: copy_rows(target, table) for table in SNAPSHOT_TABLES}
+
+def apply_snapshot_changes(target, changes):
+  # Brings the snapshot's copies of the changed entities up to date with the source;
+  # rows gone from the source are deleted, and the snapshot's foreign keys cascade
+  # those deletes as the source's did
+  ids = {kind: set() for kind in SEARCH_KINDS}
+  for kind, op, entity_id, data in changes:
+      ids[kind].add(entity_id)
+  for model, kind in SNAPSHOT_ENTITIES:
+      if ids[kind]:
+          copy_rows(target, model.__table__, model.id.in_(ids[kind]), upsert=True)
+  copy_rows(target, ShowSeries.__table__, upsert=True)
+  if ids['show']:
+      copy_rows(target, Show.__table__, Show.id.in_(ids['show']), upsert=True)
+  for table, owner, kind in ((venue_genre_table, 'venue_id', 'venue'), (artist_genre_table, 'artist_id', 'artist')):
+      if ids[kind]:
+          target.execute(db.delete(table).where(table.c[owner].in_(ids[kind])))
+          copy_rows(target, table, table.c[owner].in_(ids[kind]))
+  for model, kind in ((Show, 'show'),) + tuple(reversed(SNAPSHOT_ENTITIES)):
+      if ids[kind]:
+          present = set(db.session.scalars(db.select(model.id).where(model.id.in_(ids[kind]))))
+          if ids[kind] - present:
+              target.execute(db.delete(model.__table__).where(model.id.in_(ids[kind] - present)))
+  gone = set(target.scalars(db.select(ShowSeries.id))) - set(db.session.scalars(db.select(ShowSeries.id)))
+  if gone:
+      target.execute(db.delete(ShowSeries.__table__).where(ShowSeries.id.in_(gone)))
+  reindex_search(target, ids['venue'], ids['artist'], ids['show'], ids['genre'])
+
+def update_snapshot_projections(target):
+  # Trend scores move with every decay without an outbox event, so all are copied over
+  for model in (Venue, Artist):
+      table = model.__table__
+      for batch in stream_rows(db.select(model.id, model.trend_score)).partitions(SNAPSHOT_BATCH_SIZE):
+          target.execute(db.update(table).where(table.c.id == bindparam('b_id')).values(trend_score=bindparam('b_score')),
+                         [{'b_id': entity_id, 'b_score': score} for entity_id, score in batch])
+  for table in (GenreFacet.__table__, ShowArchiveSummary.__table__, TrendState.__table__):
+      replace_rows(target, table)
+
+def export_snapshot(path, full=False):
+  # Writes the snapshot to path; returns ('full' or 'incremental', outbox position, events applied)
+  path = os.path.abspath(path)
+  building = path + '.building'
+  if os.path.exists(building):
+      os.remove(building)
+  tracked = db.session.scalar(db.select(ChangeConsumer.position).where(ChangeConsumer.name == SNAPSHOT_CONSUMER))
+  position = None if full or tracked is None else snapshot_position(path)
+  incremental = position is not None and position == tracked
+  # Events up to here may already be reflected in the rows copied below; applying them again is harmless
+  head = db.session.scalar(db.select(db.func.max(ChangeEvent.id))) or 0
+  if incremental:
+      shutil.copyfile(path, building)
+  engine = db.create_engine('sqlite:///' + building)
+  applied = 0
+  try:
+      with engine.connect() as target:
+          # The file is discarded if anything fails, so it needs no journal while building
+          target.exec_driver_sql('PRAGMA journal_mode=OFF')
+          target.exec_driver_sql('PRAGMA synchronous=OFF')
+          if incremental:
+              batch_size = app.config.get('OUTBOX_BATCH_SIZE', 500)
+              while True:
+                  events = fetch_changes(position, batch_size)
+                  if events:
+                      apply_snapshot_changes(target, [(kind, op, entity_id, data) for event_id, kind, op, entity_id, data in events])
+                      position = events[-1].id
+                      applied += len(events)
+                  if len(events) < batch_size:
+                      break
+              update_snapshot_projections(target)
+          else:
+              export_full_snapshot(target)
+              position = head
+          target.execute(db.delete(ChangeConsumer.__table__))
+          target.execute(db.insert(ChangeConsumer.__table__).values(
+              name=SNAPSHOT_CONSUMER, position=position, updated_at=datetime.now()))
+          target.commit()
+          target.exec_driver_sql('ANALYZE')
+          target.commit()
+          if not incremental:
+              # Full exports are packed tight; incremental ones reuse the free pages
+              target.exec_driver_sql('VACUUM')
+      db.session.rollback()
+  finally:
+      engine.dispose()
+  os.replace(building, path)
+
+  consumer = db.session.get(ChangeConsumer, SNAPSHOT_CONSUMER)
+  if consumer is None:
+      consumer = ChangeConsumer(name=SNAPSHOT_CONSUMER)
+      db.session.add(consumer)
+  consumer.position = position
+  consumer.updated_at = datetime.now()
+  db.session.commit()
+  return ('incremental' if incremental else 'full'), position, applied
+
+snapshot_files = {'identity': None, 'checked': 0}
+
+def snapshot_identity(path):
+  try:
+      status = os.stat(path)
+  except OSError:
+      return None
+  return status.st_ino, status.st_mtime_ns, status.st_size
+
+def reload_snapshot_if_replaced():
+  # A new export replaces the file. Pooled connections keep reading the one they opened,
+  # so drop them, and the in-process copies built from it, once a new file appears.
+  now = time.monotonic()
+  if now - snapshot_files['checked'] < app.config.get('SNAPSHOT_CHECK_INTERVAL', 5):
+      return
+  snapshot_files['checked'] = now
+  identity = snapshot_identity(app.config['SNAPSHOT_PATH'])
+  if identity is None or identity == snapshot_files['identity']:
+      return
+  if snapshot_files['identity'] is not None:
+      db.engine.dispose()
+      with read_model.lock:
+          read_model.loaded_at = None
+      list_facets_cache['rows'] = None
+      for index in (artists_seeking_venues, venues_seeking_talent):
+          with index.lock:
+              index.loaded_at = None
+      metrics.increment('snapshot_reloads_total')
+  snapshot_files['identity'] = identity
+
+@event.listens_for(Engine, 'connect')
+def map_snapshot(dbapi_connection, connection_record):
+  if app.config.get('READ_ONLY') and isinstance(dbapi_connection, sqlite3.Connection):
+      cursor = dbapi_connection.cursor()
+      cursor.execute('PRAGMA mmap_size=%d' % app.config.get('SNAPSHOT_MMAP_BYTES', 2 ** 30))
+      cursor.execute('PRAGMA query_only=ON')
+      cursor.close()
+
+@app.before_request
+def reject_writes_when_read_only():
+  if not app.config.get('READ_ONLY'):
+      return
+  reload_snapshot_if_replaced()
+  if request.method not in ('GET', 'HEAD', 'OPTIONS') and request.endpoint not in READ_ONLY_ENDPOINTS:
+      metrics.increment('read_only_rejections_total', method=request.method)
+      raise MethodNotAllowed(valid_methods=['GET', 'HEAD', 'OPTIONS'],
+                             description='This is a read-only copy of the site; changes are made on the main site.')
+
+snapshot_cli = AppGroup('snapshot', help='Export the SQLite snapshot read-only nodes serve.')
+
+@snapshot_cli.command('export')
+@click.argument('path', required=False)
+@click.option('--full', is_flag=True, help='Rebuild from scratch instead of applying the changes since the last export.')
+def export_snapshot_command(path, full):
+  if app.config.get('READ_ONLY'):
+      raise click.UsageError('Snapshots are exported from the main database, not on a read-only node.')
+  mode, position, applied = export_snapshot(path or app.config['SNAPSHOT_PATH'], full=full)
+  detail = f', {applied} changes applied' if mode == 'incremental' else ''
+  print(f'Exported a {mode} snapshot at outbox position {position}{detail}.')
+
+app.cli.add_command(snapshot_cli)
+
+#----------------------------------------------------------------------------#
+# Sitemaps.
+#----------------------------------------------------------------------------#
+
+# /sitemap.xml lists one sitemap file per kind and 50,000-id range (see sitemap.py).
+# Files are generated from a streamed query on first request and kept under
+# SITEMAP_CACHE_DIR; each sync follows the outbox and regenerates only the ranges
+# with changed venues or artists. A read-only node has no outbox, so there the
+# files are regenerated whenever a new snapshot arrives.
+SITEMAP_KINDS = {'venues': (Venue, 'show_venue', 'venue_id'), 'artists': (Artist, 'show_artist', 'artist_id')}
+SITEMAP_EVENT_KINDS = {'venue': 'venues', 'artist': 'artists'}
+sitemap_cache = None
+
+def get_sitemap_cache():
+  global sitemap_cache
+  if sitemap_cache is None:
+      sitemap_cache = sitemap.SitemapCache(app.config.get('SITEMAP_CACHE_DIR', os.path.join(app.root_path, 'sitemap_cache')))
+  return sitemap_cache
+
+def sitemap_chunk_stats(model, chunk=None):
+  # {chunk: (URL count, lastmod)} in one aggregate query, over one chunk's ids or all of them
+  number = (model.id - 1) // sitemap.URLS_PER_SITEMAP
+  query = db.select(number, db.func.count(), db.func.max(model.updated_at)).group_by(number)
+  if chunk is not None:
+      query = query.where(model.id.between(*sitemap.chunk_bounds(chunk)))
+  return {int(number): (count, sitemap.w3c_date(lastmod)) for number, count, lastmod in db.session.execute(query)}
+
+def sitemap_base_url():
+  return (app.config.get('SITEMAP_BASE_URL') or request.url_root).rstrip('/')
+
+def sitemap_source():
+  # What the files were generated from; when it changes they are all regenerated
+  if app.config.get('READ_ONLY'):
+      exported_at = db.session.scalar(db.select(ChangeConsumer.position).where(ChangeConsumer.name == SNAPSHOT_CONSUMER))
+      return f'{sitemap_base_url()} snapshot {exported_at}'
+  return sitemap_base_url()
+
+def rebuild_sitemap_state(cache, source):
+  position = 0 if app.config.get('READ_ONLY') else db.session.scalar(db.select(db.func.max(ChangeEvent.id))) or 0
+  state = {'source': source, 'position': position, 'synced_at': time.time(), 'kinds': {}}
+  for kind, (model, endpoint, id_arg) in SITEMAP_KINDS.items():
+      state['kinds'][kind] = {str(chunk): [count, lastmod, position]
+                              for chunk, (count, lastmod) in sitemap_chunk_stats(model).items()}
+  cache.save(state)
+  cache.prune(state)
+  return state
+
+def sync_sitemap_state(cache, state):
+  # Recounts the chunks named by outbox events since the state's position
+  batch_size = app.config.get('OUTBOX_BATCH_SIZE', 500)
+  dirty = {}
+  while True:
+      events = fetch_changes(state['position'], batch_size)
+      for event_id, kind, op, entity_id, data in events:
+          if kind in SITEMAP_EVENT_KINDS:
+              dirty[(SITEMAP_EVENT_KINDS[kind], sitemap.chunk_of(entity_id))] = event_id
+      if events:
+          state['position'] = events[-1].id
+      if len(events) < batch_size:
+          break
+  for (kind, chunk), version in dirty.items():
+      stats = sitemap_chunk_stats(SITEMAP_KINDS[kind][0], chunk)
+      if chunk in stats:
+          state['kinds'][kind][str(chunk)] = [*stats[chunk], version]
+      else:
+          state['kinds'][kind].pop(str(chunk), None)
+  # Saving every sync would rewrite the file on each request; an idle one only needs
+  # synced_at kept fresh, so the outbox check below stays valid
+  if dirty or time.time() - state['synced_at'] > 3600:
+      state['synced_at'] = time.time()
+      cache.save(state)
+      cache.prune(state)
+  return state
+
+def current_sitemaps():
+  cache = get_sitemap_cache()
+  with uncounted_queries():
+      state = cache.load()
+      source = sitemap_source()
+      # Events older than OUTBOX_RETAIN_DAYS may have been pruned; a state that old
+      # cannot tell which chunks changed
+      retain = app.config.get('OUTBOX_RETAIN_DAYS', 7) * 86400 / 2
+      if state is None or state.get('source') != source or time.time() - state['synced_at'] > retain:
+          return rebuild_sitemap_state(cache, source)
+      if app.config.get('READ_ONLY'):
+          return state
+      return sync_sitemap_state(cache, state)
+
+def sitemap_urls(kind, chunk):
+  # (loc, lastmod) for every entity in the chunk, read through a server-side cursor
+  model, endpoint, id_arg = SITEMAP_KINDS[kind]
+  # Built once: the id is the last segment of the entity's URL
+  prefix = sitemap_base_url() + url_for(endpoint, **{id_arg: 0})[:-1]
+  rows = stream_rows(db.select(model.id, model.updated_at)
+                     .where(model.id.between(*sitemap.chunk_bounds(chunk))).order_by(model.id))
+  return ((f'{prefix}{entity_id}', updated_at) for entity_id, updated_at in rows)
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+# name -> function(**payload), registered with @job('name')
+job_handlers = {}
+
+def job(name):
+  def register(func):
+      job_handlers[name] = func
+      return func
+  return register
+
+def enqueue(name, payload=None, run_at=None, max_attempts=5):
+  # Adds the job to the current session; it becomes visible when the caller commits,
+  # so a job and the change that needs it are written in one transaction
+  if name not in job_handlers:
+      raise ValueError(f'Unknown job {name}')
+  new_job = Job(name=name, payload=payload or {}, run_at=run_at or datetime.now(), max_attempts=max_attempts)
+  db.session.add(new_job)
+  return new_job
+
+def enqueue_during_flush(session, name, payload=None):
+  # As enqueue, for flush hooks, which cannot add objects to the session being flushed
+  if name not in job_handlers:
+      raise ValueError(f'Unknown job {name}')
+  session.execute(db.insert(Job).values(name=name, payload=payload or {}))
+
+def claim_jobs(limit, worker):
+  # SKIP LOCKED lets several workers poll the same queue without waiting on each other.
+  # SQLite ignores FOR UPDATE, so the claim itself is a conditional UPDATE that only
+  # one worker can win for each row.
+  now = datetime.now()
+  ids = db.session.execute(
+      db.select(Job.id).where(Job.status == 'queued', Job.run_at <= now)
+      .order_by(Job.run_at).limit(limit).with_for_update(skip_locked=True)
+  ).scalars().all()
+  if not ids:
+      db.session.rollback()
+      return []
+  claimed = db.session.execute(
+      db.update(Job).where(Job.id.in_(ids), Job.status == 'queued')
+      .values(status='running', attempts=Job.attempts + 1, started_at=now, heartbeat_at=now, worker=worker)
+      .returning(Job.id, Job.name, Job.payload, Job.attempts)
+      .execution_options(synchronize_session=False)
+  ).all()
+  db.session.commit()
+  return [tuple(row) for row in claimed]
+
+def retry_delay(attempts):
+  # Exponential backoff with a little jitter, capped at an hour
+  base = app.config.get('JOB_RETRY_BASE_SECONDS', 10)
+  delay = min(base * 2 ** (attempts - 1), 3600)
+  return timedelta(seconds=delay * random.uniform(1.0, 1.1))
+
+def finish_job(job_id, attempt, worker, duration_ms, error):
+  # Records the outcome of one attempt. A conditional UPDATE, like the claim: a run that
+  # was presumed lost and retried cannot close out the retry.
+  now = datetime.now()
+  values = {'finished_at': now, 'duration_ms': duration_ms, 'error': error}
+  if error is None:
+      values['status'] = 'done'
+  else:
+      values['status'] = db.case((Job.attempts >= Job.max_attempts, 'failed'), else_='queued')
+      values['run_at'] = db.case((Job.attempts >= Job.max_attempts, Job.run_at), else_=now + retry_delay(attempt))
+  result = db.session.execute(
+      db.update(Job).where(Job.id == job_id, Job.status == 'running', Job.worker == worker, Job.attempts == attempt)
+      .values(**values)
+      .execution_options(synchronize_session=False)
+  )
+  db.session.commit()
+  return result.rowcount == 1
+
+def beat(worker, job_ids):
+  # Tells the reaper in every worker that these jobs are still running here
+  db.session.execute(
+      db.update(Job).where(Job.id.in_(job_ids), Job.status == 'running', Job.worker == worker)
+      .values(heartbeat_at=datetime.now())
+      .execution_options(synchronize_session=False)
+  )
+  db.session.commit()
+
+def requeue_stalled_jobs():
+  # Jobs whose worker stopped sending heartbeats (it died) are retried like any other
+  # failure, with the same backoff; the lost run was counted as an attempt when it was
+  # claimed. A job that is merely slow keeps its heartbeat fresh and is left alone.
+  now = datetime.now()
+  cutoff = now - timedelta(seconds=app.config.get('JOB_LOST_SECONDS', 120))
+  stalled = db.and_(Job.status == 'running', db.func.coalesce(Job.heartbeat_at, Job.started_at) < cutoff)
+  lost = db.session.execute(db.select(Job.id, Job.attempts, Job.max_attempts).where(stalled)).all()
+  requeued = 0
+  for job_id, attempts, max_attempts in lost:
+      values = {'finished_at': now, 'error': 'Worker lost'}
+      if attempts >= max_attempts:
+          values['status'] = 'failed'
+      else:
+          values['status'] = 'queued'
+          values['run_at'] = now + retry_delay(attempts)
+      # Conditional again, in case the job sent a heartbeat since the SELECT
+      result = db.session.execute(
+          db.update(Job).where(stalled, Job.id == job_id, Job.attempts == attempts)
+          .values(**values)
+          .execution_options(synchronize_session=False)
+      )
+      requeued += result.rowcount
+  db.session.commit()
+  return requeued
+
+def init_job_process():
+  # Pool processes must not reuse connections inherited from the parent
+  with app.app_context():
+      db.engine.dispose(close=False)
+
+def run_job(job_id, name, payload):
+  # Runs inside a pool process; returns (job id, duration in ms, error or None)
+  started = time.perf_counter()
+  error = None
+  with app.app_context():
+      try:
+          job_handlers[name](**payload)
+      except Exception:
+          error = traceback.format_exc()
+          db.session.rollback()
+      finally:
+          db.session.remove()
+  return job_id, (time.perf_counter() - started) * 1000, error
+
+def work(processes, once=False):
+  worker = f'{socket.gethostname()}:{os.getpid()}'
+  poll_interval = app.config.get('JOB_POLL_INTERVAL', 1.0)
+  heartbeat_interval = app.config.get('JOB_HEARTBEAT_SECONDS', 15)
+  db.engine.dispose()
+  in_flight = {}  # future -> (job id, attempt)
+  last_reap = last_beat = 0
+  with ProcessPoolExecutor(processes, initializer=init_job_process) as pool:
+      while True:
+          if time.monotonic() - last_reap > 60:
+              requeue_stalled_jobs()
+              last_reap = time.monotonic()
+          if in_flight and time.monotonic() - last_beat > heartbeat_interval:
+              beat(worker, [job_id for job_id, attempt in in_flight.values()])
+              last_beat = time.monotonic()
+          if len(in_flight) < processes:
+              for job_id, name, payload, attempt in claim_jobs(processes - len(in_flight), worker):
+                  in_flight[pool.submit(run_job, job_id, name, payload)] = (job_id, attempt)
+          if not in_flight:
+              if once:
+                  return
+              time.sleep(poll_interval)
+              continue
+          done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+          for future in done:
+              job_id, attempt = in_flight.pop(future)
+              try:
+                  job_id, duration_ms, error = future.result()
+              except Exception:
+                  duration_ms, error = None, traceback.format_exc()
+              finish_job(job_id, attempt, worker, duration_ms, error)
+
+def job_json(queued):
+  return {
+      "id": queued.id,
+      "name": queued.name,
+      "payload": queued.payload,
+      "status": queued.status,
+      "attempts": queued.attempts,
+      "max_attempts": queued.max_attempts,
+      "run_at": queued.run_at.isoformat(),
+      "created_at": queued.created_at.isoformat(),
+      "started_at": queued.started_at and queued.started_at.isoformat(),
+      "heartbeat_at": queued.heartbeat_at and queued.heartbeat_at.isoformat(),
+      "finished_at": queued.finished_at and queued.finished_at.isoformat(),
+      "duration_ms": queued.duration_ms,
+      "worker": queued.worker,
+      "error": queued.error
+  }
+
+@job('refresh_genre_facets')
+def refresh_genre_facets_job():
+  refresh_genre_facets()
+
+@job('prune_change_events')
+def prune_change_events_job(retain_days=None):
+  prune_changes(retain_days)
+
+@job('rebuild_search_index')
+def rebuild_search_index_job():
+  rebuild_search_index()
+
+@job('reindex_show_documents')
+def reindex_show_documents_job(venue_ids=(), artist_ids=()):
+  reindex_show_documents(db.session, venue_ids, artist_ids)
+  db.session.commit()
+
+@job('decay_trend_scores')
+def decay_trend_scores_job():
+  decay_trend_scores()
+
+@job('ensure_show_partitions')
+def ensure_show_partitions_job(months_ahead=None):
+  ensure_show_partitions(months_ahead)
+
+jobs_cli = AppGroup('jobs', help='Run and queue background jobs.')
+
+@jobs_cli.command('work')
+@click.option('--processes', type=int, default=None, help='Pool size, JOB_WORKER_PROCESSES by default.')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty.')
+def work_command(processes, once):
+  work(processes or app.config.get('JOB_WORKER_PROCESSES') or os.cpu_count(), once=once)
+
+@jobs_cli.command('enqueue')
+@click.argument('name')
+@click.option('--payload', default='{}', help='Keyword arguments for the job, as JSON.')
+def enqueue_command(name, payload):
+  queued = enqueue(name, json.loads(payload))
+  db.session.commit()
+  print(f'Queued job {queued.id} ({name}).')
+
+app.cli.add_command(jobs_cli)
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -119,53 +1922,493 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def image_signature(url, size):
+  # Only URLs the app itself rendered are proxied, so the endpoint cannot be pointed anywhere
+  secret = app.config['SECRET_KEY']
+  secret = secret if isinstance(secret, bytes) else secret.encode()
+  digest = hmac.new(secret, f'{size}\n{url}'.encode(), 'sha256').digest()
+  return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+def thumbnail_url(url, size='tile'):
+  # {{ artist.image_link|thumbnail('detail') }}: a resized copy served by /img
+  if not url or not app.config.get('IMAGE_PROXY_ENABLED') or not url.startswith(('http://', 'https://')):
+      return url
+  return url_for('image_thumbnail', size=size, signature=image_signature(url, size), u=url)
+
+app.jinja_env.filters['thumbnail'] = thumbnail_url
+
+#----------------------------------------------------------------------------#
+# Templates.
+#----------------------------------------------------------------------------#
+
+# Compiled templates are kept in TEMPLATE_CACHE_DIR across restarts and shared by all
+# workers, so a fresh worker loads bytecode instead of compiling on its first requests.
+# 'flask templates compile' fills it at build time, and wsgi.py loads every template
+# into the gunicorn master before it forks.
+if app.config.get('TEMPLATE_CACHE_DIR'):
+  os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+  app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+def preload_templates():
+  # Compile, or load from the bytecode cache, every page template into memory
+  names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+  for name in names:
+      app.jinja_env.get_template(name)
+  # The datetime filter's locale data is loaded on first use too
+  format_datetime(str(datetime.now()), 'full')
+  return names
+
+templates_cli = AppGroup('templates', help='Precompile templates into the bytecode cache.')
+
+@templates_cli.command('compile')
+def compile_templates_command():
+  cache = app.jinja_env.bytecode_cache
+  if cache is None:
+      raise click.ClickException('TEMPLATE_CACHE_DIR is not set.')
+  # Drop bytecode of templates that were changed or removed, then compile them all afresh
+  cache.clear()
+  app.jinja_env.cache.clear()
+  names = preload_templates()
+  print(f'Compiled {len(names)} templates into {app.config["TEMPLATE_CACHE_DIR"]}.')
+
+app.cli.add_command(templates_cli)
+
+#----------------------------------------------------------------------------#
+# Streaming.
+#----------------------------------------------------------------------------#
+
+# Template output is sent in chunks of this many rendered fragments
+STREAM_BUFFER_SIZE = 40
+# Rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = 500
+
+def stream_rows(statement):
+  # yield_per opens a server-side cursor on Postgres, so rows arrive in batches
+  # instead of being materialized up front
+  return db.session.execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+def stream_page(template_name, **context):
+  # Like render_template, but the page goes out while the row generators in the
+  # context are still being consumed. Templates must not test those generators for
+  # truthiness; use {% for %}...{% else %} instead.
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(STREAM_BUFFER_SIZE)
+  return Response(stream_with_context(stream), mimetype='text/html')
+
+#----------------------------------------------------------------------------#
+# Profiling.
+#----------------------------------------------------------------------------#
+
+# With PROFILER_ENABLED, a request carrying X-Profile (1, sample or trace) plus a
+# valid admin token, or a PROFILER_SAMPLE_RATE fraction of all requests, is run
+# under the profiler. Nothing below is registered when profiling is off.
+profiling = threading.local()
+
+def start_profile():
+  mode = request.headers.get('X-Profile')
+  if mode and admin_authorized():
+      mode = mode if mode in profiler.PROFILES else app.config.get('PROFILER_MODE', 'sample')
+  elif random.random() < app.config.get('PROFILER_SAMPLE_RATE', 0):
+      mode = app.config.get('PROFILER_MODE', 'sample')
+  else:
+      return
+  profiling.profile = profiler.PROFILES[mode](threading.get_ident(), app.config.get('PROFILER_INTERVAL', 0.005),
+                                              request.endpoint or 'unknown').start()
+
+def finish_profile(response):
+  profile = getattr(profiling, 'profile', None)
+  if profile is None:
+      return response
+  meta = {"method": request.method, "path": request.full_path, "endpoint": request.endpoint}
+  def save():
+      # Streamed pages render while the body is sent, so stop only once it is closed
+      profiling.profile = None
+      profile.stop()
+      meta["status"] = response.status_code
+      profile.save(app.config['PROFILER_DIR'], meta, app.config.get('PROFILER_KEEP'))
+  response.call_on_close(save)
+  response.headers['X-Profile-Name'] = profile.name
+  return response
+
+def time_profiled_query(conn, cursor, statement, parameters, context, executemany):
+  if getattr(profiling, 'profile', None) is not None:
+      conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+def record_profiled_query(conn, cursor, statement, parameters, context, executemany):
+  profile = getattr(profiling, 'profile', None)
+  if profile is not None and conn.info.get('profile_query_start'):
+      profile.add_query(statement, parameters, time.perf_counter() - conn.info['profile_query_start'].pop())
+
+if app.config.get('PROFILER_ENABLED'):
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    event.listen(Engine, 'before_cursor_execute', time_profiled_query)
+    event.listen(Engine, 'after_cursor_execute', record_profiled_query)
+
+#----------------------------------------------------------------------------#
+# Memory tracing.
+#----------------------------------------------------------------------------#
+
+# With MEMORY_TRACE_ENABLED, a MEMORY_TRACE_SAMPLE_RATE fraction of requests, or one
+# carrying X-Memory-Trace plus a valid admin token, runs under tracemalloc (see
+# memtrace.py). Peaks and retained allocations add up per endpoint and source line
+# at /_memory and in /_metrics. Nothing below is registered when tracing is off.
+memory_tracker = memtrace.MemoryTracker(app.root_path, frames=app.config.get('MEMORY_TRACE_FRAMES', 25))
+memory_tracing = threading.local()
+
+def start_memory_trace():
+  memory_tracing.trace = None
+  if not (request.headers.get('X-Memory-Trace') and admin_authorized()) \
+          and random.random() >= app.config.get('MEMORY_TRACE_SAMPLE_RATE', 0):
+      return
+  memory_tracing.trace = memory_tracker.begin(request.endpoint or 'unknown')
+  memory_tracing.handed_off = False
+
+def checkpoint_memory_trace(sender, template, context, **extra):
+  # A rendered page and everything in its context are alive here, usually the most
+  # a view holds at once
+  trace = getattr(memory_tracing, 'trace', None)
+  if trace is not None:
+      trace.checkpoint()
+
+def finish_memory_trace(response):
+  trace = getattr(memory_tracing, 'trace', None)
+  if trace is None:
+      return response
+  trace.checkpoint()
+  memory_tracing.handed_off = True
+  def finish():
+      # Streamed pages allocate while the body is sent, so stop only once it is closed
+      memory_tracing.trace = None
+      record_memory_trace(trace)
+  response.call_on_close(finish)
+  return response
+
+def abandon_memory_trace(exc):
+  # A request that never produced a response must still release tracemalloc
+  trace = getattr(memory_tracing, 'trace', None)
+  if trace is not None and not memory_tracing.handed_off:
+      memory_tracing.trace = None
+      record_memory_trace(trace)
+
+def record_memory_trace(trace):
+  stats = memory_tracker.end(trace)
+  metrics.increment('memory_traced_requests_total', endpoint=trace.endpoint)
+  metrics.set('memory_peak_max_bytes', stats['peak_max'], endpoint=trace.endpoint)
+  metrics.set('memory_retained_mean_bytes', stats['retained_total'] // stats['samples'], endpoint=trace.endpoint)
+  metrics.set('process_resident_bytes', memtrace.resident_bytes())
+
+if app.config.get('MEMORY_TRACE_ENABLED'):
+    app.before_request(start_memory_trace)
+    app.after_request(finish_memory_trace)
+    app.teardown_request(abandon_memory_trace)
+    template_rendered.connect(checkpoint_memory_trace, app)
+
+#----------------------------------------------------------------------------#
+# Query budgets.
+#----------------------------------------------------------------------------#
+
+# Views declare the most SQL statements (and optionally database milliseconds) a
+# request may use with @query_budget; the rest get QUERY_BUDGET_DEFAULT. With
+# QUERY_BUDGET_MODE 'log' an overrun is logged as an error, with 'raise' (for tests)
+# the request fails with QueryBudgetExceeded. Either way the report lists the
+# statements that repeated, which is how a per-row query shows up.
+query_budgets = {}
+query_counting = threading.local()
+
+def query_budget(queries, ms=None):
+  def register(view):
+      query_budgets[view.__name__] = querybudget.Budget(queries, ms)
+      return view
+  return register
+
+@contextmanager
+def uncounted_queries():
+  # For cache rebuilds (read model, match index) that one request pays for on behalf of many
+  log = getattr(query_counting, 'log', None)
+  if log is not None:
+      log.paused += 1
+  try:
+      yield
+  finally:
+      if log is not None:
+          log.paused -= 1
+
+def start_query_log():
+  query_counting.log = querybudget.QueryLog()
+
+def check_query_budget(log, endpoint, label):
+  budget = query_budgets.get(endpoint) or querybudget.Budget(app.config.get('QUERY_BUDGET_DEFAULT', 20), None)
+  if not log.exceeds(budget):
+      return
+  metrics.increment('query_budget_overruns_total', endpoint=endpoint)
+  report = log.report(label, budget)
+  if app.config.get('QUERY_BUDGET_MODE') == 'raise':
+      raise QueryBudgetExceeded(report)
+  app.logger.error(report)
+
+def check_response_query_budget(response):
+  log = getattr(query_counting, 'log', None)
+  if log is None or request.endpoint is None:
+      return response
+  label = f'{request.method} {request.path} ({request.endpoint})'
+  if not response.is_streamed:
+      check_query_budget(log, request.endpoint, label)
+      return response
+  # Streamed pages keep querying while they are sent: check once the body is done
+  log.streaming = True
+  def finish():
+      if getattr(query_counting, 'log', None) is log:
+          query_counting.log = None
+      check_query_budget(log, request_endpoint, label)
+  request_endpoint = request.endpoint
+  response.call_on_close(finish)
+  return response
+
+def finish_query_log(error=None):
+  log = getattr(query_counting, 'log', None)
+  if log is not None and not log.streaming:
+      query_counting.log = None
+
+def time_budgeted_query(conn, cursor, statement, parameters, context, executemany):
+  if getattr(query_counting, 'log', None) is not None:
+      conn.info.setdefault('budget_query_start', []).append(time.perf_counter())
+
+def record_budgeted_query(conn, cursor, statement, parameters, context, executemany):
+  log = getattr(query_counting, 'log', None)
+  if log is not None and conn.info.get('budget_query_start'):
+      log.add(statement, time.perf_counter() - conn.info['budget_query_start'].pop())
+
+if app.config.get('QUERY_BUDGET_MODE', 'off') != 'off':
+    app.before_request(start_query_log)
+    app.after_request(check_response_query_budget)
+    app.teardown_request(finish_query_log)
+    event.listen(Engine, 'before_cursor_execute', time_budgeted_query)
+    event.listen(Engine, 'after_cursor_execute', record_budgeted_query)
+
+#----------------------------------------------------------------------------#
+# Admission control.
+#----------------------------------------------------------------------------#
+
+# Searches are the heaviest requests a client can trigger at will. A view marked
+# @admission_controlled spends a token from the client's bucket and holds one of
+# SEARCH_MAX_CONCURRENT slots shared by every worker on the host (see admission.py).
+# Without either it is answered at once, before any query: 429 for a client over its
+# rate, 503 when the host is busy.
+search_admission = None
+
+def get_search_admission():
+  global search_admission
+  if search_admission is None:
+      search_admission = admission.Admission(
+          app.config.get('ADMISSION_PATH', os.path.join(app.root_path, '.admission')),
+          rate=app.config.get('SEARCH_RATE_PER_MINUTE', 30) / 60.0,
+          burst=app.config.get('SEARCH_BURST', 10),
+          max_concurrent=app.config.get('SEARCH_MAX_CONCURRENT', 8))
+  return search_admission
+
+def admission_client():
+  # The client's address; behind ADMISSION_PROXY_HOPS trusted proxies, the one the
+  # outermost proxy saw
+  hops = app.config.get('ADMISSION_PROXY_HOPS', 0)
+  if not hops:
+      return request.remote_addr or ''
+  route = request.access_route
+  return route[-hops] if len(route) >= hops else route[0]
+
+def refuse_admission(status, message, retry_after):
+  response = Response(message + '\n', status, mimetype='text/plain')
+  response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+  return response
+
+def admission_controlled(view):
+  @functools.wraps(view)
+  def admitted_view(*args, **kwargs):
+      if not app.config.get('ADMISSION_ENABLED', True):
+          return view(*args, **kwargs)
+      gate = get_search_admission()
+      admitted, retry_after = gate.take(admission_client())
+      if not admitted:
+          metrics.increment('admission_rejected_total', endpoint=request.endpoint, reason='rate')
+          return refuse_admission(429, 'Too many searches; try again shortly.', retry_after)
+      slot = gate.acquire()
+      if slot is None:
+          metrics.increment('admission_rejected_total', endpoint=request.endpoint, reason='busy')
+          return refuse_admission(503, 'Search is busy; try again shortly.', 1)
+      metrics.increment('admission_admitted_total', endpoint=request.endpoint)
+      metrics.set('admission_in_flight', gate.in_flight())
+      try:
+          return view(*args, **kwargs)
+      finally:
+          gate.release(slot)
+          metrics.set('admission_in_flight', gate.in_flight())
+  return admitted_view
+
+#----------------------------------------------------------------------------#
+# Compression.
+#----------------------------------------------------------------------------#
+
+# HTML, JSON and CSS go out brotli- or gzip-compressed, streamed pages included: each
+# chunk the template stream produces is compressed and flushed as it arrives.
+def record_compression(encoding, bytes_in, bytes_out):
+  metrics.increment('http_compressed_responses_total', encoding=encoding)
+  metrics.increment('http_compression_bytes_in_total', bytes_in, encoding=encoding)
+  metrics.increment('http_compression_bytes_out_total', bytes_out, encoding=encoding)
+  metrics.increment('http_compression_bytes_saved_total', bytes_in - bytes_out, encoding=encoding)
+
+if app.config.get('COMPRESSION_ENABLED'):
+    app.wsgi_app = compression.CompressionMiddleware(
+        app.wsgi_app, minimum_size=app.config.get('COMPRESSION_MIN_SIZE', 1024),
+        level=app.config.get('COMPRESSION_LEVEL', 6),
+        brotli_quality=app.config.get('COMPRESSION_BROTLI_QUALITY', 5),
+        record=record_compression)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
+def home_page():
+  limit = app.config.get('TRENDING_HOME_LIMIT', 5)
+  landmark = current_trend_landmark()
+  return render_template('pages/home.html', trending_venues=trending_entities('venue', limit, landmark),
+                         trending_artists=trending_entities('artist', limit, landmark))
+
 @app.route('/')
+@query_budget(3)
 def index():
-  return render_template('pages/home.html')
+  return home_page()
+
+#  Trending
+#  ----------------------------------------------------------------
+
+def trending_json(rows, id_key):
+  return [{
+      id_key: entity_id,
+      "name": name,
+      "city": city,
+      "state": state,
+      "image_link": image_link,
+      "score": round(score, 3)
+  } for entity_id, name, city, state, image_link, score in rows]
+
+@app.route('/trending')
+@query_budget(3)
+def trending_list():
+  # ?kind=venue or artist for one list; limit up to 100
+  limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+  kinds = [request.args['kind']] if request.args.get('kind') in ('venue', 'artist') else ['venue', 'artist']
+  landmark = current_trend_landmark()
+  return jsonify({kind + 's': trending_json(trending_entities(kind, limit, landmark), kind + '_id') for kind in kinds})
+
+#  Search
+#  ----------------------------------------------------------------
+
+SEARCH_PER_PAGE = 20
+
+def search_result_url(kind, entity_id, venue_id, title):
+  if kind == 'venue':
+      return url_for('show_venue', venue_id=entity_id)
+  if kind == 'artist':
+      return url_for('show_artist', artist_id=entity_id)
+  if kind == 'show':
+      return url_for('show_venue', venue_id=venue_id)
+  return url_for('artists', genre=title)
+
+def name_search(model, show_owner, search_term):
+  # The venue or artist search pages' results: up to SEARCH_RESULT_CAP name matches with
+  # their upcoming show counts. Terms under SEARCH_MIN_TERM_LENGTH characters match
+  # nearly every row, so they are not searched at all.
+  minimum = app.config.get('SEARCH_MIN_TERM_LENGTH', 2)
+  if len(search_term) < minimum:
+      metrics.increment('search_short_term_total', endpoint=request.endpoint)
+      return {"count": 0, "more": False, "data": [], "notice": f'Enter at least {minimum} characters to search.'}
+  cap = app.config.get('SEARCH_RESULT_CAP', 50)
+  # LIKE wildcards in the term are matched literally; '%%' must not list everything
+  pattern = '%' + re.sub(r'([\\%_])', r'\\\1', search_term) + '%'
+  # Counted per result row, which the limit keeps few, through the (owner, start_time) index
+  upcoming = db.select(db.func.count(Show.id)) \
+      .where(show_owner == model.id, Show.start_time > datetime.now()).scalar_subquery()
+  rows = db.session.execute(
+      db.select(model.id, model.name, upcoming)
+      .where(model.name.ilike(pattern, escape='\\')).order_by(model.name, model.id).limit(cap + 1)
+  ).all()
+  if len(rows) > cap:
+      metrics.increment('search_results_capped_total', endpoint=request.endpoint)
+  return {
+    "count": min(len(rows), cap),
+    "more": len(rows) > cap,
+    "data": [{
+      "id": entity_id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming
+    } for entity_id, name, num_upcoming in rows[:cap]]
+  }
+
+@app.route('/search')
+@query_budget(3)
+@admission_controlled
+def search_all():
+  # GET /search?q=jazz+san+francisco+next+week[&type=show][&page=2]
+  text = request.args.get('q', '').strip()
+  kind = request.args.get('type') or None
+  page = max(request.args.get('page', 1, type=int), 1)
+  if kind and kind not in SEARCH_KINDS:
+      abort(400)
+  rows, has_next = search_documents(text, kind, page, SEARCH_PER_PAGE) if text else ([], False)
+  data = {
+      "q": text,
+      "type": kind,
+      "page": page,
+      "has_next": has_next,
+      "results": [{
+          "kind": row_kind,
+          "id": entity_id,
+          "title": title,
+          "subtitle": subtitle,
+          "start_time": starts_at.strftime('%Y-%m-%d %H:%M:%S') if starts_at else None,
+          "url": search_result_url(row_kind, entity_id, venue_id, title),
+          "rank": float(rank)
+      } for row_kind, entity_id, venue_id, artist_id, title, subtitle, starts_at, rank in rows]
+  }
+  if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+      return jsonify(data)
+  return render_template('pages/search.html', search=data, kinds=SEARCH_KINDS)
 
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@query_budget(4)
 def venues():
   # COMPLETE: replace with real venues data.
-  # Get data on the venues and populate the data list (grouped per city)
-  venues = Venue.query.all() 
-  # Initialize dictionary where city, state, and venues are keys
-  data = []   
-  cities_states = set()
-
-  for venue in venues:
-    cities_states.add((venue.city, venue.state)) 
-  cities_states = list(cities_states)
-  cities_states.sort(key=itemgetter(1,0))
-  now = datetime.now()    
-
-  # Now iterate over the unique values to seed the data dictionary with city/state locations
-  for loc in cities_states:
-    venues_list = []
-    for venue in venues:
-      if (venue.city == loc[0]) and (venue.state == loc[1]):
-        venue_shows = Show.query.filter_by(venue_id=venue.id).all()
-        num_upcoming = 0
-        for show in venue_shows:
-          if show.start_time > now:
-            num_upcoming += 1
-          venues_list.append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": num_upcoming
-          })
-    data.append({
-      "city": loc[0],
-      "state": loc[1],
-      "venues": venues_list
-    })
-  return render_template('pages/venues.html', areas=data)
+  # One query: venues ordered by location, with their upcoming show counts (grouped per city below)
+  genre = request.args.get('genre')
+  model = current_read_model()
+  if model is not None and not genre:
+      return stream_page('pages/venues.html', areas=model.venue_areas(int(time.time())), facets=list_facets(), genre=genre)
+
+  upcoming = db.select(Show.venue_id, db.func.count(Show.id).label('num_upcoming')) \
+      .where(Show.start_time > datetime.now()).group_by(Show.venue_id).subquery()
+  query = db.select(Venue.id, Venue.name, Venue.city, Venue.state, db.func.coalesce(upcoming.c.num_upcoming, 0)) \
+      .outerjoin(upcoming, upcoming.c.venue_id == Venue.id) \
+      .order_by(Venue.state, Venue.city, Venue.name)
+  if genre:
+      query = query.where(Venue.genres.any(Genre.name == genre))
+
+  facets = genre_facets()
+  # Rows arrive ordered by location, so each area is a lazy group of the cursor
+  rows = stream_rows(query)
+  data = ({
+    "city": city,
+    "state": state,
+    "venues": ({
+      "id": venue_id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming
+    } for venue_id, name, _, _, num_upcoming in area)
+  } for (city, state), area in groupby(rows, key=itemgetter(2, 3)))
+  return stream_page('pages/venues.html', areas=data, facets=facets, genre=genre)
 
   # Original info:
   # data=[{
@@ -191,26 +2434,16 @@ def venues():
   # }]
 
 @app.route('/venues/search', methods=['POST'])
+@query_budget(3)
+@admission_controlled
 def search_venues():
   # COMPLETE: implement search on artists with partial string search. Ensure it is case-insensitive.
-  search_term = request.form.get('search_term', '')
-  search_result = db.session.query(Venue).filter(Venue.name.ilike(f'%{search_term}%')).all()
-  data = []
-
-  for result in search_result:
-    data.append({
-      "id": result.id,
-      "name": result.name,
-      "num_upcoming_shows": len(db.session.query(Show).filter(Show.venue_id == result.id).filter(Show.start_time > datetime.now()).all()),
-    })
-  
-  response={
-    "count": len(search_result),
-    "data": data
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  search_term = request.form.get('search_term', '').strip()
+  response = name_search(Venue, Show.venue_id, search_term)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@query_budget(8)
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # COMPLETE: replace with real venue data from the venues table, using venue_id
@@ -219,32 +2452,12 @@ def show_venue(venue_id):
   if not venue: 
     return render_template('errors/404.html')
 
-  upcoming_shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id).filter(Show.start_time>datetime.now()).all()
-  upcoming_shows = []
-
-  past_shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id).filter(Show.start_time<datetime.now()).all()
-  past_shows = []
-
-  for show in past_shows_query:
-    past_shows.append({
-      "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-    })
-
-  for show in upcoming_shows_query:
-    upcoming_shows.append({
-      "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": show.start_time.strftime("%Y-%m-%d %H:%M:%S")    
-    })
+  upcoming_shows, past_shows, past_shows_count = show_windows(Show.venue_id, venue_id)
 
   data = {
     "id": venue.id,
     "name": venue.name,
-    "genres": venue.genres,
+    "genres": [genre.name for genre in venue.genres],
     "address": venue.address,
     "city": venue.city,
     "state": venue.state,
@@ -256,11 +2469,123 @@ def show_venue(venue_id):
     "image_link": venue.image_link,
     "past_shows": past_shows,
     "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
+    "past_shows_count": past_shows_count,
     "upcoming_shows_count": len(upcoming_shows),
   }
 
   return render_template('pages/show_venue.html', venue=data)
+
+NEARBY_MAX_RADIUS_KM = 200
+NEARBY_MAX_RESULTS = 100
+NEARBY_SHOWS_PER_VENUE = 3
+
+NEARBY_FIRST_RING_KM = 1
+
+def venues_within(lat, lng, radius_km):
+  # Venues within radius_km as (distance_km, id, name, city, state). Only venues in
+  # the geohash cells covering the circle are read (one indexed range per cell), and
+  # exact distances are computed for those candidates alone.
+  ranges = []
+  for cell in geo.covering_cells(lat, lng, radius_km):
+      upper = geo.prefix_upper_bound(cell)
+      ranges.append(db.and_(Venue.geohash >= cell, Venue.geohash < upper) if upper else Venue.geohash >= cell)
+  candidates = db.session.execute(
+      db.select(Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude).where(or_(*ranges))
+  )
+  found = []
+  for venue_id, name, city, state, venue_lat, venue_lng in candidates:
+      distance = geo.haversine_km(lat, lng, venue_lat, venue_lng)
+      if distance <= radius_km:
+          found.append((distance, venue_id, name, city, state))
+  return found
+
+def nearby_venues(lat, lng, radius_km, limit):
+  # The nearest `limit` venues within radius_km, nearest first. Searches a small circle
+  # first and widens it 4x at a time: once a circle holds `limit` venues nothing outside
+  # it can be nearer, so dense city centres never read the whole radius.
+  ring = min(radius_km, NEARBY_FIRST_RING_KM)
+  while True:
+      found = venues_within(lat, lng, ring)
+      if len(found) >= limit or ring >= radius_km:
+          found.sort()
+          return found[:limit]
+      ring = min(radius_km, ring * 4)
+
+def upcoming_shows_by_venue(venue_ids, per_venue):
+  # The next per_venue shows at each venue, in one windowed query
+  if not venue_ids:
+      return {}
+  rank = db.func.row_number().over(partition_by=Show.venue_id, order_by=(Show.start_time, Show.id)).label('rank')
+  upcoming = db.select(Show.venue_id, Show.artist_id, Show.start_time, rank) \
+      .where(Show.venue_id.in_(venue_ids), Show.start_time > datetime.now()).subquery()
+  rows = db.session.execute(
+      db.select(upcoming.c.venue_id, upcoming.c.artist_id, Artist.name, Artist.image_link, upcoming.c.start_time)
+      .join(Artist, Artist.id == upcoming.c.artist_id)
+      .where(upcoming.c.rank <= per_venue)
+      .order_by(upcoming.c.venue_id, upcoming.c.start_time)
+  )
+  shows = {}
+  for venue_id, artist_id, artist_name, artist_image_link, start_time in rows:
+      shows.setdefault(venue_id, []).append({
+          "artist_id": artist_id,
+          "artist_name": artist_name,
+          "artist_image_link": artist_image_link,
+          "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')
+      })
+  return shows
+
+@app.route('/venues/nearby')
+@query_budget(10)
+def venues_nearby():
+  # GET /venues/nearby?lat=37.77&lng=-122.42&radius_km=10&limit=20
+  lat = request.args.get('lat', type=float)
+  lng = request.args.get('lng', type=float)
+  radius_km = request.args.get('radius_km', 10, type=float)
+  limit = request.args.get('limit', 20, type=int)
+  if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+      abort(400)
+  if not (0 < radius_km <= NEARBY_MAX_RADIUS_KM) or not (0 < limit <= NEARBY_MAX_RESULTS):
+      abort(400)
+
+  venues = nearby_venues(lat, lng, radius_km, limit)
+  shows = upcoming_shows_by_venue([venue_id for _, venue_id, _, _, _ in venues], NEARBY_SHOWS_PER_VENUE)
+  return jsonify({
+      "lat": lat,
+      "lng": lng,
+      "radius_km": radius_km,
+      "venues": [{
+          "id": venue_id,
+          "name": name,
+          "city": city,
+          "state": state,
+          "distance_km": round(distance, 3),
+          "upcoming_shows": shows.get(venue_id, [])
+      } for distance, venue_id, name, city, state in venues]
+  })
+
+@app.route('/venues/<int:venue_id>/calendar')
+@query_budget(4)
+def venue_calendar(venue_id):
+  venue = Venue.query.get(venue_id)
+  if not venue:
+    abort(404)
+  return show_calendar(venue, Show.venue_id)
+
+@app.route('/venues/<int:venue_id>/matches')
+@query_budget(3)
+def venue_matches(venue_id):
+  # Artists seeking venues, ranked by shared genres, location and recent shows
+  venue = Venue.query.get(venue_id)
+  if not venue:
+    abort(404)
+  source = MatchEntry(venue.id, venue.name, venue.city, venue.state, [genre.name for genre in venue.genres])
+  k = max(1, min(request.args.get('k', 10, type=int), 100))
+  matches = match_index_for(Artist).top(source, k)
+  return jsonify({
+    "venue_id": venue.id,
+    "matches": match_response(matches, "artist_id")
+  })
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -270,6 +2595,7 @@ def create_venue_form():
   return render_template('forms/new_venue.html', form=form)
 
 @app.route('/venues/create', methods=['POST'])
+@query_budget(30)
 def create_venue_submission():
   # COMPLETE: insert form data as a new Venue record in the db, instead
   form = VenueForm()
@@ -293,19 +2619,22 @@ def create_venue_submission():
       return redirect(url_for('create_venue_submission'))
 
   else:
+      record = dedupe_record(None, name, city, state, phone)
+      existing = find_duplicate(Venue, record)
+      if existing:
+          flash(f'{existing.name} in {city} is already listed.')
+          return redirect(url_for('show_venue', venue_id=existing.id))
+      if not request.form.get('confirm_duplicate'):
+          duplicates = near_duplicates(Venue, record)
+          if duplicates:
+              return render_template('forms/new_venue.html', form=form, duplicates=duplicates)
+
       error_in_insert = False
       try:
           new_venue = Venue(name=name, city=city, state=state, address=address, phone=phone, \
               seeking_talent=seeking_talent, seeking_description=seeking_description, image_link=image_link, \
-              website=website, facebook_link=facebook_link)
-          for genre in genres:
-              fetch_genre = Genre.query.filter_by(name=genre).one_or_none() 
-              if fetch_genre:
-                  new_venue.genres.append(fetch_genre)
-              else:
-                  new_genre = Genre(name=genre)
-                  db.session.add(new_genre)
-                  new_venue.genres.append(new_genre) 
+              website=website, facebook_link=facebook_link, latitude=form.latitude.data, longitude=form.longitude.data)
+          new_venue.genres = genres_named(genres)
           db.session.add(new_venue)
           db.session.commit()
       except Exception as e:
@@ -323,106 +2652,95 @@ def create_venue_submission():
           print("Error in create_venue_submission()")
           abort(500)
 
-@app.route('/venues/<venue_id>/delete', methods=['GET'])
+@app.route('/venues/<int:venue_id>/delete', methods=['POST', 'DELETE'])
+@query_budget(10)
 def delete_venue(venue_id):
   # COMPLETE: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-  venue = Venue.query.get(venue_id)
-  if not venue:
+  # One DELETE statement: the database cascades to Show and venue_genre_table
+  error_on_delete = False
+  venue_name = None
+  try:
+      release_genre_counts(venue_ids=[venue_id])
+      release_trend_scores(venue_ids=[venue_id])
+      venue_name = db.session.execute(
+          db.delete(Venue).where(Venue.id == venue_id).returning(Venue.name)
+          .execution_options(synchronize_session=False)
+      ).scalar_one_or_none()
+      if venue_name is not None:
+          record_changes('venue', 'delete', [venue_id])
+      db.session.commit()
+  except Exception as e:
+      error_on_delete = True
+      print(f'Exception "{e}" in delete_venue()')
+      db.session.rollback()
+  finally:
+      db.session.close()
+  if error_on_delete:
+      flash(f'An error occurred deleting venue {venue_id}.')
+      print("Error in delete_venue()")
+      abort(500)
+  elif venue_name is None:
       return redirect(url_for('index'))
   else:
-      error_on_delete = False
-      venue_name = venue.name
-      try:
-          db.session.delete(venue)
-          db.session.commit()
-      except:
-          error_on_delete = True
-          db.session.rollback()
-      finally:
-          db.session.close()
-      if error_on_delete:
-          flash(f'An error occurred deleting venue {venue_name}.')
-          print("Error in delete_venue()")
-          abort(500)
-      else:
-          # flash(f'Successfully removed venue {venue_name}')
-          # return redirect(url_for('venues'))
-          return jsonify({
-              'deleted': True,
-              'url': url_for('venues')
-          })
+      # flash(f'Successfully removed venue {venue_name}')
+      # return redirect(url_for('venues'))
+      return jsonify({
+          'deleted': True,
+          'url': url_for('venues')
+      })
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@query_budget(4)
 def artists():
   # COMPLETE: replace with real data returned from querying the database
-  artists = Artist.query.order_by(Artist.name).all()  # Sort alphabetically
+  genre = request.args.get('genre')
+  model = current_read_model()
+  if model is not None and not genre:
+      return stream_page('pages/artists.html', artists=model.artist_list(), facets=list_facets(), genre=genre)
 
-  data = []
-  for artist in artists:
-      data.append({
-          "id": artist.id,
-          "name": artist.name
-      })
-  return render_template('pages/artists.html', artists=data)
+  query = db.select(Artist.id, Artist.name).order_by(Artist.name)  # Sort alphabetically
+  if genre:
+      query = query.where(Artist.genres.any(Genre.name == genre))
 
-@app.route('/artists/search', methods=['POST'])
-def search_artists():
-  # COMPLETE: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  # Most of code is from search_venues()
-  artist_query = db.session.query(Artist).get(artist_id)
-
-  if not artist_query: 
-    return render_template('errors/404.html')
-
-  past_shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id==artist_id).filter(Show.start_time>datetime.now()).all()
-  past_shows = []
-
-  for show in past_shows_query:
-    past_shows.append({
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "artist_image_link": show.venue.image_link,
-      "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-    })
-
-  upcoming_shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id==artist_id).filter(Show.start_time>datetime.now()).all()
-  upcoming_shows = []
+  facets = genre_facets()
+  data = ({
+      "id": artist_id,
+      "name": name
+  } for artist_id, name in stream_rows(query))
+  return stream_page('pages/artists.html', artists=data, facets=facets, genre=genre)
 
-  for show in upcoming_shows_query:
-    upcoming_shows.append({
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "artist_image_link": show.venue.image_link,
-      "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-    })
+#  Genres
+#  ----------------------------------------------------------------
 
+def genre_facets():
+  # A single read of the precomputed counts, most listed genres first
+  return db.session.execute(
+      db.select(Genre.name, GenreFacet.artist_count, GenreFacet.venue_count, GenreFacet.upcoming_show_count)
+      .join(GenreFacet, GenreFacet.genre_id == Genre.id)
+      .order_by((GenreFacet.artist_count + GenreFacet.venue_count).desc(), Genre.name)
+  ).mappings().all()
 
-  data = {
-    "id": artist_query.id,
-    "name": artist_query.name,
-    "genres": artist_query.genres,
-    "city": artist_query.city,
-    "state": artist_query.state,
-    "phone": artist_query.phone,
-    "website": artist_query.website,
-    "facebook_link": artist_query.facebook_link,
-    "seeking_venue": artist_query.seeking_venue,
-    "seeking_description": artist_query.seeking_description,
-    "image_link": artist_query.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
-    "upcoming_shows_count": len(upcoming_shows),
-  }
+@app.route('/genres')
+@query_budget(2)
+def genres():
+  return render_template('pages/genres.html', facets=genre_facets())
 
-  return render_template('pages/show_artist.html', artist=data)
+@app.route('/artists/search', methods=['POST'])
+@query_budget(3)
+@admission_controlled
+def search_artists():
+  # COMPLETE: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # search for "band" should return "The Wild Sax Band"; single letters are below
+  # SEARCH_MIN_TERM_LENGTH and return nothing.
+  search_term = request.form.get('search_term', '').strip()
+  response = name_search(Artist, Show.artist_id, search_term)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@query_budget(8)
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # COMPLETE: replace with real venue data from the venues table, using venue_id
@@ -431,28 +2749,8 @@ def show_artist(artist_id):
       return redirect(url_for('index'))
   else:
       genres = [ genre.name for genre in artist.genres ] 
-      past_shows = []
-      past_shows_count = 0
-      upcoming_shows = []
-      upcoming_shows_count = 0
-      now = datetime.now()
-      for show in artist.shows:
-          if show.start_time > now:
-              upcoming_shows_count += 1
-              upcoming_shows.append({
-                  "venue_id": show.venue_id,
-                  "venue_name": show.venue.name,
-                  "venue_image_link": show.venue.image_link,
-                  "start_time": format_datetime(str(show.start_time))
-              })
-          if show.start_time < now:
-              past_shows_count += 1
-              past_shows.append({
-                  "venue_id": show.venue_id,
-                  "venue_name": show.venue.name,
-                  "venue_image_link": show.venue.image_link,
-                  "start_time": format_datetime(str(show.start_time))
-              })
+      upcoming_shows, past_shows, past_shows_count = show_windows(Show.artist_id, artist_id)
+      upcoming_shows_count = len(upcoming_shows)
 
       data = {
           "id": artist_id,
@@ -473,9 +2771,33 @@ def show_artist(artist_id):
       }
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/calendar')
+@query_budget(4)
+def artist_calendar(artist_id):
+  artist = Artist.query.get(artist_id)
+  if not artist:
+    abort(404)
+  return show_calendar(artist, Show.artist_id)
+
+@app.route('/artists/<int:artist_id>/matches')
+@query_budget(3)
+def artist_matches(artist_id):
+  # Venues seeking talent, ranked the same way as venue_matches()
+  artist = Artist.query.get(artist_id)
+  if not artist:
+    abort(404)
+  source = MatchEntry(artist.id, artist.name, artist.city, artist.state, [genre.name for genre in artist.genres])
+  k = max(1, min(request.args.get('k', 10, type=int), 100))
+  matches = match_index_for(Venue).top(source, k)
+  return jsonify({
+    "artist_id": artist.id,
+    "matches": match_response(matches, "venue_id")
+  })
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(3)
 def edit_artist(artist_id):
   # Taken mostly from edit_venue()
   artist = Artist.query.get(artist_id) 
@@ -501,6 +2823,7 @@ def edit_artist(artist_id):
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@query_budget(30)
 def edit_artist_submission(artist_id):
   # COMPLETE: take values from the form submitted, and update existing
   # Much of this code from edit_venue_submission()
@@ -525,27 +2848,23 @@ def edit_artist_submission(artist_id):
       error_in_update = False
       try:
           artist = Artist.query.get(artist_id)
-          artist.name = name
-          artist.city = city
-          artist.state = state
-          artist.phone = phone
-          artist.seeking_venue = seeking_venue
-          artist.seeking_description = seeking_description
-          artist.image_link = image_link
-          artist.website = website
-          artist.facebook_link = facebook_link
-          artist.genres = []
-          
-          for genre in genres:
-              fetch_genre = Genre.query.filter_by(name=genre).one_or_none()  # Throws an exception if more than one returned, returns None if none
-              if fetch_genre:
-                  artist.genres.append(fetch_genre)
-
-              else:
-                  new_genre = Genre(name=genre)
-                  db.session.add(new_genre)
-                  artist.genres.append(new_genre)  # Create a new Genre item and append it
+          if artist.version != submitted_version(form):
+              return refuse_stale_edit('artist', artist.name, url_for('edit_artist', artist_id=artist_id))
+          apply_edit(artist, {
+              "name": name,
+              "city": city,
+              "state": state,
+              "phone": phone,
+              "seeking_venue": seeking_venue,
+              "seeking_description": seeking_description,
+              "image_link": image_link,
+              "website": website,
+              "facebook_link": facebook_link
+          }, genres)
           db.session.commit()
+      except StaleDataError:
+          db.session.rollback()
+          return refuse_stale_edit('artist', name, url_for('edit_artist', artist_id=artist_id))
       except Exception as e:
           error_in_update = True
           print(f'Exception "{e}" in edit_artist_submission()')
@@ -564,6 +2883,7 @@ def edit_artist_submission(artist_id):
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(3)
 def edit_venue(venue_id):
   venue = Venue.query.get(venue_id) 
   if not venue:
@@ -589,6 +2909,7 @@ def edit_venue(venue_id):
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@query_budget(30)
 def edit_venue_submission(venue_id):
   # COMPLETE: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
@@ -613,29 +2934,26 @@ def edit_venue_submission(venue_id):
       error_in_update = False
       try:
           venue = Venue.query.get(venue_id)
-          venue.name = name
-          venue.city = city
-          venue.state = state
-          venue.address = address
-          venue.phone = phone
-
-          venue.seeking_talent = seeking_talent
-          venue.seeking_description = seeking_description
-          venue.image_link = image_link
-          venue.website = website
-          venue.facebook_link = facebook_link
-          venue.genres = []
-
-          for genre in genres:
-              fetch_genre = Genre.query.filter_by(name=genre).one_or_none()  # Throws an exception if more than one returned, returns None if none
-              if fetch_genre:
-                  venue.genres.append(fetch_genre)
-
-              else:
-                  new_genre = Genre(name=genre)
-                  db.session.add(new_genre)
-                  venue.genres.append(new_genre) 
+          if venue.version != submitted_version(form):
+              return refuse_stale_edit('venue', venue.name, url_for('edit_venue', venue_id=venue_id))
+          apply_edit(venue, {
+              "name": name,
+              "city": city,
+              "state": state,
+              "address": address,
+              "latitude": form.latitude.data,
+              "longitude": form.longitude.data,
+              "phone": phone,
+              "seeking_talent": seeking_talent,
+              "seeking_description": seeking_description,
+              "image_link": image_link,
+              "website": website,
+              "facebook_link": facebook_link
+          }, genres)
           db.session.commit()
+      except StaleDataError:
+          db.session.rollback()
+          return refuse_stale_edit('venue', name, url_for('edit_venue', venue_id=venue_id))
       except Exception as e:
           error_in_update = True
           print(f'Exception "{e}" in edit_venue_submission()')
@@ -661,6 +2979,7 @@ def create_artist_form():
   return render_template('forms/new_artist.html', form=form)
 
 @app.route('/artists/create', methods=['POST'])
+@query_budget(30)
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # COMPLETE: insert form data as a new Venue record in the db, instead
@@ -686,6 +3005,16 @@ def create_artist_submission():
       return redirect(url_for('create_artist_submission'))
 
   else:
+      record = dedupe_record(None, name, city, state, phone)
+      existing = find_duplicate(Artist, record)
+      if existing:
+          flash(f'{existing.name} from {city} is already listed.')
+          return redirect(url_for('show_artist', artist_id=existing.id))
+      if not request.form.get('confirm_duplicate'):
+          duplicates = near_duplicates(Artist, record)
+          if duplicates:
+              return render_template('forms/new_artist.html', form=form, duplicates=duplicates)
+
       error_in_insert = False
 
       # Insert form data into DB
@@ -696,18 +3025,7 @@ def create_artist_submission():
               website=website, facebook_link=facebook_link)
           # genres can't take a list of strings, it needs to be assigned to db objects
           # genres from the form is like: ['Alternative', 'Classical', 'Country']
-          for genre in genres:
-              # fetch_genre = session.query(Genre).filter_by(name=genre).one_or_none()  # Throws an exception if more than one returned, returns None if none
-              fetch_genre = Genre.query.filter_by(name=genre).one_or_none()  # Throws an exception if more than one returned, returns None if none
-              if fetch_genre:
-                  # if found a genre, append it to the list
-                  new_artist.genres.append(fetch_genre)
-
-              else:
-                  # fetch_genre was None. It's not created yet, so create it
-                  new_genre = Genre(name=genre)
-                  db.session.add(new_genre)
-                  new_artist.genres.append(new_genre)  # Create a new Genre item and append it
+          new_artist.genres = genres_named(genres)
 
           db.session.add(new_artist)
           db.session.commit()
@@ -728,53 +3046,219 @@ def create_artist_submission():
           abort(500)
 
 # Create delete_artist (much like delete_venue)
-@app.route('/artists/<artist_id>/delete', methods=['GET'])
+@app.route('/artists/<int:artist_id>/delete', methods=['POST', 'DELETE'])
+@query_budget(10)
 def delete_artist(artist_id):
-    artist = Artist.query.get(artist_id)
-    if not artist:
+    error_on_delete = False
+    artist_name = None
+    try:
+        release_genre_counts(artist_ids=[artist_id])
+        release_trend_scores(artist_ids=[artist_id])
+        artist_name = db.session.execute(
+            db.delete(Artist).where(Artist.id == artist_id).returning(Artist.name)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+        if artist_name is not None:
+            record_changes('artist', 'delete', [artist_id])
+        db.session.commit()
+    except Exception as e:
+        error_on_delete = True
+        print(f'Exception "{e}" in delete_artist()')
+        db.session.rollback()
+    finally:
+        db.session.close()
+    if error_on_delete:
+        flash(f'An error occurred deleting artist {artist_id}.')
+        print("Error in delete_artist()")
+        abort(500)
+    elif artist_name is None:
         return redirect(url_for('index'))
     else:
-        error_on_delete = False
-        artist_name = artist.name
-        try:
-            db.session.delete(artist)
-            db.session.commit()
-        except:
-            error_on_delete = True
-            db.session.rollback()
-        finally:
-            db.session.close()
-        if error_on_delete:
-            flash(f'An error occurred deleting artist {artist_name}.')
-            print("Error in delete_artist()")
-            abort(500)
-        else:
-            return jsonify({
-                'deleted': True,
-                'url': url_for('artists')
-            })
+        return jsonify({
+            'deleted': True,
+            'url': url_for('artists')
+        })
+
+# Bulk delete: {"venues": [1, 2], "artists": [3], "shows": [4, 5]} removed in one transaction.
+# Operational, like /jobs: needs the admin token
+@app.route('/bulk/delete', methods=['POST', 'DELETE'])
+def bulk_delete():
+  require_admin()
+  payload = request.get_json(silent=True) or {}
+  models = (('shows', Show), ('artists', Artist), ('venues', Venue))
+  if not isinstance(payload, dict) or not all(isinstance(payload.get(key, []), list) for key, _ in models):
+      abort(400)
+  try:
+      ids = {key: [int(i) for i in payload.get(key, [])] for key, model in models}
+  except (TypeError, ValueError):
+      abort(400)
+
+  deleted = {}
+  error_on_delete = False
+  try:
+      release_genre_counts(venue_ids=ids['venues'], artist_ids=ids['artists'], show_ids=ids['shows'])
+      release_trend_scores(venue_ids=ids['venues'], artist_ids=ids['artists'], show_ids=ids['shows'])
+      for key, model in models:
+          deleted[key] = 0
+          if ids[key]:
+              result = db.session.execute(
+                  db.delete(model).where(model.id.in_(ids[key])).returning(model.id)
+                  .execution_options(synchronize_session=False)
+              )
+              removed = result.scalars().all()
+              record_changes(CHANGE_KINDS[model], 'delete', removed)
+              deleted[key] = len(removed)
+      db.session.commit()
+  except Exception as e:
+      error_on_delete = True
+      print(f'Exception "{e}" in bulk_delete()')
+      db.session.rollback()
+  finally:
+      db.session.close()
+  if error_on_delete:
+      abort(500)
+  return jsonify({
+      'deleted': deleted
+  })
+
+#  Calendars
+#  ----------------------------------------------------------------
+
+# Detail pages list every upcoming show but only the most recent past ones;
+# the rest of the history is browsed through the calendar
+PAST_SHOWS_WINDOW = 12
+CALENDAR_BUCKETS = ('day', 'week', 'month')
+CALENDAR_MAX_DAYS = 366
+CALENDAR_MAX_SHOWS = 500
+
+def show_windows(owner_column, owner_id):
+  # Upcoming shows, the latest PAST_SHOWS_WINDOW past shows and the total past count,
+  # each read through the (owner, start_time) index
+  if owner_column is Show.venue_id:
+      other, id_key, prefix = Artist, "artist_id", "artist"
+  else:
+      other, id_key, prefix = Venue, "venue_id", "venue"
+  now = datetime.now()
+  query = db.select(other.id, other.name, other.image_link, Show.start_time) \
+      .join(other, other.id == (Show.artist_id if other is Artist else Show.venue_id)) \
+      .where(owner_column == owner_id)
+
+  def rows(statement):
+    return [{
+      id_key: other_id,
+      prefix + "_name": name,
+      prefix + "_image_link": image_link,
+      "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')
+    } for other_id, name, image_link, start_time in db.session.execute(statement)]
+
+  upcoming_shows = rows(query.where(Show.start_time > now).order_by(Show.start_time))
+  past_shows = rows(query.where(Show.start_time < now).order_by(Show.start_time.desc()).limit(PAST_SHOWS_WINDOW))
+  past_shows_count = db.session.execute(
+      db.select(db.func.count(Show.id)).where(owner_column == owner_id, Show.start_time < now)
+  ).scalar()
+  # Shows in archived partitions only survive as counts
+  archived = ShowArchiveSummary.venue_id if owner_column is Show.venue_id else ShowArchiveSummary.artist_id
+  past_shows_count += db.session.execute(
+      db.select(db.func.coalesce(db.func.sum(ShowArchiveSummary.show_count), 0)).where(archived == owner_id)
+  ).scalar()
+  return upcoming_shows, past_shows, past_shows_count
+
+def date_bucket(bucket, column):
+  # date_trunc on Postgres; SQLite gets the equivalent strftime (weeks start on Monday)
+  if db.engine.dialect.name == 'sqlite':
+      if bucket == 'day':
+          return db.func.date(column)
+      if bucket == 'week':
+          return db.func.date(column, 'weekday 0', '-6 days')
+      return db.func.strftime('%Y-%m-01', column)
+  return db.func.date_trunc(bucket, column)
+
+def parse_calendar_date(value, default):
+  if not value:
+      return default
+  try:
+      return datetime.strptime(value, '%Y-%m-%d')
+  except ValueError:
+      abort(400)
+
+def show_calendar(owner, owner_column):
+  # Shows for one venue or artist in [start, end), plus per-bucket counts grouped in SQL
+  bucket = request.args.get('bucket', 'day')
+  if bucket not in CALENDAR_BUCKETS:
+      abort(400)
+  month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+  start = parse_calendar_date(request.args.get('start'), month_start)
+  end = parse_calendar_date(request.args.get('end'), (start + timedelta(days=32)).replace(day=1))
+  if not start < end <= start + timedelta(days=CALENDAR_MAX_DAYS):
+      abort(400)
+
+  in_range = (owner_column == owner.id, Show.start_time >= start, Show.start_time < end)
+  period = date_bucket(bucket, Show.start_time).label('period')
+  buckets = [{
+      "period": period_start.strftime('%Y-%m-%d') if isinstance(period_start, datetime) else str(period_start)[:10],
+      "count": count
+  } for period_start, count in db.session.execute(
+      db.select(period, db.func.count(Show.id)).where(*in_range).group_by(period).order_by(period)
+  )]
+
+  other = Artist if owner_column is Show.venue_id else Venue
+  other_id = Show.artist_id if other is Artist else Show.venue_id
+  shows = [{
+      "show_id": show_id,
+      "id": show_other_id,
+      "name": name,
+      "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')
+  } for show_id, show_other_id, name, start_time in db.session.execute(
+      db.select(Show.id, other.id, other.name, Show.start_time)
+      .join(other, other.id == other_id).where(*in_range)
+      .order_by(Show.start_time).limit(CALENDAR_MAX_SHOWS + 1)
+  )]
+
+  data = {
+    "id": owner.id,
+    "name": owner.name,
+    "kind": "venue" if isinstance(owner, Venue) else "artist",
+    "start": start.strftime('%Y-%m-%d'),
+    "end": end.strftime('%Y-%m-%d'),
+    "bucket": bucket,
+    "buckets": buckets,
+    "shows": shows[:CALENDAR_MAX_SHOWS],
+    "truncated": len(shows) > CALENDAR_MAX_SHOWS
+  }
+  if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+      return jsonify(data)
+  span = end - start
+  return render_template('pages/calendar.html', calendar=data,
+                         previous_start=(start - span).strftime('%Y-%m-%d'),
+                         next_end=(end + span).strftime('%Y-%m-%d'))
+
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@query_budget(2)
 def shows():
   # displays list of shows at /shows
   # COMPLETE: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  shows_query = db.session.query(Show).join(Artist).join(Venue).all()
+  model = current_read_model()
+  if model is not None:
+      return stream_page('pages/shows.html', shows=model.show_list())
 
-  data = []
-  for show in shows_query: 
-    data.append({
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "artist_id": show.artist_id,
-      "artist_name": show.artist.name, 
-      "artist_image_link": show.artist.image_link,
-      "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-    })
+  shows_query = db.select(Show.venue_id, Venue.name, Show.artist_id, Artist.name, Artist.image_link, Show.start_time) \
+      .join(Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id) \
+      .order_by(Show.start_time)
 
-  return render_template('pages/shows.html', shows=data)
+  data = ({
+    "venue_id": venue_id,
+    "venue_name": venue_name,
+    "artist_id": artist_id,
+    "artist_name": artist_name,
+    "artist_image_link": artist_image_link,
+    "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')
+  } for venue_id, venue_name, artist_id, artist_name, artist_image_link, start_time in stream_rows(shows_query))
+
+  return stream_page('pages/shows.html', shows=data)
 
 @app.route('/shows/create')
 def create_shows():
@@ -783,6 +3267,7 @@ def create_shows():
   return render_template('forms/new_show.html', form=form)
 
 @app.route('/shows/create', methods=['POST'])
+@query_budget(15)
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   form = ShowForm()
@@ -809,7 +3294,449 @@ def create_show_submission():
   else:
       flash('Show was successfully listed!')
   
-  return render_template('pages/home.html')
+  return home_page()
+
+#  Show series
+#  ----------------------------------------------------------------
+
+SERIES_STEPS = {'weekly': timedelta(weeks=1), 'biweekly': timedelta(weeks=2)}
+
+def parse_series_dates(text):
+  # YYYY-MM-DD dates separated by commas or whitespace
+  return [datetime.strptime(value, '%Y-%m-%d').date() for value in re.split(r'[\s,]+', text or '') if value]
+
+def expand_series(rule, first_start, until=None, dates=()):
+  # Occurrence start times for a recurrence rule, oldest first
+  limit = app.config.get('SHOW_SERIES_MAX_OCCURRENCES', 104)
+  if rule in SERIES_STEPS:
+      if until is None:
+          raise ValueError('Weekly and biweekly series need an end date.')
+      starts = []
+      start = first_start
+      while start.date() <= until and len(starts) <= limit:
+          starts.append(start)
+          start += SERIES_STEPS[rule]
+  elif rule == 'dates':
+      starts = sorted({first_start} | {datetime.combine(day, first_start.time()) for day in dates})
+  else:
+      raise ValueError(f'Unknown repeat rule {rule!r}.')
+  if len(starts) > limit:
+      raise ValueError(f'A series can have at most {limit} shows.')
+  return starts
+
+def show_conflicts(venue_id, artist_id, starts, exclude_series=None):
+  # Existing shows at the venue or by the artist that start within SHOW_LENGTH_MINUTES
+  # of any occurrence: one query over the OR of the occurrence windows, bounded by
+  # the whole span so the (venue_id, start_time) and (artist_id, start_time) indexes apply
+  length = timedelta(minutes=app.config.get('SHOW_LENGTH_MINUTES', 180))
+  query = db.select(Show.id, Show.venue_id, Show.artist_id, Show.start_time).where(
+      or_(Show.venue_id == venue_id, Show.artist_id == artist_id),
+      Show.start_time > starts[0] - length, Show.start_time < starts[-1] + length,
+      or_(*[db.and_(Show.start_time > start - length, Show.start_time < start + length) for start in starts])
+  ).order_by(Show.start_time)
+  if exclude_series is not None:
+      query = query.where(or_(Show.series_id.is_(None), Show.series_id != exclude_series))
+  return db.session.execute(query).all()
+
+def conflict_json(conflicts):
+  return [{
+      "show_id": show_id,
+      "venue_id": venue_id,
+      "artist_id": artist_id,
+      "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')
+  } for show_id, venue_id, artist_id, start_time in conflicts]
+
+def series_show_data(series, start_time):
+  return {'artist_id': series.artist_id, 'venue_id': series.venue_id, 'start_time': start_time.isoformat()}
+
+def book_series(series, starts):
+  # All occurrences in one batched INSERT. Bulk statements skip the flush hooks, so the
+  # facet counts, trend scores and change events are updated here.
+  now = datetime.now()
+  rows = db.session.execute(
+      db.insert(Show).returning(Show.id, Show.start_time),
+      [{'venue_id': series.venue_id, 'artist_id': series.artist_id, 'series_id': series.id, 'start_time': start,
+        'created_at': now} for start in starts]
+  ).all()
+  add_upcoming_show_counts(db.session, {series.artist_id: sum(1 for start in starts if start > now)})
+  add_trend_scores(db.session, [(series.venue_id, series.artist_id, now, start) for start in starts])
+  record_change_events([('show', 'create', show_id, series_show_data(series, start_time))
+                        for show_id, start_time in rows])
+  return rows
+
+def series_json(series):
+  return {
+      "id": series.id,
+      "venue_id": series.venue_id,
+      "artist_id": series.artist_id,
+      "rule": series.rule,
+      "first_start": series.first_start.strftime('%Y-%m-%d %H:%M:%S'),
+      "until": series.until.strftime('%Y-%m-%d') if series.until else None,
+      "dates": series.dates,
+      "shows": [{
+          "id": show_id,
+          "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')
+      } for show_id, start_time in db.session.execute(
+          db.select(Show.id, Show.start_time).where(Show.series_id == series.id).order_by(Show.start_time))]
+  }
+
+@app.route('/shows/series/create', methods=['GET'])
+def create_show_series_form():
+  form = ShowSeriesForm()
+  return render_template('forms/new_show_series.html', form=form)
+
+@app.route('/shows/series/create', methods=['POST'])
+@query_budget(25)
+def create_show_series_submission():
+  form = ShowSeriesForm()
+  if not form.validate():
+      flash('Show series could not be listed: please check the form.')
+      return render_template('forms/new_show_series.html', form=form)
+  try:
+      venue_id, artist_id = int(form.venue_id.data), int(form.artist_id.data)
+      dates = parse_series_dates(form.dates.data) if form.repeat.data == 'dates' else ()
+      starts = expand_series(form.repeat.data, form.start_time.data, form.until.data, dates)
+  except ValueError as e:
+      flash(f'Show series could not be listed: {e}')
+      return render_template('forms/new_show_series.html', form=form)
+  if not db.session.get(Venue, venue_id) or not db.session.get(Artist, artist_id):
+      flash('Show series could not be listed: no such venue or artist.')
+      return render_template('forms/new_show_series.html', form=form)
+
+  conflicts = show_conflicts(venue_id, artist_id, starts)
+  if conflicts:
+      flash('Show series could not be listed: it overlaps existing shows on ' +
+            ', '.join(start_time.strftime('%Y-%m-%d %H:%M') for _, _, _, start_time in conflicts[:10]) + '.')
+      return render_template('forms/new_show_series.html', form=form)
+
+  try:
+      series = ShowSeries(venue_id=venue_id, artist_id=artist_id, rule=form.repeat.data,
+                          first_start=starts[0], until=form.until.data,
+                          dates=[day.isoformat() for day in dates] or None)
+      db.session.add(series)
+      db.session.flush()
+      book_series(series, starts)
+      db.session.commit()
+      flash(f'Show series was successfully listed with {len(starts)} shows!')
+  except Exception as e:
+      print(f'Exception "{e}" in create_show_series_submission()')
+      db.session.rollback()
+      flash('An error occurred. Show series could not be listed.')
+  finally:
+      db.session.close()
+  return home_page()
+
+@app.route('/shows/series/<int:series_id>')
+@query_budget(3)
+def show_series(series_id):
+  series = db.session.get(ShowSeries, series_id)
+  if not series:
+      abort(404)
+  return jsonify(series_json(series))
+
+@app.route('/shows/series/<int:series_id>', methods=['PATCH'])
+@query_budget(25)
+def edit_show_series(series_id):
+  # Moves every upcoming occurrence to another venue or artist and/or shifts it by
+  # shift_minutes, in one transaction; past shows are left as they happened
+  require_csrf_header()
+  series = db.session.get(ShowSeries, series_id)
+  if not series:
+      abort(404)
+  payload = request.get_json(silent=True) or {}
+  if not isinstance(payload, dict):
+      abort(400)
+  try:
+      venue_id = int(payload.get('venue_id', series.venue_id))
+      artist_id = int(payload.get('artist_id', series.artist_id))
+      shift = timedelta(minutes=int(payload.get('shift_minutes', 0)))
+  except (TypeError, ValueError):
+      abort(400)
+  if not db.session.get(Venue, venue_id) or not db.session.get(Artist, artist_id):
+      abort(400)
+
+  now = datetime.now()
+  upcoming = db.session.execute(
+      db.select(Show.id, Show.start_time, Show.created_at)
+      .where(Show.series_id == series_id, Show.start_time > now).order_by(Show.start_time)
+  ).all()
+  if not upcoming:
+      return jsonify(series_json(series))
+  starts = [start_time + shift for _, start_time, _ in upcoming]
+  conflicts = show_conflicts(venue_id, artist_id, starts, exclude_series=series_id)
+  if conflicts:
+      return jsonify({"error": "overlaps existing shows", "conflicts": conflict_json(conflicts)}), 409
+
+  release_genre_counts(show_ids=[show_id for show_id, _, _ in upcoming])
+  release_trend_scores(show_ids=[show_id for show_id, _, _ in upcoming])
+  shows_table = Show.__table__
+  db.session.execute(
+      db.update(shows_table).where(shows_table.c.id == bindparam('b_id'))
+      .values(venue_id=venue_id, artist_id=artist_id, start_time=bindparam('b_start')),
+      [{'b_id': show_id, 'b_start': start} for (show_id, _, _), start in zip(upcoming, starts)]
+  )
+  series.venue_id, series.artist_id = venue_id, artist_id
+  if series.first_start > now:
+      series.first_start += shift
+  add_upcoming_show_counts(db.session, {artist_id: sum(1 for start in starts if start > now)})
+  add_trend_scores(db.session, [(venue_id, artist_id, created_at, start)
+                                for (_, _, created_at), start in zip(upcoming, starts)])
+  record_change_events([('show', 'update', show_id, series_show_data(series, start))
+                        for (show_id, _, _), start in zip(upcoming, starts)])
+  db.session.commit()
+  return jsonify(series_json(series))
+
+@app.route('/shows/series/<int:series_id>', methods=['DELETE'])
+@query_budget(15)
+def cancel_show_series(series_id):
+  # Cancels every upcoming occurrence in one DELETE; the series is removed too unless
+  # it has past shows
+  require_csrf_header()
+  series = db.session.get(ShowSeries, series_id)
+  if not series:
+      abort(404)
+  upcoming = (Show.series_id == series_id, Show.start_time > datetime.now())
+  cancelled_ids = db.session.scalars(db.select(Show.id).where(*upcoming)).all()
+  release_genre_counts(show_ids=cancelled_ids)
+  release_trend_scores(show_ids=cancelled_ids)
+  cancelled = db.session.scalars(db.delete(Show).where(*upcoming).returning(Show.id)).all()
+  record_changes('show', 'delete', cancelled)
+  if not db.session.scalar(db.select(db.func.count(Show.id)).where(Show.series_id == series_id)):
+      db.session.delete(series)
+  db.session.commit()
+  return jsonify({"success": True, "cancelled": len(cancelled)})
+
+#  Sitemaps
+#  ----------------------------------------------------------------
+
+@app.route('/robots.txt')
+def robots_txt():
+  return Response(f'User-agent: *\nSitemap: {sitemap_base_url()}{url_for("sitemap_index")}\n', mimetype='text/plain')
+
+@app.route('/sitemap.xml')
+@query_budget(2)
+def sitemap_index():
+  state = current_sitemaps()
+  base = sitemap_base_url()
+  entries = [(base + url_for('sitemap_file', kind=kind, chunk=int(chunk)), lastmod)
+             for kind in SITEMAP_KINDS
+             for chunk, (count, lastmod, version) in sorted(state['kinds'].get(kind, {}).items(), key=lambda item: int(item[0]))]
+  response = Response(sitemap.sitemap_index(entries), mimetype='application/xml')
+  response.cache_control.max_age = app.config.get('SITEMAP_MAX_AGE', 3600)
+  return response
+
+@app.route('/sitemaps/<kind>-<int:chunk>.xml')
+@query_budget(3)
+def sitemap_file(kind, chunk):
+  if kind not in SITEMAP_KINDS:
+      abort(404)
+  entry = current_sitemaps()['kinds'].get(kind, {}).get(str(chunk))
+  if entry is None:
+      abort(404)
+  count, lastmod, version = entry
+  cache = get_sitemap_cache()
+  path = cache.path(kind, chunk, version)
+  max_age = app.config.get('SITEMAP_MAX_AGE', 3600)
+  try:
+      cached = open(path, 'rb')
+  except FileNotFoundError:
+      metrics.increment('sitemap_generated_total', kind=kind)
+      response = Response(stream_with_context(cache.tee(sitemap.urlset(sitemap_urls(kind, chunk)), path)),
+                          mimetype='application/xml')
+      response.set_etag(f'{kind}-{chunk}-{version}')
+      response.cache_control.max_age = max_age
+      response.cache_control.public = True
+      return response
+  response = send_file(cached, mimetype='application/xml', etag=f'{kind}-{chunk}-{version}',
+                       conditional=True, max_age=max_age)
+  response.cache_control.public = True
+  return response
+
+#  Images
+#  ----------------------------------------------------------------
+
+image_cache = None
+# cache key -> when fetching it last failed; such images redirect to the original for a while
+image_failures = {}
+
+def get_image_cache():
+  global image_cache
+  if image_cache is None:
+      image_cache = imagecache.ImageCache(app.config.get('IMAGE_CACHE_DIR', os.path.join(app.root_path, 'image_cache')),
+                                          app.config.get('IMAGE_CACHE_MAX_BYTES', 512 * 2 ** 20))
+  return image_cache
+
+@app.route('/img/<size>/<signature>')
+def image_thumbnail(size, signature):
+  url = request.args.get('u', '')
+  if size not in imagecache.SIZES or not hmac.compare_digest(signature, image_signature(url, size)):
+      abort(404)
+  cache = get_image_cache()
+  key = cache.key(url, size)
+  body = None
+  cached = cache.get(key)
+  if cached is not None:
+      _, content_type, digest = cached
+      try:
+          body = open(cached[0], 'rb')
+      except FileNotFoundError:
+          # evicted by another worker since the lookup
+          body = None
+  if body is None:
+      failed_at = image_failures.get(key)
+      if failed_at is not None and time.monotonic() - failed_at < app.config.get('IMAGE_RETRY_SECONDS', 300):
+          return redirect(url)
+      try:
+          data, content_type = imagecache.fetch_image(
+              url, timeout=app.config.get('IMAGE_FETCH_TIMEOUT', 5),
+              max_bytes=app.config.get('IMAGE_MAX_SOURCE_BYTES', 10 * 2 ** 20),
+              allow_private=app.config.get('IMAGE_PROXY_ALLOW_PRIVATE', False))
+          data, content_type = imagecache.make_thumbnail(data, content_type, size)
+      except imagecache.FetchError as e:
+          app.logger.warning(f'Image proxy: {e}')
+          if len(image_failures) > 10000:
+              image_failures.clear()
+          image_failures[key] = time.monotonic()
+          return redirect(url)
+      image_failures.pop(key, None)
+      digest = cache.put(key, data, content_type)[2]
+      body = io.BytesIO(data)
+  response = send_file(body, mimetype=content_type, etag=digest, conditional=True,
+                       max_age=app.config.get('IMAGE_PROXY_MAX_AGE', 7 * 86400))
+  response.cache_control.public = True
+  return response
+
+#  Jobs
+#  ----------------------------------------------------------------
+
+def admin_authorized():
+  # Operational endpoints need the X-Admin-Token header; without a configured token
+  # they are closed unless ALLOW_UNAUTHENTICATED_ADMIN opts in
+  token = app.config.get('ADMIN_TOKEN')
+  if not token:
+      return app.config.get('ALLOW_UNAUTHENTICATED_ADMIN', False)
+  return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+def require_admin():
+  if not admin_authorized():
+      abort(403)
+
+def require_csrf_header():
+  # JSON write endpoints have no form to carry the CSRF token, so a page's script sends
+  # the session's token in X-CSRFToken; scripts may use an admin token instead
+  if admin_authorized() or not app.config.get('WTF_CSRF_ENABLED', True):
+      return
+  try:
+      validate_csrf(request.headers.get('X-CSRFToken'))
+  except ValidationError as e:
+      abort(400, description=str(e))
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+  require_admin()
+  query = db.select(Job).order_by(Job.id.desc()).limit(min(request.args.get('limit', 50, type=int), 500))
+  if request.args.get('status'):
+      query = query.where(Job.status == request.args['status'])
+  return jsonify({
+      "jobs": [job_json(queued) for queued in db.session.execute(query).scalars()]
+  })
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+  require_admin()
+  payload = request.get_json(silent=True) or {}
+  if not isinstance(payload, dict) or payload.get('name') not in job_handlers:
+      abort(400)
+  queued = enqueue(payload['name'], payload.get('payload'))
+  db.session.commit()
+  return jsonify(job_json(queued)), 201
+
+@app.route('/jobs/<int:job_id>')
+def show_job(job_id):
+  require_admin()
+  queued = db.session.get(Job, job_id)
+  if not queued:
+      abort(404)
+  return jsonify(job_json(queued))
+
+@app.route('/jobs/metrics')
+def job_metrics():
+  # Per job name and status: how many, and how long they took
+  require_admin()
+  rows = db.session.execute(
+      db.select(Job.name, Job.status, db.func.count(Job.id), db.func.avg(Job.duration_ms),
+                db.func.max(Job.duration_ms), db.func.avg(Job.attempts))
+      .group_by(Job.name, Job.status).order_by(Job.name, Job.status)
+  )
+  return jsonify({
+      "jobs": [{
+          "name": name,
+          "status": status,
+          "count": count,
+          "avg_duration_ms": avg_ms,
+          "max_duration_ms": max_ms,
+          "avg_attempts": float(avg_attempts) if avg_attempts is not None else None
+      } for name, status, count, avg_ms, max_ms, avg_attempts in rows]
+  })
+
+#  Profiles
+#  ----------------------------------------------------------------
+
+@app.route('/_profiles')
+def list_profiles():
+  require_admin()
+  directory = app.config['PROFILER_DIR']
+  profiles = []
+  for name in profiler.list_profiles(directory)[:min(request.args.get('limit', 50, type=int), 500)]:
+      with open(os.path.join(directory, name + '.json')) as info:
+          meta = json.load(info)
+      meta.pop('queries', None)
+      meta['folded_url'] = url_for('download_profile', name=name)
+      meta['sql_url'] = url_for('download_profile', name=name, sql=1)
+      profiles.append(meta)
+  return jsonify({"profiles": profiles})
+
+@app.route('/_profiles/<name>')
+def download_profile(name):
+  # The collapsed stacks (feed to flamegraph.pl or speedscope), or with ?sql=1 the
+  # request details and every statement it ran
+  require_admin()
+  if not profiler.PROFILE_NAME.match(name):
+      abort(404)
+  suffix = '.json' if request.args.get('sql') else '.folded'
+  return send_from_directory(os.path.abspath(app.config['PROFILER_DIR']), name + suffix,
+                             as_attachment=True, mimetype='application/json' if suffix == '.json' else 'text/plain')
+
+#  Memory
+#  ----------------------------------------------------------------
+
+@app.route('/_memory')
+def show_memory():
+  # This worker's sampled allocations by endpoint, largest peak first, with the source
+  # lines behind them (?top=N lines each)
+  require_admin()
+  return jsonify({
+      "pid": os.getpid(),
+      "enabled": bool(app.config.get('MEMORY_TRACE_ENABLED')),
+      "sample_rate": app.config.get('MEMORY_TRACE_SAMPLE_RATE', 0),
+      "resident_bytes": memtrace.resident_bytes(),
+      "endpoints": memory_tracker.report(min(request.args.get('top', 10, type=int), 100))
+  })
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/_metrics')
+def show_metrics():
+  # This worker's counters, as JSON or with ?format=prometheus in Prometheus' text format
+  require_admin()
+  if request.args.get('format') == 'prometheus':
+      return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+  return jsonify({
+      "pid": os.getpid(),
+      "uptime_seconds": round(time.time() - metrics.started, 3),
+      "metrics": metrics.snapshot()
+  })
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -834,6 +3761,7 @@ if not app.debug:
 # Launch.
 #----------------------------------------------------------------------------#
 
+# Development server only; production runs under gunicorn (see gunicorn.conf.py)
 # Default port:
 if __name__ == '__main__':
     app.run()
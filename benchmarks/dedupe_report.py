@@ -0,0 +1,96 @@
+"""Cost of duplicate detection at scale.
+
+Loads synthetic venues (1M by default) into a scratch SQLite database, a share of
+them re-listed under another spelling (case, punctuation, a typo, a shared phone),
+then times 'flask dedupe keys', the whole-table dedupe report and the checks one
+create runs, and reports how many of the planted duplicates the report found.
+
+    python benchmarks/dedupe_report.py [--venues N] [--duplicates FRACTION] [--db PATH]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def misspell(name, rng):
+    choice = rng.randrange(4)
+    if choice == 0:
+        return name.upper()
+    if choice == 1:
+        return name.replace(' ', ' - ', 1) + '!'
+    if choice == 2:
+        i = rng.randrange(len(name))
+        return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+    return 'The ' + name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--venues', type=int, default=1000000)
+    parser.add_argument('--duplicates', type=float, default=0.01)
+    parser.add_argument('--creates', type=int, default=200)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'fyyur-dedupe-bench.db'))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + args.db
+
+    from app import app, db, Venue, fill_dedupe_keys, dedupe_report, dedupe_record, find_duplicate, near_duplicates
+
+    rng = random.Random(args.seed)
+    words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).capitalize() for _ in range(20000)]
+    cities = ['City %d' % i for i in range(2000)]
+    planted = []
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        batch, originals = [], []
+        for i in range(1, args.venues + 1):
+            if originals and rng.random() < args.duplicates:
+                original_id, name, city, phone = rng.choice(originals)
+                row = {'name': misspell(name, rng), 'city': city, 'state': 'CA', 'phone': phone}
+                planted.append((original_id, i))
+            else:
+                row = {'name': ' '.join(rng.choices(words, k=rng.randint(1, 3))), 'city': rng.choice(cities),
+                       'state': 'CA', 'phone': '%010d' % rng.randrange(10 ** 10)}
+                if len(originals) < 100000:
+                    originals.append((i, row['name'], row['city'], row['phone']))
+            batch.append(row)
+            if len(batch) == 50000:
+                db.session.execute(db.insert(Venue), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(Venue), batch)
+        db.session.commit()
+        print('loaded %d venues (%d planted duplicates) in %.1f s' % (args.venues, len(planted), time.perf_counter() - started))
+
+        started = time.perf_counter()
+        fill_dedupe_keys(Venue)
+        print('dedupe keys: %.1f s' % (time.perf_counter() - started))
+
+        started = time.perf_counter()
+        groups, pairs = dedupe_report(Venue)
+        print('report: %.1f s, %d groups' % (time.perf_counter() - started, len(groups)))
+        group_of = {entity_id: n for n, group in enumerate(groups) for entity_id in group}
+        found = sum(1 for a, b in planted if a in group_of and group_of[a] == group_of.get(b))
+        print('planted duplicates found: %d of %d (%.1f%%)' % (found, len(planted), 100.0 * found / max(len(planted), 1)))
+
+        samples = rng.sample(originals, min(args.creates, len(originals)))
+        started = time.perf_counter()
+        for original_id, name, city, phone in samples:
+            record = dedupe_record(None, misspell(name, rng), city, 'CA', phone)
+            if find_duplicate(Venue, record) is None:
+                near_duplicates(Venue, record)
+        print('create checks: %.2f ms each' % ((time.perf_counter() - started) * 1000 / len(samples)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Latency of /venues/nearby's venue lookup at scale.
+
+Loads synthetic venues (1M by default) into a scratch SQLite database, clustered
+around a handful of metro areas the way real venues are, and times
+nearby_venues() for random points and radii.
+
+    python benchmarks/nearby_venues.py [--venues N] [--queries N] [--db PATH]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+METROS = [(37.77, -122.42), (40.71, -74.01), (30.27, -97.74), (41.88, -87.63),
+          (47.61, -122.33), (39.74, -104.99), (42.36, -71.06), (36.16, -86.78)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--venues', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'fyyur-nearby-bench.db'))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + args.db
+
+    import geo
+    from app import app, db, Venue, nearby_venues
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        batch = []
+        for i in range(args.venues):
+            if rng.random() < 0.9:
+                lat, lng = rng.choice(METROS)
+                lat, lng = rng.gauss(lat, 0.3), rng.gauss(lng, 0.3)
+            else:
+                lat, lng = rng.uniform(25, 49), rng.uniform(-124, -67)
+            batch.append({'name': 'Venue %d' % i, 'city': 'City', 'state': 'CA',
+                          'latitude': lat, 'longitude': lng, 'geohash': geo.encode(lat, lng)})
+            if len(batch) == 50000:
+                db.session.execute(db.insert(Venue), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(Venue), batch)
+        db.session.commit()
+        print('loaded %d venues in %.1f s' % (args.venues, time.perf_counter() - started))
+
+        for radius in (1, 5, 25, 100):
+            timings, counts = [], []
+            for _ in range(args.queries):
+                lat, lng = rng.choice(METROS)
+                lat, lng = lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5)
+                started = time.perf_counter()
+                found = nearby_venues(lat, lng, radius, 20)
+                timings.append((time.perf_counter() - started) * 1000)
+                counts.append(len(found))
+            timings.sort()
+            print('radius %3d km: median %6.2f ms  p95 %6.2f ms  (%d results on average)' % (
+                radius, statistics.median(timings), timings[int(len(timings) * 0.95) - 1],
+                statistics.mean(counts)))
+    os.remove(args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Memory and render cost of the in-process read model.
+
+Builds a synthetic projection (50k venues, 100k artists, 1M shows by default)
+and reports traced bytes per entity and the time to walk each list page.
+
+    python benchmarks/read_model_memory.py [--venues N] [--artists N] [--shows N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from readmodel import ReadModel  # noqa: E402
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Chicago', 'IL'),
+          ('Seattle', 'WA'), ('Denver', 'CO'), ('Boston', 'MA'), ('Nashville', 'TN')]
+
+
+def traced(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def loaded(venues, artists, shows):
+    model = ReadModel()
+    model.load(venues, artists, shows)
+    return model
+
+
+def timed(label, rows):
+    started = time.perf_counter()
+    count = sum(1 for _ in rows)
+    print('%-22s %9d rows %9.1f ms' % (label, count, (time.perf_counter() - started) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--venues', type=int, default=50000)
+    parser.add_argument('--artists', type=int, default=100000)
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # City/state are built per row, as the driver would return them, so interning is measured
+    venues = [(i, 'Venue %d' % i, ''.join(city), ''.join(state)) for i, (city, state) in
+              ((i, rng.choice(CITIES)) for i in range(1, args.venues + 1))]
+    artists = [(i, 'Artist %d' % i, 'https://images.example.com/artists/%d.jpg' % i)
+               for i in range(1, args.artists + 1)]
+    now = int(time.time())
+    starts = sorted(now + rng.randint(-365, 365) * 86400 for _ in range(args.shows))
+    shows = [(i + 1, rng.randint(1, args.venues), rng.randint(1, args.artists), start)
+             for i, start in enumerate(starts)]
+
+    # Name strings are shared with the input rows, as they are with driver rows, so
+    # they are not counted; everything the model allocates on top of them is. Each
+    # kind is measured on a model of its own, and shows as what loading them adds.
+    _, venue_bytes = traced(lambda: loaded(venues, [], []))
+    _, artist_bytes = traced(lambda: loaded([], artists, []))
+    model, total_bytes = traced(lambda: loaded(venues, artists, shows))
+    show_bytes = total_bytes - venue_bytes - artist_bytes
+
+    print('venues  %9d  %6.1f bytes each' % (args.venues, venue_bytes / max(args.venues, 1)))
+    print('artists %9d  %6.1f bytes each' % (args.artists, artist_bytes / max(args.artists, 1)))
+    print('shows   %9d  %6.1f bytes each' % (args.shows, show_bytes / max(args.shows, 1)))
+    print('total   %9.1f MiB' % (total_bytes / 2 ** 20))
+    print()
+
+    timed('/venues projection', (venue for area in model.venue_areas(now) for venue in area['venues']))
+    timed('/artists projection', model.artist_list())
+    timed('/shows projection', model.show_list())
+    print()
+
+    # Batches as the outbox delivers them: one booking, a weekly series of two years'
+    # occurrences, and cancelling a show
+    def booking(show_id, start):
+        return ('show', 'create', show_id, {'venue_id': 1, 'artist_id': 1,
+                                            'start_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start))})
+    batches = [
+        ('apply one new show', [booking(args.shows + 1, now + 3600)]),
+        ('apply a 104-show series', [booking(args.shows + 2 + week, now + week * 7 * 86400) for week in range(104)]),
+        ('apply one cancellation', [('show', 'delete', args.shows // 2, {})]),
+    ]
+    for label, changes in batches:
+        started = time.perf_counter()
+        model.apply(changes)
+        print('%-24s %22.1f ms' % (label, (time.perf_counter() - started) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Latency of /search's ranked full-text query at 1M documents.
+
+Fills search_document with synthetic venues, artists and shows (1M documents by
+default) and times search_documents() for a mix of queries. Runs against a scratch
+SQLite database (FTS5) unless DATABASE_URL points at a Postgres database to use.
+
+    python benchmarks/search_documents.py [--documents N] [--queries N]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Chicago', 'IL'),
+          ('Seattle', 'WA'), ('Denver', 'CO'), ('Boston', 'MA'), ('Nashville', 'TN')]
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+          'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+          'Rock n Roll', 'Soul']
+WORDS = ['blue', 'red', 'night', 'owl', 'river', 'stone', 'silver', 'echo', 'velvet', 'union', 'hall',
+         'room', 'garden', 'club', 'band', 'trio', 'quartet', 'collective', 'sound', 'lounge', 'north',
+         'south', 'golden', 'electric', 'wild', 'sax', 'petals', 'guns', 'moon', 'harbor']
+QUERIES = ['jazz', 'san francisco', 'jazz san francisco', 'velvet lounge', 'blue night trio',
+           'jazz san francisco next week', 'rock austin this month', 'silv', 'next week', 'punk boston tomorrow']
+
+
+def name(rng, words):
+    return ' '.join(rng.choice(WORDS).title() for _ in range(words))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    scratch = None
+    if not os.environ.get('DATABASE_URL'):
+        scratch = os.path.join(tempfile.gettempdir(), 'fyyur-search-bench.db')
+        if os.path.exists(scratch):
+            os.remove(scratch)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + scratch
+
+    import search
+    from app import app, db, SearchDocument, search_documents
+
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        batch = []
+        for i in range(args.documents):
+            city, state = rng.choice(CITIES)
+            genres = rng.sample(GENRES, 2)
+            roll = rng.random()
+            if roll < 0.05:
+                document = search.venue_document(i, name(rng, 2), city, state, '%d Main St' % i, genres)
+            elif roll < 0.15:
+                document = search.artist_document(i, name(rng, 3), city, state, genres)
+            else:
+                start = now + timedelta(hours=rng.randint(-24 * 365, 24 * 365))
+                document = search.show_document(i, i % 50000, i % 100000, start, name(rng, 3), name(rng, 2),
+                                                city, state, genres)
+            batch.append(document)
+            if len(batch) == 20000:
+                db.session.execute(db.insert(SearchDocument.__table__), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(SearchDocument.__table__), batch)
+        db.session.commit()
+        print('indexed %d documents in %.1f s' % (args.documents, time.perf_counter() - started))
+
+        for text in QUERIES:
+            timings = []
+            for page in range(1, args.queries + 1):
+                started = time.perf_counter()
+                rows, _ = search_documents(text, page=1 + page % 3, now=now)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            print('%-32s median %7.2f ms  p95 %7.2f ms' % (
+                repr(text), statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]))
+    if scratch:
+        os.remove(scratch)
+
+
+if __name__ == '__main__':
+    main()
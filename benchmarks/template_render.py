@@ -0,0 +1,113 @@
+"""First-request and steady-state render time of pages/shows.html and pages/show_venue.html.
+
+Each configuration runs in a fresh process, as a newly started worker would:
+
+    none       no bytecode cache, templates re-checked on every render (development)
+    cold       empty bytecode cache: the first worker after a deploy without 'flask templates compile'
+    warm       bytecode cache filled by 'flask templates compile'
+    preloaded  warm, plus preload_templates() before forking as wsgi.py does under gunicorn
+
+    python benchmarks/template_render.py [--renders N]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Nothing is queried; the app only needs a database URL to import
+SCRATCH_DATABASE = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'fyyur-template-bench.db')
+
+
+def contexts():
+    start = datetime(2026, 5, 1, 20, 0)
+    shows = [{
+        'venue_id': i % 7 + 1, 'venue_name': 'The Musical Hop %d' % i,
+        'artist_id': i % 11 + 1, 'artist_name': 'Guns N Petals %d' % i,
+        'artist_image_link': 'https://images.example.com/artist-%d.jpg' % i,
+        'start_time': str(start + timedelta(days=i)),
+    } for i in range(60)]
+    venue = {
+        'id': 1, 'name': 'The Musical Hop', 'genres': ['Jazz', 'Reggae', 'Swing', 'Classical', 'Folk'],
+        'address': '1015 Folsom Street', 'city': 'San Francisco', 'state': 'CA', 'phone': '123-123-1234',
+        'website': 'https://www.themusicalhop.com', 'facebook_link': 'https://www.facebook.com/TheMusicalHop',
+        'seeking_talent': True, 'seeking_description': 'We are on the lookout for a local artist.',
+        'image_link': 'https://images.example.com/venue-1.jpg',
+        'upcoming_shows': shows[:10], 'upcoming_shows_count': 10,
+        'past_shows': shows[10:30], 'past_shows_count': 20,
+    }
+    return {'pages/shows.html': {'shows': shows}, 'pages/show_venue.html': {'venue': venue}}
+
+
+def child(mode, renders):
+    # Runs in the fresh process; reports milliseconds as JSON on stdout
+    from flask import render_template
+    from app import app, preload_templates
+    app.jinja_env.auto_reload = mode == 'none'
+    if mode == 'preloaded':
+        preload_templates()
+    results = {}
+    for name, context in contexts().items():
+        with app.test_request_context('/'):
+            started = time.perf_counter()
+            render_template(name, **context)
+            first = time.perf_counter() - started
+            timings = []
+            for _ in range(renders):
+                started = time.perf_counter()
+                render_template(name, **context)
+                timings.append(time.perf_counter() - started)
+        results[name] = {'first': first * 1000, 'steady': statistics.median(timings) * 1000}
+    print(json.dumps(results))
+
+
+def run(mode, cache_dir, renders):
+    env = dict(os.environ, TEMPLATE_CACHE_DIR='' if mode == 'none' else cache_dir)
+    env.setdefault('DATABASE_URL', SCRATCH_DATABASE)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, '--renders', str(renders)],
+                            env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--renders', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per configuration')
+    parser.add_argument('--child')
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child, args.renders)
+
+    cache_dir = tempfile.mkdtemp(prefix='fyyur-template-bench-')
+    env = dict(os.environ, TEMPLATE_CACHE_DIR=cache_dir, FLASK_APP='app.py')
+    env.setdefault('DATABASE_URL', SCRATCH_DATABASE)
+    try:
+        print('%-10s %-22s %12s %12s' % ('mode', 'template', 'first ms', 'steady ms'))
+        for mode in ('none', 'cold', 'warm', 'preloaded'):
+            if mode == 'warm':
+                subprocess.run([sys.executable, '-m', 'flask', 'templates', 'compile'],
+                               env=env, cwd=ROOT, check=True, capture_output=True)
+            results = []
+            for _ in range(args.runs):
+                if mode == 'cold':
+                    shutil.rmtree(cache_dir)
+                    os.makedirs(cache_dir)
+                results.append(run(mode, cache_dir, args.renders))
+            for name in results[0]:
+                print('%-10s %-22s %12.2f %12.3f' % (
+                    mode, name,
+                    statistics.median(result[name]['first'] for result in results),
+                    statistics.median(result[name]['steady'] for result in results)))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Types worth compressing. Images, archives, fonts and the like are already compressed.
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/.*|application/(json|javascript|xml|xhtml\+xml|rss\+xml|atom\+xml|ld\+json)|image/svg\+xml)$')
+
+
+def accepted_encoding(header, available):
+    # The client's preferred encoding among `available` (in server preference order), or None
+    weights = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+    best, best_q = None, 0.0
+    for coding in available:
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        # wbits 31: a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        # Everything given so far, decodable by the client without waiting for more
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b''):
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self, data=b''):
+        return self.compressor.process(data) + self.compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compresses responses with brotli or gzip, whichever the client prefers per
+    Accept-Encoding. Bodies are read until minimum_size bytes have arrived: smaller
+    ones go out as they are, complete ones are compressed in one go, and longer
+    streamed ones are compressed chunk by chunk, each flushed so the browser can
+    render it before the rest is produced.
+
+    `record(encoding, bytes_in, bytes_out)` is called once per compressed response."""
+
+    def __init__(self, app, minimum_size=1024, level=6, brotli_quality=5, record=None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.record = record
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def encoder(self, encoding):
+        return BrotliEncoder(self.brotli_quality) if encoding == 'br' else GzipEncoder(self.level)
+
+    def __call__(self, environ, start_response):
+        encoding = accepted_encoding(environ.get('HTTP_ACCEPT_ENCODING'), self.encodings)
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response.update(status=status, headers=headers, exc_info=exc_info)
+            return write
+
+        def write(data):
+            raise RuntimeError('the WSGI write() callable is not supported with compression')
+
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+        body = self.app(environ, capture)
+        status, headers = response['status'], response['headers']
+        length = self.compressible(status, headers)
+        if length is False:
+            start_response(status, headers, response['exc_info'])
+            return body
+        return CompressedBody(self, encoding, body, status, headers, response['exc_info'], start_response,
+                              complete=length is not None)
+
+    def compressible(self, status, headers):
+        # False, or the Content-Length (None for a streamed body) of a response to compress
+        if status[:3] in ('204', '206', '304') or status[0] == '1':
+            return False
+        content_type = content_encoding = cache_control = ''
+        length = None
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-type':
+                content_type = value.split(';', 1)[0].strip().lower()
+            elif name == 'content-encoding':
+                content_encoding = value
+            elif name == 'cache-control':
+                cache_control = value.lower()
+            elif name == 'content-length':
+                length = int(value) if value.isdigit() else None
+        if not COMPRESSIBLE_TYPES.match(content_type) or content_encoding or 'no-transform' in cache_control:
+            return False
+        # The representation now depends on Accept-Encoding, even when this one is small
+        for i, (name, value) in enumerate(headers):
+            if name.lower() == 'vary':
+                headers[i] = (name, value + ', Accept-Encoding')
+                break
+        else:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if length is not None and length < self.minimum_size:
+            return False
+        return length
+
+
+class CompressedBody:
+    # The WSGI iterable for a compressed response; close() always reaches the app's body
+    def __init__(self, middleware, encoding, body, status, headers, exc_info, start_response, complete=False):
+        # complete: the body has a Content-Length, so it is read whole and sent with a new one
+        self.complete = complete
+        self.middleware = middleware
+        self.encoding = encoding
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.exc_info = exc_info
+        self.start_response = start_response
+
+    def __iter__(self):
+        minimum_size = self.middleware.minimum_size
+        chunks = iter(self.body)
+        buffered = []
+        size = 0
+        finished = False
+        while size < minimum_size or self.complete:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                finished = True
+                break
+            buffered.append(chunk)
+            size += len(chunk)
+        head = b''.join(buffered)
+        if size < minimum_size:
+            self.start_response(self.status, self.headers, self.exc_info)
+            yield head
+            return
+
+        encoder = self.middleware.encoder(self.encoding)
+        headers = [(name, value) for name, value in self.headers if name.lower() != 'content-length']
+        headers.append(('Content-Encoding', self.encoding))
+        for i, (name, value) in enumerate(headers):
+            # The compressed bytes differ from the ones the app's ETag names
+            if name.lower() == 'etag' and value.startswith('"'):
+                headers[i] = (name, 'W/' + value)
+        bytes_out = 0
+        try:
+            if finished:
+                data = encoder.finish(head)
+                headers.append(('Content-Length', str(len(data))))
+                self.start_response(self.status, headers, self.exc_info)
+                bytes_out = len(data)
+                yield data
+                return
+            self.start_response(self.status, headers, self.exc_info)
+            data = encoder.chunk(head)
+            bytes_out += len(data)
+            yield data
+            for chunk in chunks:
+                if chunk:
+                    size += len(chunk)
+                    data = encoder.chunk(chunk)
+                    bytes_out += len(data)
+                    yield data
+            data = encoder.finish()
+            bytes_out += len(data)
+            yield data
+        finally:
+            if self.middleware.record is not None and bytes_out:
+                self.middleware.record(self.encoding, size, bytes_out)
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
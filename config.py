@@ -1,10 +1,175 @@
 import os
-SECRET_KEY = os.urandom(32)
+import tempfile
+from urllib.parse import quote
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# FYYUR_ENV=production switches off debug mode and requires the settings below
+# to come from the environment
+PRODUCTION = os.environ.get('FYYUR_ENV') == 'production'
+
+# Every worker process must sign sessions with the same key
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY:
+    if PRODUCTION:
+        raise RuntimeError('SECRET_KEY must be set when FYYUR_ENV=production')
+    SECRET_KEY = os.urandom(32)
+
 # Enable debug mode.
-DEBUG = True
+DEBUG = os.environ.get('FLASK_DEBUG', '0' if PRODUCTION else '1') == '1'
+
+# Compiled Jinja templates, shared by every worker and kept across restarts; fill it
+# at build time with 'flask templates compile'
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(basedir, '.template_cache'))
+# Re-check template files for changes on every render: only while developing
+TEMPLATES_AUTO_RELOAD = DEBUG and not PRODUCTION
 
 # Connect to the database
-SQLALCHEMY_DATABASE_URI = 'postgresql://Maissoun@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://Maissoun@localhost:5432/fyyur')
+if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+    # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+
+# Read-only edge nodes (READ_ONLY=1) serve every page from the SQLite snapshot written by
+# 'flask snapshot export', opened immutable: SQLite then skips locking and change checks,
+# which is safe because a new export replaces the file instead of writing into it
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', os.path.join(basedir, 'snapshot.sqlite'))
+READ_ONLY = os.environ.get('READ_ONLY') == '1'
+if READ_ONLY:
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///file:%s?mode=ro&immutable=1&uri=true' % quote(os.path.abspath(SNAPSHOT_PATH))
+# Bytes of the snapshot each connection memory-maps, and seconds between checks for a new file
+SNAPSHOT_MMAP_BYTES = 2 ** 30
+SNAPSHOT_CHECK_INTERVAL = 5
+
+# One pooled connection per request thread (see gunicorn.conf.py); pre-ping drops
+# connections the server closed while idle
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_pre_ping': True,
+    'pool_size': WEB_THREADS,
+}
+
+# Seconds before a worker rebuilds its in-memory venue/artist match index
+MATCH_INDEX_MAX_AGE = 3600
+
+# Token required in the X-Admin-Token header by operational endpoints (/jobs, ...).
+# Without one they refuse every request, unless ALLOW_UNAUTHENTICATED_ADMIN=1 opens
+# them to anyone, e.g. on a developer's machine
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+ALLOW_UNAUTHENTICATED_ADMIN = os.environ.get('ALLOW_UNAUTHENTICATED_ADMIN') == '1'
+
+# Background jobs ('flask jobs work')
+JOB_WORKER_PROCESSES = os.cpu_count()
+JOB_POLL_INTERVAL = 1.0
+JOB_RETRY_BASE_SECONDS = 10
+# Workers refresh their running jobs' heartbeat this often; a running job whose
+# heartbeat is older than JOB_LOST_SECONDS lost its worker and is retried
+JOB_HEARTBEAT_SECONDS = 15
+JOB_LOST_SECONDS = 120
+
+# Monthly Show partitions to keep created ahead of the current month (Postgres only)
+SHOW_PARTITIONS_AHEAD = 3
+
+# In-process read model for the /venues, /artists and /shows pages. It catches up
+# from the outbox every READ_MODEL_SYNC_INTERVAL seconds and fully reloads after
+# READ_MODEL_MAX_AGE
+READ_MODEL_ENABLED = False
+READ_MODEL_MAX_AGE = 3600
+READ_MODEL_SYNC_INTERVAL = 1.0
+READ_MODEL_FACET_TTL = 60
+
+# Request profiling: X-Profile: 1|sample|trace with an admin token, or a random sample
+# of requests. Collapsed stacks and SQL are written under PROFILER_DIR and served at /_profiles
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') == '1'
+PROFILER_MODE = 'sample'
+PROFILER_SAMPLE_RATE = 0.0
+PROFILER_INTERVAL = 0.005
+PROFILER_DIR = os.path.join(basedir, 'profiles')
+PROFILER_KEEP = 200
+
+# change_event outbox: events per consumer batch, and how long consumed events are kept
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_RETAIN_DAYS = 7
+
+# Shows are assumed to last this long when checking bookings for overlaps
+SHOW_LENGTH_MINUTES = 180
+# Most occurrences a single show series may book
+SHOW_SERIES_MAX_OCCURRENCES = 104
+
+# Keep search_document current on every change; off only for bulk imports followed by 'flask search reindex'
+SEARCH_INDEX_ENABLED = True
+# A venue or artist rename rewrites its shows' documents in the same transaction. With
+# SEARCH_SHOW_REINDEX_JOB=1 the reindex_show_documents job does it instead, which keeps
+# renames of busy venues quick but leaves show results stale until a 'flask jobs work'
+# worker runs the job
+SEARCH_SHOW_REINDEX_JOB = os.environ.get('SEARCH_SHOW_REINDEX_JOB') == '1'
+
+# Image proxy: list and detail pages show thumbnails served from /img, fetched from the
+# original image_link once and kept in a size-capped LRU disk cache
+IMAGE_PROXY_ENABLED = True
+IMAGE_CACHE_DIR = os.path.join(basedir, 'image_cache')
+IMAGE_CACHE_MAX_BYTES = 512 * 2 ** 20
+IMAGE_FETCH_TIMEOUT = 5
+IMAGE_MAX_SOURCE_BYTES = 10 * 2 ** 20
+IMAGE_PROXY_MAX_AGE = 7 * 86400
+IMAGE_RETRY_SECONDS = 300
+# Allow fetching from private/loopback addresses, e.g. a local stand-in origin in tests
+IMAGE_PROXY_ALLOW_PRIVATE = False
+
+# Response compression: brotli when installed and accepted, else gzip, for HTML/JSON/CSS
+# of at least COMPRESSION_MIN_SIZE bytes. Turn off if a proxy in front compresses already
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
+# SQL statement budgets per view (@query_budget in app.py; QUERY_BUDGET_DEFAULT for the
+# rest). 'log' reports overruns as errors, 'raise' fails the request; the test suite
+# runs in 'raise' mode (tests/conftest.py)
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'log' if DEBUG else 'off')
+QUERY_BUDGET_DEFAULT = 20
+
+# Trending venues and artists: each booking counts 1, plus TRENDING_UPCOMING_BONUS for
+# a show within TRENDING_UPCOMING_DAYS of booking, halving every TRENDING_HALF_LIFE_DAYS.
+# Run the 'decay_trend_scores' job (or 'flask trending decay') daily
+TRENDING_HALF_LIFE_DAYS = 7
+TRENDING_UPCOMING_DAYS = 30
+TRENDING_UPCOMING_BONUS = 1.0
+TRENDING_HOME_LIMIT = 5
+
+# Sitemaps at /sitemap.xml, generated once per 50,000-id range and kept here until a
+# venue or artist in the range changes. Set SITEMAP_BASE_URL when the app is reached
+# under more than one host name, so every file names the canonical one
+SITEMAP_CACHE_DIR = os.path.join(basedir, 'sitemap_cache')
+SITEMAP_BASE_URL = os.environ.get('SITEMAP_BASE_URL')
+SITEMAP_MAX_AGE = 3600
+
+# Admission control for the search views: each client gets SEARCH_BURST searches,
+# refilled at SEARCH_RATE_PER_MINUTE, and at most SEARCH_MAX_CONCURRENT run at once on
+# the host. Workers share the state through files at ADMISSION_PATH (tmpfs if there is
+# one). Behind proxies that append to X-Forwarded-For, set ADMISSION_PROXY_HOPS to
+# their number so clients are told apart by their own address
+ADMISSION_ENABLED = True
+ADMISSION_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'fyyur-admission')
+ADMISSION_PROXY_HOPS = int(os.environ.get('ADMISSION_PROXY_HOPS', 0))
+SEARCH_RATE_PER_MINUTE = 30
+SEARCH_BURST = 10
+SEARCH_MAX_CONCURRENT = 8
+# Shorter venue and artist name searches match nearly every row and are refused;
+# longer ones list at most SEARCH_RESULT_CAP matches
+SEARCH_MIN_TERM_LENGTH = 2
+SEARCH_RESULT_CAP = 50
+
+# Duplicate listings: names whose trigram similarity reaches DEDUPE_THRESHOLD in the
+# same city count as likely duplicates; each listing is compared with its
+# DEDUPE_WINDOW nearest neighbours by name (and by phone number)
+DEDUPE_WINDOW = 10
+DEDUPE_THRESHOLD = 0.6
+
+# Memory tracing: a MEMORY_TRACE_SAMPLE_RATE fraction of requests (or X-Memory-Trace: 1
+# with an admin token) runs under tracemalloc, one at a time per worker; peak and
+# retained allocations by endpoint and source line are served at /_memory. Tracing
+# slows the sampled request and whatever runs beside it, so keep the rate low
+MEMORY_TRACE_ENABLED = os.environ.get('MEMORY_TRACE_ENABLED') == '1'
+MEMORY_TRACE_SAMPLE_RATE = 0.01
+MEMORY_TRACE_FRAMES = 25
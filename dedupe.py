@@ -0,0 +1,107 @@
+import re
+import unicodedata
+from collections import deque, namedtuple
+
+# Normalized keys for spotting a venue or artist listed twice: case, accents,
+# punctuation and spacing are ignored and '&' reads as 'and', so "Guns N' Petals"
+# and "guns n petals" share a name key.
+WORD = re.compile(r'[a-z0-9]+')
+
+# What the near-duplicate checks compare
+Record = namedtuple('Record', 'id name_key city_key state phone_key')
+
+
+def words(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return WORD.findall(text.casefold().replace('&', ' and '))
+
+
+def name_key(name):
+    return ' '.join(words(name)) or None
+
+
+city_key = name_key
+
+
+def phone_key(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        # The North American country code
+        digits = digits[1:]
+    return digits or None
+
+
+def trigrams(key):
+    # As pg_trgm: each word padded with two spaces in front and one behind
+    grams = set()
+    for word in (key or '').split():
+        padded = '  %s ' % word
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def overlap(a, b):
+    # Share of trigrams two trigram sets have in common, 0 to 1
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+def similarity(a, b):
+    return overlap(trigrams(a), trigrams(b))
+
+
+def match_score(a, b, a_trigrams=None, b_trigrams=None):
+    # How likely two records are one listing: name similarity for records in the same
+    # city and state, lifted halfway to 1 when they also share a phone number. Records
+    # in different places only compare when the phone matches. Pass the name keys'
+    # trigrams when they are at hand.
+    same_phone = a.phone_key is not None and a.phone_key == b.phone_key
+    if not same_phone and (a.city_key != b.city_key or a.state != b.state):
+        return 0.0
+    score = overlap(trigrams(a.name_key) if a_trigrams is None else a_trigrams,
+                    trigrams(b.name_key) if b_trigrams is None else b_trigrams)
+    return (score + 1.0) / 2 if same_phone else score
+
+
+def sorted_neighborhood(passes, window, threshold):
+    # {(id, id): score} for likely duplicates. Each pass is every record, sorted on a
+    # different key; a record is only compared with the window - 1 before it, so a pass
+    # costs n * window comparisons instead of n^2 / 2.
+    pairs = {}
+    for records in passes:
+        recent = deque(maxlen=max(window - 1, 1))
+        for record in records:
+            grams = trigrams(record.name_key)
+            for other, other_grams in recent:
+                if other.id == record.id:
+                    continue
+                score = match_score(record, other, grams, other_grams)
+                if score >= threshold:
+                    pair = (min(record.id, other.id), max(record.id, other.id))
+                    pairs[pair] = max(score, pairs.get(pair, 0.0))
+            recent.append((record, grams))
+    return pairs
+
+
+def clusters(pairs):
+    # Groups of ids linked by the pairs, each sorted, largest group first
+    parent = {}
+
+    def root(i):
+        parent.setdefault(i, i)
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups = {}
+    for i in parent:
+        groups.setdefault(root(i), []).append(i)
+    return sorted((sorted(group) for group in groups.values()), key=lambda group: (-len(group), group[0]))
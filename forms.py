@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, URL, Optional
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, DateField, TextAreaField, FloatField, HiddenField
+from wtforms.validators import DataRequired, URL, Optional, NumberRange
 
 class ShowForm(FlaskForm):
     artist_id = StringField(
@@ -16,6 +16,35 @@ class ShowForm(FlaskForm):
         default= datetime.today()
     )
 
+class ShowSeriesForm(FlaskForm):
+    artist_id = StringField(
+        'artist_id', validators=[DataRequired()]
+    )
+    venue_id = StringField(
+        'venue_id', validators=[DataRequired()]
+    )
+    start_time = DateTimeField(
+        'start_time',
+        validators=[DataRequired()],
+        default= datetime.today()
+    )
+    repeat = SelectField(
+        'repeat', validators=[DataRequired()],
+        choices=[
+            ('weekly', 'Every week'),
+            ('biweekly', 'Every two weeks'),
+            ('dates', 'On specific dates'),
+        ]
+    )
+    until = DateField(
+        # for weekly and biweekly series
+        'until', validators=[Optional()]
+    )
+    dates = TextAreaField(
+        # for specific dates: YYYY-MM-DD, one per line or comma separated
+        'dates', validators=[Optional()]
+    )
+
 class VenueForm(FlaskForm):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -82,6 +111,12 @@ class VenueForm(FlaskForm):
     address = StringField(
         'address', validators=[DataRequired()]
     )
+    latitude = FloatField(
+        'latitude', validators=[Optional(), NumberRange(-90, 90)]
+    )
+    longitude = FloatField(
+        'longitude', validators=[Optional(), NumberRange(-180, 180)]
+    )
     phone = StringField(
         'phone', validators=[DataRequired()]
     )
@@ -128,6 +163,8 @@ class VenueForm(FlaskForm):
     facebook_link = StringField(
         'facebook_link', validators=[Optional(), URL()]
     )
+    # The version the edit form was rendered from; a stale one refuses the edit
+    version = HiddenField('version')
 
 class ArtistForm(FlaskForm):
     name = StringField(
@@ -237,4 +274,5 @@ class ArtistForm(FlaskForm):
     )
     facebook_link = StringField(
         'facebook_link', validators=[Optional(), URL()]    # Can chain these
-    )
\ No newline at end of file
+    )
+    version = HiddenField('version')
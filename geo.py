@@ -0,0 +1,94 @@
+import math
+
+# Geohash cells: each character adds 5 bits, interleaving longitude and latitude
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Precision stored on venues; cells about 150 m across
+GEOHASH_PRECISION = 7
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if lng >= mid:
+                value = value * 2 + 1
+                lng_range[0] = mid
+            else:
+                value *= 2
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value *= 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # (height, width) of a cell in degrees
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    # (south, west, north, east) around a circle; longitudes are not wrapped
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if north >= 90.0 or south <= -90.0:
+        return south, -180.0, north, 180.0
+    dlng = dlat / max(math.cos(math.radians(max(abs(south), abs(north)))), 1e-12)
+    return south, max(-180.0, lng - dlng), north, min(180.0, lng + dlng)
+
+
+def covering_cells(lat, lng, radius_km, max_cells=16):
+    # The smallest set of same-length geohash prefixes covering the circle's bounding
+    # box, using the longest prefix that needs at most max_cells of them
+    south, west, north, east = bounding_box(lat, lng, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = int(math.floor(north / height) - math.floor(south / height)) + 1
+        columns = int(math.floor(east / width) - math.floor(west / width)) + 1
+        if rows * columns <= max_cells or precision == 1:
+            break
+    cells = set()
+    for row in range(rows):
+        cell_lat = min(north, south + row * height)
+        for column in range(columns):
+            cell_lng = min(east, west + column * width)
+            cells.add(encode(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+def prefix_upper_bound(prefix):
+    # The smallest geohash after every hash starting with prefix, or None if there is none.
+    # Geohash characters sort the same in byte order and the usual text collations.
+    chars = list(prefix)
+    while chars:
+        i = BASE32.index(chars[-1])
+        if i + 1 < len(BASE32):
+            chars[-1] = BASE32[i + 1]
+            return ''.join(chars)
+        chars.pop()
+    return None
@@ -0,0 +1,37 @@
+# Production server settings: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Graceful reload of new code: kill -USR2 <master> starts a new master with the new
+# code, then kill -WINCH and -TERM the old one once the new workers are up. kill -HUP
+# restarts the workers but, with preload_app, keeps the code the master loaded.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:%s' % os.environ.get('PORT', '8000'))
+
+# One process per core, each serving WEB_THREADS requests at a time; threads cover
+# the time requests spend waiting on Postgres and streaming pages to clients
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so in-process caches and fragmentation cannot grow forever
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened in the master (at import, or by preload) belong to it; drop
+    # them from this worker's pool without closing the master's sockets
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
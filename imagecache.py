@@ -0,0 +1,261 @@
+import fcntl
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it originals are cached unresized
+    Image = None
+
+# Thumbnail sizes the proxy will produce; anything else is rejected
+SIZES = {
+    'tile': (300, 300),
+    'detail': (600, 600),
+}
+THUMBNAIL_QUALITY = 80
+
+
+class FetchError(Exception):
+    pass
+
+
+def public_addresses(host, port):
+    # getaddrinfo results for host, refused if any address is loopback, private or
+    # link-local (metadata services, the database, ...): image links are user input
+    try:
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise FetchError('cannot resolve %s: %s' % (host, e))
+    for info in infos:
+        address = info[4][0]
+        if not ipaddress.ip_address(address.split('%', 1)[0]).is_global:
+            raise FetchError('%s resolves to non-public address %s' % (host, address))
+    return infos
+
+
+def connect_public(address, timeout=None, source_address=None):
+    # socket.create_connection for the connections below. The name is resolved once,
+    # here, and the addresses checked are the ones connected to, so a DNS answer that
+    # changes between a check and the connect (rebinding) cannot reach a private host.
+    # TLS still verifies and sends SNI for the host name.
+    host, port = address
+    error = None
+    for family, type_, proto, _, sockaddr in public_addresses(host, port):
+        sock = socket.socket(family, type_, proto)
+        try:
+            if isinstance(timeout, (int, float)):
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or FetchError('no addresses for %s' % host)
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+def check_url(url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise FetchError('not an http(s) URL: %r' % url)
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Redirects are followed only to http(s) URLs; their hosts are checked on connect
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def fetch_image(url, timeout=5, max_bytes=10 * 2 ** 20, allow_private=False):
+    # (bytes, content type) of an http(s) image, read up to max_bytes
+    check_url(url)
+    handlers = [CheckedRedirectHandler()]
+    if not allow_private:
+        handlers += [PublicHTTPHandler(), PublicHTTPSHandler()]
+    opener = urllib.request.build_opener(*handlers)
+    request = urllib.request.Request(url, headers={'User-Agent': 'fyyur-image-proxy'})
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                raise FetchError('%s is %s, not an image' % (url, content_type))
+            data = response.read(max_bytes + 1)
+    except OSError as e:
+        raise FetchError('fetching %s failed: %s' % (url, e))
+    if len(data) > max_bytes:
+        raise FetchError('%s is larger than %d bytes' % (url, max_bytes))
+    return data, content_type
+
+
+def make_thumbnail(data, content_type, size):
+    # Crops to the size's aspect ratio and scales down, as JPEG. Without Pillow the
+    # original is returned unchanged.
+    if Image is None:
+        return data, content_type
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            image = ImageOps.fit(image.convert('RGB'), SIZES[size], Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise FetchError('cannot decode image: %s' % e)
+    return out.getvalue(), 'image/jpeg'
+
+
+class ImageCache:
+    """Thumbnails on disk, stored once per distinct content under blobs/<sha256> with
+    small refs/<key> files mapping a (url, size) key to a blob. Reads refresh the
+    mtimes of both; once the blobs pass max_bytes the least recently used are removed
+    until they are under low_water of it. Safe for several processes sharing the
+    directory: files are written atomically, the byte count in .size is shared and
+    updated under a file lock, and eviction takes a file lock."""
+
+    def __init__(self, directory, max_bytes, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.blobs = os.path.join(directory, 'blobs')
+        self.refs = os.path.join(directory, 'refs')
+        os.makedirs(self.blobs, exist_ok=True)
+        os.makedirs(self.refs, exist_ok=True)
+        self.size_path = os.path.join(directory, '.size')
+
+    @staticmethod
+    def key(url, size):
+        return hashlib.sha256(('%s\n%s' % (size, url)).encode()).hexdigest()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs, digest[:2], digest)
+
+    def write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def get(self, key):
+        # (path, content type, digest) of the cached blob, or None
+        try:
+            with open(os.path.join(self.refs, key)) as ref:
+                digest, content_type = ref.read().split()
+        except (FileNotFoundError, ValueError):
+            return None
+        path = self.blob_path(digest)
+        try:
+            os.utime(path)
+            os.utime(os.path.join(self.refs, key))
+        except FileNotFoundError:
+            return None
+        return path, content_type, digest
+
+    def put(self, key, data, content_type):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        stored = None
+        if not os.path.exists(path):
+            self.write_atomic(path, data)
+            stored = self.add_bytes(len(data))
+        else:
+            os.utime(path)
+        self.write_atomic(os.path.join(self.refs, key), ('%s %s' % (digest, content_type)).encode())
+        if stored is not None and stored > self.max_bytes:
+            self.evict()
+        return path, content_type, digest
+
+    def add_bytes(self, delta, total=None):
+        # Adds delta to the bytes stored by every process sharing the directory, or sets
+        # them to total, and returns the result. Counted from the files on first use.
+        with open(self.size_path, 'a+b') as count:
+            fcntl.flock(count, fcntl.LOCK_EX)
+            count.seek(0)
+            current = count.read().strip()
+            if total is None:
+                # A first count already includes the blob just written
+                total = int(current) + delta if current else self.stored_bytes()
+            count.seek(0)
+            count.truncate()
+            count.write(b'%d' % total)
+        return total
+
+    def blob_files(self):
+        # (mtime, size, path) of every blob; another process may be evicting meanwhile
+        for entry in os.scandir(self.blobs):
+            if entry.is_dir():
+                for blob in os.scandir(entry.path):
+                    if blob.name.startswith('.'):
+                        continue
+                    try:
+                        stat = blob.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, blob.path
+
+    def stored_bytes(self):
+        return sum(size for _, size, _ in self.blob_files())
+
+    def evict(self):
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            blobs = sorted(self.blob_files())
+            total = sum(size for _, size, _ in blobs)
+            target = self.max_bytes * self.low_water
+            for _, size, path in blobs:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            # Refs to evicted blobs are dropped lazily; prune ones nobody read for a while
+            cutoff = time.time() - 7 * 86400
+            for ref in os.scandir(self.refs):
+                try:
+                    if ref.stat().st_mtime < cutoff:
+                        os.remove(ref.path)
+                except FileNotFoundError:
+                    pass
+            # Corrects any drift in the shared count, e.g. from a process that died between
+            # writing a blob and counting it
+            self.add_bytes(0, total)
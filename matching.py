@@ -0,0 +1,129 @@
+import heapq
+import math
+import threading
+
+# Score weights: shared genres dominate, then location, then how busy the candidate is
+GENRE_WEIGHT = 1.0
+CITY_WEIGHT = 2.0
+STATE_WEIGHT = 1.0
+ACTIVITY_WEIGHT = 0.5
+
+
+def location_key(value):
+    return ' '.join((value or '').casefold().split())
+
+
+class Entry:
+    __slots__ = ('id', 'name', 'city', 'state', 'genres', 'activity')
+
+    def __init__(self, id, name, city, state, genres, activity=0):
+        self.id = id
+        self.name = name
+        self.city = location_key(city)
+        self.state = location_key(state)
+        self.genres = frozenset(genres)
+        self.activity = activity
+
+    def keys(self):
+        for genre in self.genres:
+            yield (genre, self.state, self.city), (genre, self.state), genre
+
+
+class MatchIndex:
+    """Entities that are seeking a match, indexed by (genre, state, city) with wider
+    (genre, state) and genre postings used only when the narrow ones run out."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.by_city = {}
+        self.by_state = {}
+        self.by_genre = {}
+        self.max_activity = 0
+        # ids changed since the last refresh, reloaded lazily before the next query
+        self.pending = set()
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_city.clear()
+            self.by_state.clear()
+            self.by_genre.clear()
+            self.max_activity = 0
+            self.pending.clear()
+
+    def upsert(self, entry):
+        with self.lock:
+            self.remove(entry.id)
+            self.entries[entry.id] = entry
+            for city_key, state_key, genre in entry.keys():
+                self.by_city.setdefault(city_key, set()).add(entry.id)
+                self.by_state.setdefault(state_key, set()).add(entry.id)
+                self.by_genre.setdefault(genre, set()).add(entry.id)
+            self.max_activity = max(self.max_activity, entry.activity)
+
+    def remove(self, entry_id):
+        with self.lock:
+            entry = self.entries.pop(entry_id, None)
+            if entry is None:
+                return
+            for city_key, state_key, genre in entry.keys():
+                for postings, key in ((self.by_city, city_key), (self.by_state, state_key), (self.by_genre, genre)):
+                    ids = postings.get(key)
+                    if ids is not None:
+                        ids.discard(entry_id)
+                        if not ids:
+                            del postings[key]
+
+    def add_activity(self, entry_id, count=1):
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            if entry is not None:
+                entry.activity += count
+                self.max_activity = max(self.max_activity, entry.activity)
+
+    def score(self, source, entry):
+        shared = source.genres & entry.genres
+        score = GENRE_WEIGHT * len(shared) + ACTIVITY_WEIGHT * math.log1p(entry.activity)
+        if entry.state == source.state:
+            score += STATE_WEIGHT
+            if entry.city == source.city:
+                score += CITY_WEIGHT
+        return score, shared
+
+    def top(self, source, k=10, exclude=None):
+        # Widen from same city to same state to anywhere, stopping once nothing further
+        # out could beat the current k-th best score.
+        if k < 1:
+            return []
+        best_activity = ACTIVITY_WEIGHT * math.log1p(self.max_activity)
+        levels = (
+            (self.by_city, lambda g: (g, source.state, source.city), None),
+            (self.by_state, lambda g: (g, source.state), GENRE_WEIGHT * len(source.genres) + STATE_WEIGHT + best_activity),
+            (self.by_genre, lambda g: g, GENRE_WEIGHT * len(source.genres) + best_activity),
+        )
+        with self.lock:
+            seen = set()
+            if exclude is not None:
+                seen.add(exclude)
+            heap = []  # min-heap of (score, id, shared) holding the best k so far
+            for postings, key, bound in levels:
+                if bound is not None and len(heap) >= k and heap[0][0] >= bound:
+                    break
+                for genre in source.genres:
+                    for entry_id in postings.get(key(genre), ()):
+                        if entry_id in seen:
+                            continue
+                        seen.add(entry_id)
+                        score, shared = self.score(source, self.entries[entry_id])
+                        item = (score, -entry_id, shared)
+                        if len(heap) < k:
+                            heapq.heappush(heap, item)
+                        elif item[:2] > heap[0][:2]:
+                            heapq.heapreplace(heap, item)
+            ranked = sorted(heap, key=lambda item: item[:2], reverse=True)
+            return [(self.entries[-neg_id], score, shared) for score, neg_id, shared in ranked]
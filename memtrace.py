@@ -0,0 +1,146 @@
+import gc
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# tracemalloc runs only while a sampled request is being measured, one request per
+# process at a time, so requests that are not sampled pay nothing. It traces every
+# thread, though: allocations by requests running alongside the sampled one are
+# counted with it, which averages out over many samples.
+
+# Lines kept per endpoint between reports
+KEEP_LINES = 100
+
+
+def resident_bytes():
+    # This process's current resident set size, or its peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def attribute(snapshot, root):
+    # {'file:line': bytes}, each allocation charged to the most recent frame in the
+    # app's own code under root (not its dependencies), else to its innermost frame
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, __file__)])
+    totals = Counter()
+    for stat in snapshot.statistics('traceback'):
+        # Frames run from the oldest to the most recent
+        chosen = stat.traceback[-1]
+        for frame in reversed(stat.traceback):
+            if frame.filename.startswith(root) and 'site-packages' not in frame.filename:
+                chosen = frame
+                break
+        filename = os.path.relpath(chosen.filename, root) if chosen.filename.startswith(root) else chosen.filename
+        totals['%s:%d' % (filename, chosen.lineno)] += stat.size
+    return totals
+
+
+class RequestTrace:
+    """tracemalloc around one request. checkpoint() keeps a snapshot whenever traced
+    memory is higher than at any earlier checkpoint, which stands in for the peak:
+    tracemalloc only knows the peak's size, not what was allocated at the time."""
+
+    def __init__(self, endpoint, frames):
+        self.endpoint = endpoint
+        self.frames = frames
+        self.largest = -1
+        self.largest_snapshot = None
+
+    def start(self):
+        tracemalloc.start(self.frames)
+        self.started = time.perf_counter()
+        return self
+
+    def checkpoint(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if current > self.largest:
+            self.largest = current
+            self.largest_snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        # Peak and retained bytes; retained is what the request allocated that is still
+        # alive once it is over and cycles are collected: caches, or a leak
+        self.peak = tracemalloc.get_traced_memory()[1]
+        gc.collect()
+        self.retained = tracemalloc.get_traced_memory()[0]
+        self.retained_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        self.seconds = time.perf_counter() - self.started
+
+
+class MemoryTracker:
+    """Peak and retained allocations of sampled requests in this process, by endpoint
+    and by source line."""
+
+    def __init__(self, root, frames=25):
+        self.root = os.path.abspath(root)
+        self.frames = frames
+        self.lock = threading.Lock()
+        # Held while a request is traced
+        self.tracing = threading.Lock()
+        self.endpoints = {}
+
+    def begin(self, endpoint):
+        # A started RequestTrace, or None while another request (or anything else in
+        # the process) is using tracemalloc
+        if not self.tracing.acquire(blocking=False):
+            return None
+        if tracemalloc.is_tracing():
+            self.tracing.release()
+            return None
+        return RequestTrace(endpoint, self.frames).start()
+
+    def end(self, trace):
+        try:
+            trace.stop()
+        finally:
+            self.tracing.release()
+        peak_lines = attribute(trace.largest_snapshot, self.root) if trace.largest_snapshot else Counter()
+        retained_lines = attribute(trace.retained_snapshot, self.root)
+        trace.largest_snapshot = trace.retained_snapshot = None
+        with self.lock:
+            stats = self.endpoints.setdefault(trace.endpoint, {
+                'samples': 0, 'peak_max': 0, 'peak_total': 0, 'retained_max': 0, 'retained_total': 0,
+                'peak_lines': Counter(), 'retained_lines': Counter()})
+            stats['samples'] += 1
+            stats['peak_max'] = max(stats['peak_max'], trace.peak)
+            stats['peak_total'] += trace.peak
+            stats['retained_max'] = max(stats['retained_max'], trace.retained)
+            stats['retained_total'] += trace.retained
+            for key, lines in (('peak_lines', peak_lines), ('retained_lines', retained_lines)):
+                stats[key].update(lines)
+                if len(stats[key]) > KEEP_LINES:
+                    stats[key] = Counter(dict(stats[key].most_common(KEEP_LINES)))
+            return dict(stats)
+
+    def report(self, top=10):
+        # Endpoints by largest peak, each with its top lines averaged per sample
+        with self.lock:
+            endpoints = [(endpoint, dict(stats)) for endpoint, stats in self.endpoints.items()]
+        report = []
+        for endpoint, stats in sorted(endpoints, key=lambda item: -item[1]['peak_max']):
+            samples = stats['samples']
+            report.append({
+                "endpoint": endpoint,
+                "samples": samples,
+                "peak_max_bytes": stats['peak_max'],
+                "peak_mean_bytes": stats['peak_total'] // samples,
+                "retained_max_bytes": stats['retained_max'],
+                "retained_mean_bytes": stats['retained_total'] // samples,
+                "peak_lines": [{"line": line, "mean_bytes": size // samples}
+                               for line, size in stats['peak_lines'].most_common(top)],
+                "retained_lines": [{"line": line, "mean_bytes": size // samples}
+                                   for line, size in stats['retained_lines'].most_common(top)],
+            })
+        return report
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
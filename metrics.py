@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class Metrics:
+    """Counters and gauges for this process, keyed by name and labels. Each worker
+    keeps its own; the /_metrics response says which process answered."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def snapshot(self):
+        # [{name, type, labels, value}] sorted by name
+        with self.lock:
+            items = [(key, 'counter', value) for key, value in self.counters.items()]
+            items += [(key, 'gauge', value) for key, value in self.gauges.items()]
+        return [{"name": name, "type": kind, "labels": dict(labels), "value": value}
+                for (name, labels), kind, value in sorted(items, key=lambda item: item[0])]
+
+    def prometheus(self):
+        # The snapshot in Prometheus' text exposition format
+        lines = []
+        typed = set()
+        for metric in self.snapshot():
+            if metric['name'] not in typed:
+                typed.add(metric['name'])
+                lines.append('# TYPE %s %s' % (metric['name'], metric['type']))
+            labels = ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in sorted(metric['labels'].items()))
+            lines.append('%s%s %s' % (metric['name'], '{%s}' % labels if labels else '', metric['value']))
+        return '\n'.join(lines) + '\n'
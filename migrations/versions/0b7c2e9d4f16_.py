@@ -0,0 +1,38 @@
+"""venue and artist dedupe keys
+
+Revision ID: 0b7c2e9d4f16
+Revises: 6e1d8b3f0a29
+Create Date: 2026-10-19 18:12:35.904127
+
+The keys start empty; fill them with 'flask dedupe keys' after upgrading.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7c2e9d4f16'
+down_revision = '6e1d8b3f0a29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('name_key', sa.String(), nullable=True))
+            batch_op.add_column(sa.Column('city_key', sa.String(length=120), nullable=True))
+            batch_op.add_column(sa.Column('phone_key', sa.String(length=20), nullable=True))
+            batch_op.create_index('ix_%s_dedupe' % table, ['city_key', 'state', 'name_key'], unique=False)
+            batch_op.create_index(batch_op.f('ix_%s_phone_key' % table), ['phone_key'], unique=False)
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f('ix_%s_phone_key' % table))
+            batch_op.drop_index('ix_%s_dedupe' % table)
+            batch_op.drop_column('phone_key')
+            batch_op.drop_column('city_key')
+            batch_op.drop_column('name_key')
@@ -0,0 +1,41 @@
+"""cascade deletes from venues, artists and genres
+
+Revision ID: 3c1f2a9d8e47
+Revises: a76b966eaab4
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f2a9d8e47'
+down_revision = 'a76b966eaab4'
+branch_labels = None
+depends_on = None
+
+
+# (table, column, referenced table) for every foreign key that should cascade
+CASCADING_KEYS = [
+    ('Show', 'artist_id', 'Artist'),
+    ('Show', 'venue_id', 'Venue'),
+    ('artist_genre_table', 'artist_id', 'Artist'),
+    ('artist_genre_table', 'genre_id', 'Genre'),
+    ('venue_genre_table', 'venue_id', 'Venue'),
+    ('venue_genre_table', 'genre_id', 'Genre'),
+]
+
+
+def upgrade():
+    for table, column, referent in CASCADING_KEYS:
+        name = f'{table}_{column}_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referent, [column], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    for table, column, referent in CASCADING_KEYS:
+        name = f'{table}_{column}_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referent, [column], ['id'])
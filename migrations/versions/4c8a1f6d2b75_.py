@@ -0,0 +1,30 @@
+"""venue and artist version
+
+Revision ID: 4c8a1f6d2b75
+Revises: 0b7c2e9d4f16
+Create Date: 2026-10-19 21:05:47.318862
+
+Existing rows start at version 1.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8a1f6d2b75'
+down_revision = '0b7c2e9d4f16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
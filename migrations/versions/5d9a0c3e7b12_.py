@@ -0,0 +1,26 @@
+"""show indexes by venue and artist start time
+
+Revision ID: 5d9a0c3e7b12
+Revises: 8b24e6f0c915
+Create Date: 2026-10-19 10:48:05.203771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9a0c3e7b12'
+down_revision = '8b24e6f0c915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,36 @@
+"""venue and artist updated_at
+
+Revision ID: 6e1d8b3f0a29
+Revises: a94c0e1b7d52
+Create Date: 2026-10-19 16:41:08.527316
+
+Existing rows are stamped with the time of the upgrade.
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e1d8b3f0a29'
+down_revision = 'a94c0e1b7d52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    now = datetime.now()
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(sa.table(table, sa.column('updated_at', sa.DateTime())).update().values(updated_at=now))
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
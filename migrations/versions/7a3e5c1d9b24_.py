@@ -0,0 +1,42 @@
+"""change_event outbox and consumer checkpoints
+
+Revision ID: 7a3e5c1d9b24
+Revises: e2a6d41f9c80
+Create Date: 2026-10-19 13:31:08.214577
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3e5c1d9b24'
+down_revision = 'e2a6d41f9c80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_event',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('op', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('data', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index(op.f('ix_change_event_created_at'), 'change_event', ['created_at'], unique=False)
+    op.create_table('change_consumer',
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('position', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('change_consumer')
+    op.drop_index(op.f('ix_change_event_created_at'), table_name='change_event')
+    op.drop_table('change_event')
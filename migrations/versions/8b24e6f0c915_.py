@@ -0,0 +1,46 @@
+"""genre facet counts
+
+Revision ID: 8b24e6f0c915
+Revises: 3c1f2a9d8e47
+Create Date: 2026-10-19 10:02:17.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b24e6f0c915'
+down_revision = '3c1f2a9d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('genre_facet',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('artist_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('venue_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('upcoming_show_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre_id')
+    )
+    op.create_index(op.f('ix_Genre_name'), 'Genre', ['name'], unique=False)
+    # Seed the counts for existing data; the app keeps them current from here on
+    op.execute('''
+        INSERT INTO genre_facet (genre_id, artist_count, venue_count, upcoming_show_count, refreshed_at)
+        SELECT g.id,
+            (SELECT count(*) FROM artist_genre_table ag WHERE ag.genre_id = g.id),
+            (SELECT count(*) FROM venue_genre_table vg WHERE vg.genre_id = g.id),
+            (SELECT count(*) FROM "Show" s
+                JOIN artist_genre_table ag ON ag.artist_id = s.artist_id
+                WHERE ag.genre_id = g.id AND s.start_time > now()),
+            now()
+        FROM "Genre" g
+    ''')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Genre_name'), table_name='Genre')
+    op.drop_table('genre_facet')
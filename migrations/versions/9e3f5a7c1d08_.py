@@ -0,0 +1,29 @@
+"""job heartbeat
+
+Revision ID: 9e3f5a7c1d08
+Revises: 4c8a1f6d2b75
+Create Date: 2026-10-20 09:14:22.508316
+
+Jobs running during the upgrade have no heartbeat yet; the reaper falls back to
+their start time.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3f5a7c1d08'
+down_revision = '4c8a1f6d2b75'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
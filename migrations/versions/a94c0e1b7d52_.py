@@ -0,0 +1,62 @@
+"""trending scores
+
+Revision ID: a94c0e1b7d52
+Revises: f3b7a9c2d418
+Create Date: 2026-10-19 15:02:44.180512
+
+Existing shows are taken as booked when they started (or now, for upcoming ones).
+Scores start at zero; fill them with 'flask trending rebuild' after upgrading.
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a94c0e1b7d52'
+down_revision = 'f3b7a9c2d418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    now = datetime.now()
+    op.create_table('trend_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('landmark', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(sa.table('trend_state', sa.column('id'), sa.column('landmark')).insert().values(id=1, landmark=now))
+
+    with op.batch_alter_table('Venue', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('trend_score', sa.Float(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_Venue_trend_score'), ['trend_score'], unique=False)
+
+    with op.batch_alter_table('Artist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('trend_score', sa.Float(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_Artist_trend_score'), ['trend_score'], unique=False)
+
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+    shows = sa.table('Show', sa.column('start_time', sa.DateTime()), sa.column('created_at', sa.DateTime()))
+    op.execute(shows.update().values(
+        created_at=sa.case((shows.c.start_time < now, shows.c.start_time), else_=sa.literal(now))))
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
+
+    with op.batch_alter_table('Artist', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Artist_trend_score'))
+        batch_op.drop_column('trend_score')
+
+    with op.batch_alter_table('Venue', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Venue_trend_score'))
+        batch_op.drop_column('trend_score')
+
+    op.drop_table('trend_state')
@@ -0,0 +1,48 @@
+"""recurring show series
+
+Revision ID: b81f4d2c6e35
+Revises: 7a3e5c1d9b24
+Create Date: 2026-10-19 13:52:44.901233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81f4d2c6e35'
+down_revision = '7a3e5c1d9b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_series',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('rule', sa.String(length=20), nullable=False),
+    sa.Column('first_start', sa.DateTime(), nullable=False),
+    sa.Column('until', sa.Date(), nullable=True),
+    sa.Column('dates', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_show_series_artist_id'), 'show_series', ['artist_id'], unique=False)
+    op.create_index(op.f('ix_show_series_venue_id'), 'show_series', ['venue_id'], unique=False)
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('series_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_Show_series_id'), ['series_id'], unique=False)
+        batch_op.create_foreign_key('Show_series_id_fkey', 'show_series', ['series_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('Show', schema=None) as batch_op:
+        batch_op.drop_constraint('Show_series_id_fkey', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_Show_series_id'))
+        batch_op.drop_column('series_id')
+    op.drop_index(op.f('ix_show_series_venue_id'), table_name='show_series')
+    op.drop_index(op.f('ix_show_series_artist_id'), table_name='show_series')
+    op.drop_table('show_series')
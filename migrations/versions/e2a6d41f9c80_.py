@@ -0,0 +1,110 @@
+"""partition Show by month and keep archived show counts
+
+Revision ID: e2a6d41f9c80
+Revises: c47e19b5a2d3
+Create Date: 2026-10-19 12:41:26.873405
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a6d41f9c80'
+down_revision = 'c47e19b5a2d3'
+branch_labels = None
+depends_on = None
+
+# Partitions created ahead of the current month; the app keeps extending this
+# with 'flask shows partitions' (or the ensure_show_partitions job)
+MONTHS_AHEAD = 3
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def upgrade():
+    op.create_table('show_archive_summary',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('show_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('month', 'venue_id', 'artist_id')
+    )
+    op.create_index(op.f('ix_show_archive_summary_venue_id'), 'show_archive_summary', ['venue_id'], unique=False)
+    op.create_index(op.f('ix_show_archive_summary_artist_id'), 'show_archive_summary', ['artist_id'], unique=False)
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_unpartitioned"')
+    op.execute('ALTER INDEX "Show_pkey" RENAME TO "Show_unpartitioned_pkey"')
+    op.execute('ALTER INDEX "ix_Show_venue_id_start_time" RENAME TO "ix_Show_unpartitioned_venue_id_start_time"')
+    op.execute('ALTER INDEX "ix_Show_artist_id_start_time" RENAME TO "ix_Show_unpartitioned_artist_id_start_time"')
+    # The partition key has to be part of the primary key
+    op.execute('''
+        CREATE TABLE "Show" (
+            id integer NOT NULL DEFAULT nextval('"Show_id_seq"'::regclass),
+            start_time timestamp without time zone NOT NULL,
+            artist_id integer NOT NULL,
+            venue_id integer NOT NULL,
+            CONSTRAINT "Show_pkey" PRIMARY KEY (id, start_time),
+            CONSTRAINT "Show_artist_id_fkey" FOREIGN KEY (artist_id) REFERENCES "Artist" (id) ON DELETE CASCADE,
+            CONSTRAINT "Show_venue_id_fkey" FOREIGN KEY (venue_id) REFERENCES "Venue" (id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (start_time)
+    ''')
+    op.execute('CREATE INDEX "ix_Show_venue_id_start_time" ON "Show" (venue_id, start_time)')
+    op.execute('CREATE INDEX "ix_Show_artist_id_start_time" ON "Show" (artist_id, start_time)')
+    op.execute('CREATE TABLE "Show_default" PARTITION OF "Show" DEFAULT')
+
+    this_month = datetime.now().date().replace(day=1)
+    earliest = bind.execute(sa.text('SELECT min(start_time) FROM "Show_unpartitioned"')).scalar()
+    month = min(earliest.date().replace(day=1), this_month) if earliest else this_month
+    while month <= add_months(this_month, MONTHS_AHEAD):
+        op.execute(
+            f'CREATE TABLE "Show_p{month:%Y_%m}" PARTITION OF "Show" '
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        )
+        month = add_months(month, 1)
+
+    op.execute('INSERT INTO "Show" (id, start_time, artist_id, venue_id) '
+               'SELECT id, start_time, artist_id, venue_id FROM "Show_unpartitioned"')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+    op.execute('DROP TABLE "Show_unpartitioned"')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('ALTER TABLE "Show" RENAME TO "Show_partitioned"')
+        op.execute('ALTER INDEX "Show_pkey" RENAME TO "Show_partitioned_pkey"')
+        op.execute('ALTER INDEX "ix_Show_venue_id_start_time" RENAME TO "ix_Show_partitioned_venue_id_start_time"')
+        op.execute('ALTER INDEX "ix_Show_artist_id_start_time" RENAME TO "ix_Show_partitioned_artist_id_start_time"')
+        op.execute('''
+            CREATE TABLE "Show" (
+                id integer NOT NULL DEFAULT nextval('"Show_id_seq"'::regclass),
+                start_time timestamp without time zone NOT NULL,
+                artist_id integer NOT NULL,
+                venue_id integer NOT NULL,
+                CONSTRAINT "Show_pkey" PRIMARY KEY (id),
+                CONSTRAINT "Show_artist_id_fkey" FOREIGN KEY (artist_id) REFERENCES "Artist" (id) ON DELETE CASCADE,
+                CONSTRAINT "Show_venue_id_fkey" FOREIGN KEY (venue_id) REFERENCES "Venue" (id) ON DELETE CASCADE
+            )
+        ''')
+        op.execute('CREATE INDEX "ix_Show_venue_id_start_time" ON "Show" (venue_id, start_time)')
+        op.execute('CREATE INDEX "ix_Show_artist_id_start_time" ON "Show" (artist_id, start_time)')
+        op.execute('INSERT INTO "Show" (id, start_time, artist_id, venue_id) '
+                   'SELECT id, start_time, artist_id, venue_id FROM "Show_partitioned"')
+        op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+        op.execute('DROP TABLE "Show_partitioned" CASCADE')
+
+    op.drop_index(op.f('ix_show_archive_summary_artist_id'), table_name='show_archive_summary')
+    op.drop_index(op.f('ix_show_archive_summary_venue_id'), table_name='show_archive_summary')
+    op.drop_table('show_archive_summary')
@@ -0,0 +1,75 @@
+"""full-text search documents
+
+Revision ID: f3b7a9c2d418
+Revises: d5c28e7f1a63
+Create Date: 2026-10-19 14:41:09.366021
+
+The table starts empty; fill it with 'flask search reindex' (or the
+rebuild_search_index job) after upgrading. Change hooks keep it current from then on.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7a9c2d418'
+down_revision = 'd5c28e7f1a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('search_document',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=True),
+    sa.Column('artist_id', sa.Integer(), nullable=True),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('subtitle', sa.String(), nullable=True),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('starts_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'entity_id', name='uq_search_document_kind_entity')
+    )
+    op.create_index(op.f('ix_search_document_artist_id'), 'search_document', ['artist_id'], unique=False)
+    op.create_index('ix_search_document_kind_starts_at', 'search_document', ['kind', 'starts_at'], unique=False)
+    op.create_index(op.f('ix_search_document_venue_id'), 'search_document', ['venue_id'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "ALTER TABLE search_document ADD COLUMN document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(subtitle, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(body, '')), 'C')) STORED"
+        )
+        op.execute("CREATE INDEX ix_search_document_document ON search_document USING gin (document)")
+    elif op.get_bind().dialect.name == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE search_fts USING fts5(title, subtitle, body, "
+            "content='search_document', content_rowid='id', prefix='2 3')"
+        )
+        op.execute(
+            "CREATE TRIGGER search_document_ai AFTER INSERT ON search_document BEGIN "
+            "INSERT INTO search_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body); END"
+        )
+        op.execute(
+            "CREATE TRIGGER search_document_ad AFTER DELETE ON search_document BEGIN "
+            "INSERT INTO search_fts(search_fts, rowid, title, subtitle, body) "
+            "VALUES ('delete', old.id, old.title, old.subtitle, old.body); END"
+        )
+        op.execute(
+            "CREATE TRIGGER search_document_au AFTER UPDATE ON search_document BEGIN "
+            "INSERT INTO search_fts(search_fts, rowid, title, subtitle, body) "
+            "VALUES ('delete', old.id, old.title, old.subtitle, old.body); "
+            "INSERT INTO search_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body); END"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE search_fts")
+    op.drop_index(op.f('ix_search_document_venue_id'), table_name='search_document')
+    op.drop_index('ix_search_document_kind_starts_at', table_name='search_document')
+    op.drop_index(op.f('ix_search_document_artist_id'), table_name='search_document')
+    op.drop_table('search_document')
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Profile files are named <started>-<endpoint>-<thread>; nothing else is served
+PROFILE_NAME = re.compile(r'^[0-9]+-[A-Za-z0-9_.]+-[0-9]+$')
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+def collapse(frame):
+    # Root-first 'file:function' frames joined with ';', the format flamegraph.pl and speedscope read
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """Collapsed stacks and the SQL issued for one request thread, between start()
+    and stop(). Stack weights are samples or microseconds depending on the subclass."""
+
+    mode = None
+    unit = None
+
+    def __init__(self, thread_id, interval, label):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.label = label
+        self.stacks = Counter()
+        self.queries = []
+        self.started = time.time()
+        self.duration = None
+
+    def start(self):
+        return self
+
+    def stop(self):
+        if self.duration is None:
+            self.duration = time.time() - self.started
+        return self
+
+    def add_query(self, statement, parameters, duration):
+        self.queries.append({
+            "statement": statement,
+            "parameters": repr(parameters)[:500],
+            "duration_ms": round(duration * 1000, 3)
+        })
+
+    @property
+    def name(self):
+        return '%d-%s-%d' % (self.started * 1000, re.sub(r'[^A-Za-z0-9_.]', '_', self.label), self.thread_id)
+
+    def save(self, directory, meta=None, keep=None):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name)
+        with open(base + '.folded', 'w') as folded:
+            for stack, weight in self.stacks.most_common():
+                if round(weight):
+                    folded.write('%s %d\n' % (stack, round(weight)))
+        with open(base + '.json', 'w') as info:
+            json.dump(dict(meta or {}, name=self.name, mode=self.mode, unit=self.unit, started=self.started,
+                           duration_ms=round(self.duration * 1000, 3), interval_ms=self.interval * 1000,
+                           total=round(sum(self.stacks.values())), queries=self.queries), info, indent=2)
+        if keep:
+            for old in list_profiles(directory)[keep:]:
+                for suffix in ('.folded', '.json'):
+                    try:
+                        os.remove(os.path.join(directory, old + suffix))
+                    except FileNotFoundError:
+                        pass
+        return self.name
+
+
+class SamplingProfile(Profile):
+    # Samples the thread's stack every `interval` seconds from a helper thread. The
+    # helper needs the GIL, so intervals below sys.getswitchinterval() (5 ms) do not help.
+    mode = 'sample'
+    unit = 'samples'
+
+    def start(self):
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name='profiler', daemon=True)
+        self.sampler.start()
+        return self
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or self.done.is_set():
+                return
+            self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        if self.duration is None:
+            self.done.set()
+            self.sampler.join()
+        return super().stop()
+
+
+class TracingProfile(Profile):
+    # Deterministic: hooks every call and return on the thread that calls start()
+    # (and must call stop()), charging self time in microseconds to the current stack.
+    # Slows the request down several times, but sees requests shorter than a sample.
+    mode = 'trace'
+    unit = 'microseconds'
+
+    def start(self):
+        # Seed with the frames already running so their returns unwind cleanly
+        outer = collapse(sys._getframe(1))
+        self.keys = []
+        for label in outer.split(';'):
+            self.keys.append(self.keys[-1] + ';' + label if self.keys else label)
+        self.last = time.perf_counter()
+        sys.setprofile(self.trace)
+        return self
+
+    def trace(self, frame, event, arg):
+        now = time.perf_counter()
+        if self.keys:
+            self.stacks[self.keys[-1]] += (now - self.last) * 1e6
+        if event == 'call':
+            self.keys.append(self.keys[-1] + ';' + frame_label(frame) if self.keys else frame_label(frame))
+        elif event == 'c_call':
+            label = 'builtin:' + getattr(arg, '__qualname__', getattr(arg, '__name__', '?'))
+            self.keys.append(self.keys[-1] + ';' + label if self.keys else label)
+        elif self.keys:
+            self.keys.pop()
+        self.last = time.perf_counter()
+
+    def stop(self):
+        if self.duration is None:
+            sys.setprofile(None)
+        return super().stop()
+
+
+PROFILES = {profile.mode: profile for profile in (SamplingProfile, TracingProfile)}
+
+
+def list_profiles(directory):
+    # Profile names, newest first
+    try:
+        names = [name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    return sorted((name for name in names if PROFILE_NAME.match(name)),
+                  key=lambda name: int(name.split('-', 1)[0]), reverse=True)
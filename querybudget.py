@@ -0,0 +1,59 @@
+import re
+from collections import Counter, namedtuple
+
+# Most statements and database milliseconds one request to a view may use; ms is optional
+Budget = namedtuple('Budget', 'queries ms')
+
+WHITESPACE = re.compile(r'\s+')
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAMETER = re.compile(r'%\(\w+\)s|%s|\$\?|(?<![\w:]):\w+|\?')
+IN_LIST = re.compile(r'\((?:\?, )*\?\)')
+VALUES_LIST = re.compile(r'(VALUES \([^)]*\))(?:, \([^)]*\))+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(statement):
+    # The statement with literals, parameters and IN/VALUES lists folded, so the same
+    # query run for different rows counts as one:
+    # "SELECT ... WHERE "Show".venue_id = ? AND id IN (?, ?)" -> "... = ? AND id IN (?)"
+    text = WHITESPACE.sub(' ', statement).strip()
+    text = STRING.sub('?', text)
+    text = NUMBER.sub('?', text)
+    text = PARAMETER.sub('?', text)
+    text = IN_LIST.sub('(?)', text)
+    return VALUES_LIST.sub(r'\1, ...', text)
+
+
+class QueryLog:
+    """The statements one request ran, by fingerprint, and their total time."""
+
+    def __init__(self):
+        self.fingerprints = Counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.paused = 0
+        self.streaming = False
+
+    def add(self, statement, seconds):
+        if self.paused:
+            return
+        self.fingerprints[fingerprint(statement)] += 1
+        self.count += 1
+        self.seconds += seconds
+
+    def exceeds(self, budget):
+        return self.count > budget.queries or (budget.ms is not None and self.seconds * 1000 > budget.ms)
+
+    def report(self, label, budget, repeated=5):
+        lines = ['%s ran %d SQL statements in %.1f ms; its budget is %d%s' % (
+            label, self.count, self.seconds * 1000, budget.queries,
+            ' in %g ms' % budget.ms if budget.ms is not None else '')]
+        for statement, count in self.fingerprints.most_common(repeated):
+            if count < 2:
+                break
+            lines.append('  %dx %s' % (count, statement if len(statement) <= 300 else statement[:297] + '...'))
+        return '\n'.join(lines)
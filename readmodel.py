@@ -0,0 +1,294 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime
+from itertools import groupby
+
+# Ids are stored as 32-bit ints, show start times as 64-bit epoch seconds
+ID_TYPE = 'i'
+TIME_TYPE = 'q'
+
+
+def intern(value):
+    return sys.intern(value) if value else value
+
+
+def timestamp(value):
+    # Show start times as epoch seconds; accepts datetimes or ISO strings from change events
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+class VenueSummary:
+    __slots__ = ('id', 'name', 'city', 'state', 'starts')
+
+    def __init__(self, id, name, city, state, starts=None):
+        self.id = id
+        self.name = name
+        self.city = intern(city)
+        self.state = intern(state)
+        # Sorted start times of this venue's shows
+        self.starts = starts if starts is not None else array(TIME_TYPE)
+
+    def upcoming(self, now):
+        return len(self.starts) - bisect_right(self.starts, now)
+
+    def next_show(self, now):
+        i = bisect_right(self.starts, now)
+        return self.starts[i] if i < len(self.starts) else None
+
+
+class ArtistSummary:
+    __slots__ = ('id', 'name', 'image_link', 'starts')
+
+    def __init__(self, id, name, image_link, starts=None):
+        self.id = id
+        self.name = name
+        self.image_link = image_link
+        self.starts = starts if starts is not None else array(TIME_TYPE)
+
+    upcoming = VenueSummary.upcoming
+    next_show = VenueSummary.next_show
+
+
+class ShowColumns:
+    # Every show as parallel arrays ordered by start time, then id; by_id and
+    # by_id_starts hold the same shows' ids and start times ordered by id, so a show
+    # is found from its id by bisection
+    __slots__ = ('ids', 'starts', 'venue_ids', 'artist_ids', 'by_id', 'by_id_starts')
+
+    def __init__(self, ids=None, starts=None, venue_ids=None, artist_ids=None, by_id=None, by_id_starts=None):
+        self.ids = ids if ids is not None else array(ID_TYPE)
+        self.starts = starts if starts is not None else array(TIME_TYPE)
+        self.venue_ids = venue_ids if venue_ids is not None else array(ID_TYPE)
+        self.artist_ids = artist_ids if artist_ids is not None else array(ID_TYPE)
+        self.by_id = by_id if by_id is not None else array(ID_TYPE)
+        self.by_id_starts = by_id_starts if by_id_starts is not None else array(TIME_TYPE)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def place(self, start, show_id):
+        # Position of (start, show_id) in start order
+        lo = bisect_left(self.starts, start)
+        return bisect_left(self.ids, show_id, lo, bisect_right(self.starts, start, lo))
+
+    def find(self, show_id):
+        # Position of the show in id order and in start order, or None
+        j = bisect_left(self.by_id, show_id)
+        if j == len(self.by_id) or self.by_id[j] != show_id:
+            return None
+        return j, self.place(self.by_id_starts[j], show_id)
+
+
+def spliced(column, removed, inserted):
+    # A copy of column without the items at the sorted positions in removed and with
+    # each (position, value) of the sorted inserted placed before the item at that
+    # position, built in one pass of slice copies
+    cuts = sorted([(position, 0, value) for position, value in inserted] + [(position, 1, None) for position in removed],
+                  key=lambda cut: cut[:2])
+    result = array(column.typecode)
+    done = 0
+    for position, remove, value in cuts:
+        result.extend(column[done:position])
+        if remove:
+            done = position + 1
+        else:
+            done = position
+            result.append(value)
+    result.extend(column[done:])
+    return result
+
+
+def respliced(starts, removed, added):
+    # A copy of sorted start times with one occurrence of each removed value taken out
+    # (values not present are ignored) and the added values put in
+    positions = []
+    for value, count in Counter(removed).items():
+        i = bisect_left(starts, value)
+        positions.extend(range(i, min(i + count, bisect_right(starts, value, i))))
+    return spliced(starts, sorted(positions), [(bisect_left(starts, value), value) for value in sorted(added)])
+
+
+class ReadModel:
+    """The projection behind the /venues, /artists and /shows pages.
+
+    Writers never change a dict or an array that a reader may be iterating: a load or
+    a batch of changes builds new ones outside the lock, holding only self.writing so
+    that writers take turns, then swaps them in under self.lock, which readers take
+    only to cache a sort order. A summary that keeps its identity across a batch has
+    its starts attribute pointed at a new array in that swap. A batch rebuilds each
+    array at most once however many changes it holds.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.writing = threading.Lock()
+        self.loaded_at = None
+        self.reset()
+
+    def reset(self):
+        with self.writing, self.lock:
+            self.venues = {}
+            self.artists = {}
+            self.shows = ShowColumns()
+            self.venue_order = None
+            self.artist_order = None
+
+    def load(self, venues, artists, shows):
+        # venues: (id, name, city, state); artists: (id, name, image_link);
+        # shows: (id, venue_id, artist_id, start) ordered by start, then id
+        venue_summaries = {row[0]: VenueSummary(*row) for row in venues}
+        artist_summaries = {row[0]: ArtistSummary(*row) for row in artists}
+        columns = ShowColumns()
+        for show_id, venue_id, artist_id, start in shows:
+            columns.ids.append(show_id)
+            columns.starts.append(start)
+            columns.venue_ids.append(venue_id)
+            columns.artist_ids.append(artist_id)
+            # Shows arrive in start order, so appending keeps every array sorted
+            venue = venue_summaries.get(venue_id)
+            if venue is not None:
+                venue.starts.append(start)
+            artist = artist_summaries.get(artist_id)
+            if artist is not None:
+                artist.starts.append(start)
+        order = sorted(range(len(columns)), key=columns.ids.__getitem__)
+        columns.by_id = array(ID_TYPE, map(columns.ids.__getitem__, order))
+        columns.by_id_starts = array(TIME_TYPE, map(columns.starts.__getitem__, order))
+        with self.writing, self.lock:
+            self.venues, self.artists, self.shows = venue_summaries, artist_summaries, columns
+            self.venue_order = self.artist_order = None
+
+    # Change events, as (kind, op, id, data)
+
+    def apply(self, changes):
+        with self.writing:
+            # Venues and artists first, so shows booked in the same batch find them;
+            # their dicts are copied only when the batch changes one
+            venues, artists = self.venues, self.artists
+            shows = {}  # show id -> (start, venue_id, artist_id), or None once deleted
+            gone = {'venue': set(), 'artist': set()}
+            for kind, op, entity_id, data in changes:
+                if kind == 'venue':
+                    if venues is self.venues:
+                        venues = dict(venues)
+                    if op == 'delete':
+                        venues.pop(entity_id, None)
+                        gone['venue'].add(entity_id)
+                    else:
+                        current = venues.get(entity_id)
+                        venues[entity_id] = VenueSummary(entity_id, data['name'], data['city'], data['state'],
+                                                         current.starts if current else None)
+                elif kind == 'artist':
+                    if artists is self.artists:
+                        artists = dict(artists)
+                    if op == 'delete':
+                        artists.pop(entity_id, None)
+                        gone['artist'].add(entity_id)
+                    else:
+                        current = artists.get(entity_id)
+                        artists[entity_id] = ArtistSummary(entity_id, data['name'], data['image_link'],
+                                                           current.starts if current else None)
+                elif kind == 'show':
+                    shows[entity_id] = None if op == 'delete' else (
+                        timestamp(data['start_time']), data['venue_id'], data['artist_id'])
+            columns, starts = self.shows, []
+            if shows or gone['venue'] or gone['artist']:
+                columns, starts = self.applied_shows(shows, gone, venues, artists)
+            with self.lock:
+                for entity, entity_starts in starts:
+                    entity.starts = entity_starts
+                if venues is not self.venues:
+                    self.venues, self.venue_order = venues, None
+                if artists is not self.artists:
+                    self.artists, self.artist_order = artists, None
+                self.shows = columns
+
+    def applied_shows(self, shows, gone, venues, artists):
+        # The show columns with a batch's show changes applied, and the new start
+        # times of each venue or artist summary they touch as [(summary, starts)]
+        old = self.shows
+        removed = {}  # position in start order -> position in id order
+        for show_id in shows:
+            found = old.find(show_id)
+            if found is not None:
+                removed[found[1]] = found[0]
+        if gone['venue'] or gone['artist']:
+            # The database cascades a venue or artist delete to its shows; mirror that here
+            for i in range(len(old)):
+                if old.venue_ids[i] in gone['venue'] or old.artist_ids[i] in gone['artist']:
+                    removed.setdefault(i, bisect_left(old.by_id, old.ids[i]))
+        added = sorted((row[0], show_id, row[1], row[2]) for show_id, row in shows.items()
+                       if row is not None and row[1] not in gone['venue'] and row[2] not in gone['artist'])
+        if not removed and not added:
+            return old, []
+        starts = {}  # (kind, id) -> ([removed starts], [added starts])
+        for i in removed:
+            starts.setdefault(('venue', old.venue_ids[i]), ([], []))[0].append(old.starts[i])
+            starts.setdefault(('artist', old.artist_ids[i]), ([], []))[0].append(old.starts[i])
+        for start, show_id, venue_id, artist_id in added:
+            starts.setdefault(('venue', venue_id), ([], []))[1].append(start)
+            starts.setdefault(('artist', artist_id), ([], []))[1].append(start)
+
+        in_order = sorted(removed)
+        places = [old.place(start, show_id) for start, show_id, venue_id, artist_id in added]
+        by_id = sorted((show_id, start) for start, show_id, venue_id, artist_id in added)
+        by_id_places = [bisect_left(old.by_id, show_id) for show_id, start in by_id]
+        by_id_removed = sorted(removed.values())
+        columns = ShowColumns(
+            *(spliced(column, in_order, [(place, row[field]) for place, row in zip(places, added)])
+              for column, field in ((old.ids, 1), (old.starts, 0), (old.venue_ids, 2), (old.artist_ids, 3))),
+            spliced(old.by_id, by_id_removed, [(place, row[0]) for place, row in zip(by_id_places, by_id)]),
+            spliced(old.by_id_starts, by_id_removed, [(place, row[1]) for place, row in zip(by_id_places, by_id)])
+        )
+        entity_starts = []
+        for (kind, entity_id), (removed_starts, added_starts) in starts.items():
+            entity = (venues if kind == 'venue' else artists).get(entity_id)
+            if entity is not None:
+                entity_starts.append((entity, respliced(entity.starts, removed_starts, added_starts)))
+        return columns, entity_starts
+
+    # Page projections, shaped like the dicts the templates already use
+
+    def venue_areas(self, now):
+        order = self.venue_order
+        if order is None:
+            with self.lock:
+                order = self.venue_order = sorted(self.venues.values(), key=lambda v: (v.state or '', v.city or '', v.name or ''))
+        return ({
+            "city": city,
+            "state": state,
+            "venues": ({
+                "id": venue.id,
+                "name": venue.name,
+                "num_upcoming_shows": venue.upcoming(now)
+            } for venue in area)
+        } for (city, state), area in groupby(order, key=lambda v: (v.city, v.state)))
+
+    def artist_list(self):
+        order = self.artist_order
+        if order is None:
+            with self.lock:
+                order = self.artist_order = sorted(self.artists.values(), key=lambda a: a.name or '')
+        return ({"id": artist.id, "name": artist.name} for artist in order)
+
+    def show_list(self):
+        columns = self.shows
+        venues, artists = self.venues, self.artists
+        for i in range(len(columns)):
+            venue = venues.get(columns.venue_ids[i])
+            artist = artists.get(columns.artist_ids[i])
+            if venue is None or artist is None:
+                continue
+            yield {
+                "venue_id": venue.id,
+                "venue_name": venue.name,
+                "artist_id": artist.id,
+                "artist_name": artist.name,
+                "artist_image_link": artist.image_link,
+                "start_time": datetime.fromtimestamp(columns.starts[i]).strftime('%Y-%m-%d %H:%M:%S')
+            }
@@ -0,0 +1,116 @@
+import re
+from datetime import datetime, timedelta
+
+TOKEN = re.compile(r'\w+')
+
+# Index DDL the ORM cannot express, run after search_document is created (and by
+# its migration): a weighted tsvector column with a GIN index on Postgres, an
+# external-content FTS5 table kept in step by triggers on SQLite
+INDEX_DDL = {
+    'postgresql': [
+        "ALTER TABLE search_document ADD COLUMN document tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(subtitle, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(body, '')), 'C')) STORED",
+        "CREATE INDEX ix_search_document_document ON search_document USING gin (document)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE search_fts USING fts5(title, subtitle, body, "
+        "content='search_document', content_rowid='id', prefix='2 3')",
+        "CREATE TRIGGER search_document_ai AFTER INSERT ON search_document BEGIN "
+        "INSERT INTO search_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body); END",
+        "CREATE TRIGGER search_document_ad AFTER DELETE ON search_document BEGIN "
+        "INSERT INTO search_fts(search_fts, rowid, title, subtitle, body) "
+        "VALUES ('delete', old.id, old.title, old.subtitle, old.body); END",
+        "CREATE TRIGGER search_document_au AFTER UPDATE ON search_document BEGIN "
+        "INSERT INTO search_fts(search_fts, rowid, title, subtitle, body) "
+        "VALUES ('delete', old.id, old.title, old.subtitle, old.body); "
+        "INSERT INTO search_fts(rowid, title, subtitle, body) VALUES (new.id, new.title, new.subtitle, new.body); END",
+    ],
+}
+
+
+def tokens(text):
+    return [token.casefold() for token in TOKEN.findall(text or '')]
+
+
+# Documents, as the columns of a search_document row
+
+def venue_document(venue_id, name, city, state, address, genres):
+    return {
+        'kind': 'venue', 'entity_id': venue_id, 'venue_id': venue_id, 'artist_id': None,
+        'title': name, 'subtitle': '%s, %s' % (city, state),
+        'body': ' '.join(list(genres) + [address or '']), 'starts_at': None,
+    }
+
+
+def artist_document(artist_id, name, city, state, genres):
+    return {
+        'kind': 'artist', 'entity_id': artist_id, 'venue_id': None, 'artist_id': artist_id,
+        'title': name, 'subtitle': '%s, %s' % (city, state),
+        'body': ' '.join(genres), 'starts_at': None,
+    }
+
+
+def show_document(show_id, venue_id, artist_id, start_time, artist_name, venue_name, city, state, genres):
+    # Dates are indexed as words too, so "october" or "friday" match
+    return {
+        'kind': 'show', 'entity_id': show_id, 'venue_id': venue_id, 'artist_id': artist_id,
+        'title': '%s at %s' % (artist_name, venue_name),
+        'subtitle': '%s, %s' % (city, state),
+        'body': ' '.join(list(genres) + [start_time.strftime('%A %B %Y-%m-%d')]),
+        'starts_at': start_time,
+    }
+
+
+def genre_document(genre_id, name):
+    return {
+        'kind': 'genre', 'entity_id': genre_id, 'venue_id': None, 'artist_id': None,
+        'title': name, 'subtitle': 'Genre', 'body': '', 'starts_at': None,
+    }
+
+
+# Queries
+
+def day_start(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def date_windows(now):
+    # Phrases that turn a query into a search for shows in a date range, longest first
+    today = day_start(now)
+    week = today - timedelta(days=today.weekday())
+    month = today.replace(day=1)
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    saturday = week + timedelta(days=5)
+    return [
+        (('this', 'weekend'), (max(now, saturday - timedelta(hours=6)), week + timedelta(days=7))),
+        (('this', 'week'), (now, week + timedelta(days=7))),
+        (('next', 'week'), (week + timedelta(days=7), week + timedelta(days=14))),
+        (('this', 'month'), (now, next_month)),
+        (('next', 'month'), (next_month, (next_month + timedelta(days=32)).replace(day=1))),
+        (('tonight',), (now, today + timedelta(days=1))),
+        (('today',), (now, today + timedelta(days=1))),
+        (('tomorrow',), (today + timedelta(days=1), today + timedelta(days=2))),
+    ]
+
+
+def parse_query(text, now=None):
+    # Search terms, and the (start, end) show window named by a date phrase, if any:
+    # "jazz san francisco next week" -> ['jazz', 'san', 'francisco'], (next Monday, the Monday after)
+    now = now or datetime.now()
+    terms = tokens(text)
+    for phrase, window in date_windows(now):
+        for i in range(len(terms) - len(phrase) + 1):
+            if tuple(terms[i:i + len(phrase)]) == phrase:
+                return terms[:i] + terms[i + len(phrase):], window
+    return terms, None
+
+
+def tsquery(terms):
+    # Every term must match, each as a prefix: to_tsquery('simple', 'jazz:* & san:*')
+    return ' & '.join('%s:*' % term for term in terms)
+
+
+def fts5_query(terms):
+    return ' AND '.join('"%s"*' % term.replace('"', '""') for term in terms)
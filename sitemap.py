@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+# The sitemap protocol allows at most 50,000 URLs per file. Files cover fixed id
+# ranges rather than positions, so an edit, insert or delete only ever changes the
+# one file whose range holds its id.
+URLS_PER_SITEMAP = 50000
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+# URLs per piece of a streamed response
+PIECE_SIZE = 1000
+
+
+def chunk_of(entity_id):
+    return (entity_id - 1) // URLS_PER_SITEMAP
+
+
+def chunk_bounds(chunk):
+    # First and last id the chunk covers
+    return chunk * URLS_PER_SITEMAP + 1, (chunk + 1) * URLS_PER_SITEMAP
+
+
+def w3c_date(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def urlset(entries):
+    # The sitemap XML for (loc, lastmod datetime or None) pairs, in pieces
+    pieces = ['<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="%s">\n' % NAMESPACE]
+    for loc, modified in entries:
+        if modified is not None:
+            pieces.append('<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (escape(loc), w3c_date(modified)))
+        else:
+            pieces.append('<url><loc>%s</loc></url>\n' % escape(loc))
+        if len(pieces) >= PIECE_SIZE:
+            yield ''.join(pieces)
+            pieces = []
+    pieces.append('</urlset>\n')
+    yield ''.join(pieces)
+
+
+def sitemap_index(entries):
+    # The sitemap index XML for (loc, lastmod date string or None) pairs
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="%s">\n' % NAMESPACE
+    for loc, modified in entries:
+        lastmod = '<lastmod>%s</lastmod>' % modified if modified else ''
+        yield '<sitemap><loc>%s</loc>%s</sitemap>\n' % (escape(loc), lastmod)
+    yield '</sitemapindex>\n'
+
+
+class SitemapCache:
+    """Generated sitemap files on disk, shared by every worker, plus state.json: what
+    they were generated from, the outbox position they reflect and, per kind and
+    chunk, [URL count, lastmod, version]. A chunk's version is the id of the last
+    change event inside its range and is part of its file name, so a worker still
+    writing an outdated file never replaces the current one."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.state_path = os.path.join(directory, 'state.json')
+
+    def path(self, kind, chunk, version):
+        return os.path.join(self.directory, '%s-%d-%d.xml' % (kind, chunk, version))
+
+    def load(self):
+        try:
+            with open(self.state_path) as state:
+                return json.load(state)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, state):
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as out:
+                json.dump(state, out)
+            os.replace(temp, self.state_path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    def tee(self, pieces, path):
+        # Yields the pieces as bytes while writing them to path; the file only appears
+        # once every piece was produced, so an abandoned response leaves nothing behind
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for piece in pieces:
+                    data = piece.encode()
+                    out.write(data)
+                    yield data
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def prune(self, state):
+        # Removes files no chunk in state names any more
+        current = {'%s-%s-%d.xml' % (kind, chunk, entry[2])
+                   for kind, chunks in state['kinds'].items() for chunk, entry in chunks.items()}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.xml') and entry.name not in current:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
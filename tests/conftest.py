@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# config.py reads these when app is imported, so they are set first. Each test gets an
+# empty SQLite database; query budgets raise, so a view that overruns its budget fails.
+TEST_DIR = tempfile.mkdtemp(prefix='fyyur-tests-')
+DATABASE_PATH = os.path.join(TEST_DIR, 'fyyur.db')
+ADMIN_TOKEN = 'test-admin-token'
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + DATABASE_PATH,
+    'SECRET_KEY': 'test',
+    'TEMPLATE_CACHE_DIR': os.path.join(TEST_DIR, 'templates'),
+    'QUERY_BUDGET_MODE': 'raise',
+    'ADMIN_TOKEN': ADMIN_TOKEN,
+})
+for name in ('READ_ONLY', 'ALLOW_UNAUTHENTICATED_ADMIN', 'SEARCH_SHOW_REINDEX_JOB'):
+    os.environ.pop(name, None)
+
+import app as fyyur  # noqa: E402
+
+fyyur.app.config.update(
+    TESTING=True,
+    ADMISSION_ENABLED=False,
+    IMAGE_PROXY_ENABLED=False,
+    READ_MODEL_ENABLED=False,
+    IMAGE_CACHE_DIR=os.path.join(TEST_DIR, 'image_cache'),
+    SITEMAP_CACHE_DIR=os.path.join(TEST_DIR, 'sitemap_cache'),
+    PROFILER_DIR=os.path.join(TEST_DIR, 'profiles'),
+)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def database():
+    # A new file rather than drop_all(), which leaves the search_fts virtual table behind
+    with fyyur.app.app_context():
+        fyyur.db.engine.dispose()
+        if os.path.exists(DATABASE_PATH):
+            os.remove(DATABASE_PATH)
+        fyyur.db.create_all()
+    # Per-process state built from the previous test's rows
+    fyyur.read_model.reset()
+    fyyur.read_model.loaded_at = None
+    fyyur.read_model.position = 0
+    fyyur.read_model.synced_at = 0
+    fyyur.list_facets_cache['rows'] = None
+    for index in (fyyur.artists_seeking_venues, fyyur.venues_seeking_talent):
+        with index.lock:
+            index.loaded_at = None
+    yield
+
+
+@pytest.fixture
+def client():
+    return fyyur.app.test_client()
+
+
+@pytest.fixture
+def admin():
+    return {'X-Admin-Token': ADMIN_TOKEN}
@@ -0,0 +1,67 @@
+import re
+from datetime import datetime, timedelta
+
+from app import app, db, genres_named, Venue, Artist, Show
+
+# Rows are added through the ORM, so the flush hooks (facets, outbox, search) run as
+# they do for the views; each helper commits and returns the new id
+
+
+def add_venue(name='The Musical Hop', city='San Francisco', state='CA', genres=('Jazz',), **fields):
+    with app.app_context():
+        fields.setdefault('address', '1015 Folsom Street')
+        fields.setdefault('phone', '1231231234')
+        venue = Venue(name=name, city=city, state=state, **fields)
+        venue.genres = genres_named(list(genres))
+        db.session.add(venue)
+        db.session.commit()
+        return venue.id
+
+
+def add_artist(name='Guns N Petals', city='San Francisco', state='CA', genres=('Rock n Roll',), **fields):
+    with app.app_context():
+        fields.setdefault('phone', '3261235000')
+        artist = Artist(name=name, city=city, state=state, **fields)
+        artist.genres = genres_named(list(genres))
+        db.session.add(artist)
+        db.session.commit()
+        return artist.id
+
+
+def add_show(venue_id, artist_id, days=7, **fields):
+    with app.app_context():
+        start_time = datetime.now().replace(microsecond=0) + timedelta(days=days)
+        show = Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time, **fields)
+        db.session.add(show)
+        db.session.commit()
+        return show.id
+
+
+def count(*criteria, model=Show):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).select_from(model).where(*criteria))
+
+
+def venue_form(**fields):
+    # What the venue create and edit forms post
+    form = {
+        'name': 'The Musical Hop',
+        'city': 'San Francisco',
+        'state': 'CA',
+        'address': '1015 Folsom Street',
+        'phone': '123-123-1234',
+        'genres': ['Jazz'],
+        'seeking_talent': 'No',
+        'seeking_description': '',
+        'image_link': '',
+        'website': '',
+        'facebook_link': '',
+    }
+    form.update(fields)
+    return form
+
+
+def csrf_token(client):
+    # The token the client's session gets on any form page
+    page = client.get('/venues/create').get_data(as_text=True)
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
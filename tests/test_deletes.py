@@ -0,0 +1,84 @@
+from app import app, db, venue_genre_table, artist_genre_table, ChangeEvent, Venue, Artist, Show
+from tests.helpers import add_venue, add_artist, add_show, count
+
+
+def association_rows(table, column, entity_id):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).select_from(table).where(column == entity_id))
+
+
+def test_venue_delete_cascades_to_shows_and_genres(client):
+    venue_id = add_venue(genres=('Jazz', 'Blues'))
+    other_id = add_venue(name='Park Square Live', genres=('Jazz',))
+    artist_id = add_artist()
+    add_show(venue_id, artist_id, days=-3)
+    add_show(venue_id, artist_id, days=3)
+    kept = add_show(other_id, artist_id, days=5)
+
+    response = client.post(f'/venues/{venue_id}/delete')
+
+    assert response.status_code == 200
+    assert response.get_json()['deleted'] is True
+    assert count(Venue.id == venue_id, model=Venue) == 0
+    assert count(Show.venue_id == venue_id) == 0
+    assert association_rows(venue_genre_table, venue_genre_table.c.venue_id, venue_id) == 0
+    assert count(Show.id == kept) == 1
+    assert count(Artist.id == artist_id, model=Artist) == 1
+    assert count(ChangeEvent.kind == 'venue', ChangeEvent.op == 'delete', ChangeEvent.entity_id == venue_id,
+                 model=ChangeEvent) == 1
+
+
+def test_artist_delete_cascades_to_shows_and_genres(client):
+    venue_id = add_venue()
+    artist_id = add_artist(genres=('Rock n Roll', 'Funk'))
+    add_show(venue_id, artist_id)
+
+    assert client.post(f'/artists/{artist_id}/delete').status_code == 200
+    assert count(Show.artist_id == artist_id) == 0
+    assert association_rows(artist_genre_table, artist_genre_table.c.artist_id, artist_id) == 0
+    assert count(Venue.id == venue_id, model=Venue) == 1
+
+
+def test_bulk_delete(client, admin):
+    venues = [add_venue(name=f'Venue {i}') for i in range(3)]
+    artists = [add_artist(name=f'Artist {i}') for i in range(2)]
+    shows = [add_show(venue_id, artists[1], days=i + 1) for i, venue_id in enumerate(venues)]
+    add_show(venues[2], artists[0], days=10)
+
+    response = client.post('/bulk/delete', headers=admin,
+                           json={'venues': venues[:2], 'artists': [artists[0]], 'shows': [shows[2]]})
+
+    assert response.status_code == 200
+    assert response.get_json()['deleted'] == {'shows': 1, 'artists': 1, 'venues': 2}
+    assert count(model=Venue) == 1
+    assert count(model=Artist) == 1
+    # The venues' shows went with them, the artist's show with the artist
+    assert count() == 0
+
+
+def test_bulk_delete_needs_the_admin_token(client):
+    venue_id = add_venue()
+
+    assert client.post('/bulk/delete', json={'venues': [venue_id]}).status_code == 403
+    assert client.post('/bulk/delete', json={'venues': [venue_id]},
+                       headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert count(model=Venue) == 1
+
+
+def test_admin_endpoints_are_closed_without_a_configured_token(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_TOKEN', None)
+    monkeypatch.setitem(app.config, 'DEBUG', True)
+
+    assert client.post('/bulk/delete', json={}).status_code == 403
+    assert client.get('/jobs').status_code == 403
+
+    monkeypatch.setitem(app.config, 'ALLOW_UNAUTHENTICATED_ADMIN', True)
+    assert client.post('/bulk/delete', json={}).status_code == 200
+
+
+def test_bulk_delete_rejects_bodies_that_are_not_objects_of_id_lists(client, admin):
+    venue_id = add_venue()
+
+    for body in ([venue_id], 5, {'venues': str(venue_id)}, {'venues': ['x']}):
+        assert client.post('/bulk/delete', headers=admin, json=body).status_code == 400
+    assert count(model=Venue) == 1
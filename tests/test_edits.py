@@ -0,0 +1,73 @@
+import re
+
+from app import app, db, Venue, Artist
+import app as fyyur
+from tests.helpers import add_venue, add_artist, csrf_token, venue_form
+
+
+def version_of(model, entity_id):
+    with app.app_context():
+        return db.session.get(model, entity_id).version
+
+
+def name_of(model, entity_id):
+    with app.app_context():
+        return db.session.get(model, entity_id).name
+
+
+def test_edit_form_carries_the_version(client):
+    venue_id = add_venue()
+
+    page = client.get(f'/venues/{venue_id}/edit').get_data(as_text=True)
+
+    assert re.search(r'name="version"[^>]*value="1"', page)
+
+
+def test_edit_bumps_the_version(client):
+    venue_id = add_venue()
+
+    response = client.post(f'/venues/{venue_id}/edit', data=venue_form(name='The Hop', version='1', csrf_token=csrf_token(client)))
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/venues/{venue_id}')
+    assert name_of(Venue, venue_id) == 'The Hop'
+    assert version_of(Venue, venue_id) == 2
+
+
+def test_stale_edit_is_refused(client):
+    venue_id = add_venue()
+    client.post(f'/venues/{venue_id}/edit', data=venue_form(name='The Hop', version='1', csrf_token=csrf_token(client)))
+
+    response = client.post(f'/venues/{venue_id}/edit', data=venue_form(name='Stale Name', version='1', csrf_token=csrf_token(client)))
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/venues/{venue_id}/edit')
+    assert name_of(Venue, venue_id) == 'The Hop'
+    assert version_of(Venue, venue_id) == 2
+    with client.session_transaction() as session:
+        assert any('changed by someone else' in message for _, message in session['_flashes'])
+
+
+def test_edit_that_loses_the_race_is_refused(client, monkeypatch):
+    # Another edit commits after the version check but before this one's UPDATE, which
+    # then matches no row
+    artist_id = add_artist()
+    apply_edit = fyyur.apply_edit
+
+    def racing_apply_edit(obj, values, genre_names):
+        changed = apply_edit(obj, values, genre_names)
+        with db.engine.begin() as connection:
+            connection.execute(db.update(Artist).where(Artist.id == artist_id)
+                               .values(name='Won The Race', version=Artist.version + 1))
+        return changed
+
+    monkeypatch.setattr(fyyur, 'apply_edit', racing_apply_edit)
+    response = client.post(f'/artists/{artist_id}/edit', data={
+        'name': 'Lost The Race', 'city': 'San Francisco', 'state': 'CA', 'phone': '326-123-5000',
+        'genres': ['Rock n Roll'], 'seeking_venue': 'No', 'seeking_description': '', 'image_link': '',
+        'website': '', 'facebook_link': '', 'version': '1', 'csrf_token': csrf_token(client)})
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/artists/{artist_id}/edit')
+    assert name_of(Artist, artist_id) == 'Won The Race'
+    assert version_of(Artist, artist_id) == 2
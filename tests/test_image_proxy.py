@@ -0,0 +1,174 @@
+import io
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app as fyyur
+import imagecache
+from app import app
+
+
+def png(width=800, height=400):
+    Image = pytest.importorskip('PIL.Image')
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(out, 'PNG')
+    return out.getvalue()
+
+
+@pytest.fixture
+def origin():
+    # A local stand-in for the sites image links point at; hits counts requests by path
+    files = {'/photo.png': (png(), 'image/png'), '/page.html': (b'<html></html>', 'text/html')}
+    hits = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits[self.path] = hits.get(self.path, 0) + 1
+            if self.path not in files:
+                self.send_error(404)
+                return
+            body, content_type = files[self.path]
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield {'url': 'http://127.0.0.1:%d' % server.server_port, 'port': server.server_port, 'hits': hits}
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'IMAGE_PROXY_ENABLED', True)
+    monkeypatch.setitem(app.config, 'IMAGE_PROXY_ALLOW_PRIVATE', True)
+    monkeypatch.setitem(app.config, 'IMAGE_CACHE_DIR', str(tmp_path / 'image_cache'))
+    monkeypatch.setattr(fyyur, 'image_cache', None)
+    monkeypatch.setattr(fyyur, 'image_failures', {})
+
+
+def proxied(url, size='tile'):
+    with app.test_request_context():
+        return fyyur.thumbnail_url(url, size)
+
+
+def test_image_is_fetched_resized_and_cached(client, origin, proxy):
+    Image = pytest.importorskip('PIL.Image')
+    url = origin['url'] + '/photo.png'
+
+    response = client.get(proxied(url))
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert Image.open(io.BytesIO(response.data)).size == imagecache.SIZES['tile']
+    assert origin['hits'] == {'/photo.png': 1}
+
+    again = client.get(proxied(url))
+    assert again.status_code == 200
+    assert again.data == response.data
+    assert client.get(proxied(url), headers={'If-None-Match': again.headers['ETag']}).status_code == 304
+    assert origin['hits'] == {'/photo.png': 1}
+
+    # Each size is its own entry
+    assert client.get(proxied(url, 'detail')).status_code == 200
+    assert origin['hits'] == {'/photo.png': 2}
+
+
+def test_unsigned_urls_are_refused(client, origin, proxy):
+    url = origin['url'] + '/photo.png'
+    path = proxied(url)
+
+    assert client.get(path.replace('/img/tile/', '/img/tile/x')).status_code == 404
+    assert client.get(path.replace('/img/tile/', '/img/huge/')).status_code == 404
+    assert origin['hits'] == {}
+
+
+def test_failed_fetches_redirect_to_the_original(client, origin, proxy):
+    for path in ('/page.html', '/missing.png'):
+        url = origin['url'] + path
+
+        response = client.get(proxied(url))
+
+        assert response.status_code == 302
+        assert response.headers['Location'] == url
+        # Not retried until IMAGE_RETRY_SECONDS pass
+        assert client.get(proxied(url)).status_code == 302
+        assert origin['hits'][path] == 1
+
+
+def test_private_addresses_are_refused(client, origin, proxy, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMAGE_PROXY_ALLOW_PRIVATE', False)
+    url = origin['url'] + '/photo.png'
+
+    response = client.get(proxied(url))
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == url
+    assert origin['hits'] == {}
+    for host in ('localhost', '[::1]', '169.254.169.254', '10.0.0.1'):
+        with pytest.raises(imagecache.FetchError):
+            imagecache.fetch_image('http://%s:%d/photo.png' % (host, origin['port']), timeout=1)
+    assert origin['hits'] == {}
+
+
+def test_a_name_that_resolves_to_a_private_address_is_refused(origin, monkeypatch):
+    # The addresses checked are the ones connected to: a DNS answer is never looked up
+    # twice, so it cannot change to a private address between the check and the connect
+    lookups = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        lookups.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('127.0.0.1', port))]
+
+    monkeypatch.setattr(imagecache.socket, 'getaddrinfo', getaddrinfo)
+
+    with pytest.raises(imagecache.FetchError):
+        imagecache.fetch_image('http://images.example.com:%d/photo.png' % origin['port'], timeout=1)
+    assert lookups == ['images.example.com']
+    assert origin['hits'] == {}
+
+
+def test_only_http_urls_are_fetched():
+    for url in ('file:///etc/passwd', 'ftp://example.com/a.png', 'http:///a.png'):
+        with pytest.raises(imagecache.FetchError):
+            imagecache.fetch_image(url)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = imagecache.ImageCache(str(tmp_path), max_bytes=10000)
+    blobs = {name: os.urandom(3000) for name in 'abcd'}
+    for name in 'abc':
+        cache.put(name, blobs[name], 'image/jpeg')
+        time.sleep(0.01)
+    assert cache.get('a') is not None
+
+    # 12000 bytes pass max_bytes: b, now the least recently used, goes first
+    cache.put('d', blobs['d'], 'image/jpeg')
+
+    assert cache.get('b') is None
+    assert [name for name in 'acd' if cache.get(name) is not None] == ['a', 'c', 'd']
+    assert cache.stored_bytes() == 9000
+    with open(tmp_path / '.size') as size:
+        assert int(size.read()) == 9000
+
+
+def test_cache_stores_identical_content_once(tmp_path):
+    cache = imagecache.ImageCache(str(tmp_path), max_bytes=10000)
+    data = os.urandom(3000)
+
+    first = cache.put('a', data, 'image/jpeg')
+    second = cache.put('b', data, 'image/jpeg')
+
+    assert first[0] == second[0]
+    assert cache.stored_bytes() == 3000
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import app, db, Show
+from querybudget import QueryBudgetExceeded, fingerprint
+from tests.helpers import add_venue, add_artist
+
+# The suite runs with QUERY_BUDGET_MODE=raise (see conftest.py): a view that runs more
+# statements than its @query_budget fails the request with QueryBudgetExceeded. Every
+# view here gets enough rows that a per-row query would overrun its budget.
+ROWS = 12
+
+
+@pytest.fixture
+def listings():
+    venue_ids = [add_venue(name=f'Venue {i}', city=('Austin', 'Boston', 'Chicago')[i % 3], genres=('Jazz', 'Blues'),
+                           latitude=37.77 + i / 1000, longitude=-122.42, seeking_talent=True)
+                 for i in range(ROWS)]
+    artist_ids = [add_artist(name=f'Artist {i}', genres=('Jazz', 'Folk'), seeking_venue=True) for i in range(ROWS)]
+    now = datetime.now().replace(microsecond=0)
+    with app.app_context():
+        db.session.add_all(Show(venue_id=venue_ids[i % ROWS], artist_id=artist_ids[(i * 5) % ROWS],
+                                start_time=now + timedelta(days=i - ROWS)) for i in range(ROWS * 3))
+        db.session.commit()
+    return venue_ids, artist_ids
+
+
+def get(client, url):
+    # Streamed pages check their budget once the body is sent and the response closed
+    with client.get(url) as response:
+        response.get_data()
+    return response
+
+
+VIEWS = [
+    '/', '/trending', '/venues', '/venues?genre=Jazz', '/artists', '/artists?genre=Jazz', '/shows', '/genres',
+    '/venues/{venue}', '/artists/{artist}', '/venues/{venue}/calendar', '/artists/{artist}/calendar',
+    '/venues/{venue}/edit', '/artists/{artist}/edit', '/venues/{venue}/matches', '/artists/{artist}/matches',
+    '/venues/nearby?lat=37.77&lng=-122.42&radius_km=50', '/search?q=venue', '/sitemap.xml',
+]
+
+
+@pytest.mark.parametrize('url', VIEWS)
+def test_views_stay_within_their_budget(client, listings, url):
+    venue_ids, artist_ids = listings
+
+    response = get(client, url.format(venue=venue_ids[0], artist=artist_ids[0]))
+
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('url', ['/venues', '/artists', '/shows'])
+def test_read_model_pages_stay_within_their_budget(client, listings, monkeypatch, url):
+    monkeypatch.setitem(app.config, 'READ_MODEL_ENABLED', True)
+
+    assert get(client, url).status_code == 200
+    assert get(client, url).status_code == 200
+
+
+def test_a_per_row_query_exceeds_the_budget(client, listings, monkeypatch):
+    # The nearby venues' upcoming shows fetched one venue at a time, as an N+1
+    # regression would
+    def upcoming_shows_one_by_one(venue_ids, per_venue):
+        return {venue_id: [{"artist_id": artist_id, "start_time": str(start_time)}
+                           for artist_id, start_time in db.session.execute(
+                               db.select(Show.artist_id, Show.start_time).where(Show.venue_id == venue_id)
+                               .order_by(Show.start_time).limit(per_venue))]
+                for venue_id in venue_ids}
+
+    monkeypatch.setattr(fyyur, 'upcoming_shows_by_venue', upcoming_shows_one_by_one)
+
+    with pytest.raises(QueryBudgetExceeded) as raised:
+        get(client, '/venues/nearby?lat=37.77&lng=-122.42&radius_km=50')
+
+    report = str(raised.value)
+    assert 'budget is 10' in report
+    assert f'{ROWS}x SELECT "Show".artist_id' in report
+
+
+def test_fingerprint_folds_values_and_lists():
+    assert fingerprint('SELECT * FROM "Show" WHERE venue_id = 12 AND id IN (?, ?, ?)') == \
+        fingerprint('SELECT *\n  FROM "Show" WHERE venue_id = ? AND id IN (?)')
+    assert fingerprint("INSERT INTO t (a) VALUES ('x'), ('y')") == 'INSERT INTO t (a) VALUES (?), ...'
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+import app as fyyur
+from app import app, db, Venue, Artist, Show
+from readmodel import ReadModel
+from tests.helpers import add_venue, add_artist, add_show
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setitem(app.config, 'READ_MODEL_ENABLED', True)
+    monkeypatch.setitem(app.config, 'READ_MODEL_SYNC_INTERVAL', 0)
+    venue_ids = [add_venue(name=f'Venue {i}', city=('Austin', 'Boston')[i % 2]) for i in range(3)]
+    artist_ids = [add_artist(name=f'Artist {i}') for i in range(3)]
+    for i in range(9):
+        add_show(venue_ids[i % 3], artist_ids[i % 2], days=i - 4)
+    with app.app_context():
+        return fyyur.current_read_model()
+
+
+def loaded_from_database():
+    # A ReadModel loaded the way a worker loads it, for comparison
+    model = ReadModel()
+    with app.app_context():
+        model.load(db.session.execute(db.select(Venue.id, Venue.name, Venue.city, Venue.state)),
+                   db.session.execute(db.select(Artist.id, Artist.name, Artist.image_link)),
+                   [(show_id, venue_id, artist_id, int(start_time.timestamp()))
+                    for show_id, venue_id, artist_id, start_time in db.session.execute(
+                        db.select(Show.id, Show.venue_id, Show.artist_id, Show.start_time)
+                        .order_by(Show.start_time, Show.id))])
+    return model
+
+
+def projection(model):
+    now = int(datetime.now().timestamp())
+    columns = model.shows
+    return {
+        'venues': [dict(area, venues=list(area['venues'])) for area in model.venue_areas(now)],
+        'artists': list(model.artist_list()),
+        'shows': list(model.show_list()),
+        'columns': [list(column) for column in (columns.ids, columns.starts, columns.venue_ids,
+                                                columns.artist_ids, columns.by_id, columns.by_id_starts)],
+        'starts': {(kind, entity_id): list(summary.starts)
+                   for kind, summaries in (('venue', model.venues), ('artist', model.artists))
+                   for entity_id, summary in summaries.items()},
+    }
+
+
+def make_changes(client, admin):
+    with app.app_context():
+        venue_ids = db.session.scalars(db.select(Venue.id).order_by(Venue.id)).all()
+        artist_ids = db.session.scalars(db.select(Artist.id).order_by(Artist.id)).all()
+        show_id = db.session.scalar(db.select(Show.id).where(Show.venue_id == venue_ids[1]))
+        renamed = db.session.get(Artist, artist_ids[2])
+        renamed.name = 'Renamed Artist'
+        db.session.commit()
+    new_venue = add_venue(name='New Venue', city='Chicago', state='IL')
+    add_show(new_venue, artist_ids[2], days=3)
+    add_show(venue_ids[2], artist_ids[2], days=-1)
+    with app.app_context():
+        moved = db.session.get(Show, show_id)
+        moved.start_time = moved.start_time.replace(year=moved.start_time.year + 1)
+        db.session.commit()
+    assert client.post(f'/venues/{venue_ids[0]}/delete').status_code == 200
+    assert client.post('/bulk/delete', headers=admin, json={'artists': [artist_ids[1]]}).status_code == 200
+
+
+def test_load_matches_the_database(model):
+    assert len(model.shows) == 9
+    assert projection(model) == projection(loaded_from_database())
+
+
+def test_commits_are_applied_as_they_happen(client, admin, model):
+    make_changes(client, admin)
+
+    assert projection(model) == projection(loaded_from_database())
+
+
+def test_other_workers_changes_arrive_from_the_outbox(client, admin, model, monkeypatch):
+    # Without this worker's own commit hook the changes reach the model only by sync
+    monkeypatch.setattr(fyyur, 'change_listeners',
+                        [listener for listener in fyyur.change_listeners if listener is not fyyur.apply_read_model_changes])
+    before = projection(model)
+    make_changes(client, admin)
+    assert projection(model) == before
+
+    with app.app_context():
+        fyyur.current_read_model()
+
+    assert projection(model) == projection(loaded_from_database())
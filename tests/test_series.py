@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db, Show, ShowSeries
+from tests.helpers import add_venue, add_artist, add_show, count, csrf_token
+
+
+@pytest.fixture
+def series(client):
+    # A weekly series of five upcoming shows at 20:00, plus one that already happened
+    venue_id, artist_id = add_venue(), add_artist()
+    first = (datetime.now() + timedelta(days=2)).replace(hour=20, minute=0, second=0, microsecond=0)
+    response = client.post('/shows/series/create', data={
+        'csrf_token': csrf_token(client),
+        'venue_id': str(venue_id),
+        'artist_id': str(artist_id),
+        'start_time': first.strftime('%Y-%m-%d %H:%M:%S'),
+        'repeat': 'weekly',
+        'until': (first + timedelta(weeks=4)).strftime('%Y-%m-%d'),
+    })
+    assert response.status_code == 200
+    with app.app_context():
+        series_id = db.session.scalar(db.select(ShowSeries.id))
+    past = add_show(venue_id, artist_id, days=-5, series_id=series_id)
+    return {'id': series_id, 'venue_id': venue_id, 'artist_id': artist_id, 'first': first, 'past': past}
+
+
+def series_shows(series_id):
+    with app.app_context():
+        return db.session.execute(
+            db.select(Show.id, Show.venue_id, Show.start_time).where(Show.series_id == series_id).order_by(Show.start_time)
+        ).all()
+
+
+def test_series_books_every_occurrence(series):
+    starts = [start_time for _, _, start_time in series_shows(series['id'])][1:]
+
+    assert starts == [series['first'] + timedelta(weeks=week) for week in range(5)]
+
+
+def test_series_edit_moves_and_shifts_upcoming_shows(client, series):
+    other_venue = add_venue(name='Park Square Live')
+    before = series_shows(series['id'])
+
+    response = client.patch(f"/shows/series/{series['id']}", json={'venue_id': other_venue, 'shift_minutes': 90},
+                            headers={'X-CSRFToken': csrf_token(client)})
+
+    assert response.status_code == 200
+    assert response.get_json()['venue_id'] == other_venue
+    after = series_shows(series['id'])
+    assert after[0] == before[0]
+    assert [(show_id, venue_id, start_time) for show_id, venue_id, start_time in after[1:]] == \
+        [(show_id, other_venue, start_time + timedelta(minutes=90)) for show_id, _, start_time in before[1:]]
+
+
+def test_series_edit_refuses_overlaps(client, series, admin):
+    other_venue = add_venue(name='Park Square Live')
+    other_artist = add_artist(name='Matt Quevedo')
+    with app.app_context():
+        db.session.add(Show(venue_id=other_venue, artist_id=other_artist,
+                            start_time=series['first'] + timedelta(weeks=2, hours=1)))
+        db.session.commit()
+    before = series_shows(series['id'])
+
+    response = client.patch(f"/shows/series/{series['id']}", json={'venue_id': other_venue}, headers=admin)
+
+    assert response.status_code == 409
+    assert len(response.get_json()['conflicts']) == 1
+    assert series_shows(series['id']) == before
+
+
+def test_series_changes_need_a_csrf_or_admin_token(client, series):
+    before = series_shows(series['id'])
+
+    assert client.patch(f"/shows/series/{series['id']}", json={'shift_minutes': 60}).status_code == 400
+    assert client.delete(f"/shows/series/{series['id']}").status_code == 400
+    assert series_shows(series['id']) == before
+
+
+def test_series_edit_rejects_bodies_that_are_not_objects(client, series, admin):
+    for body in ([1, 2], 60):
+        assert client.patch(f"/shows/series/{series['id']}", json=body, headers=admin).status_code == 400
+
+
+def test_series_cancel_removes_upcoming_shows_only(client, series, admin):
+    response = client.delete(f"/shows/series/{series['id']}", headers=admin)
+
+    assert response.get_json() == {'success': True, 'cancelled': 5}
+    assert [show_id for show_id, _, _ in series_shows(series['id'])] == [series['past']]
+    # The series stays while it has a show in the past
+    assert count(ShowSeries.id == series['id'], model=ShowSeries) == 1
+
+
+def test_series_cancel_removes_a_series_without_past_shows(client, series, admin):
+    with app.app_context():
+        db.session.execute(db.delete(Show).where(Show.id == series['past']))
+        db.session.commit()
+
+    assert client.delete(f"/shows/series/{series['id']}", headers=admin).get_json()['cancelled'] == 5
+    assert count(ShowSeries.id == series['id'], model=ShowSeries) == 0
@@ -0,0 +1,41 @@
+import math
+
+# Trending scores use forward decay: a show booked at time t adds
+# weight * e^(rate * (t - landmark)) to its venue's and artist's stored score.
+# Scores stored against the same landmark rank exactly as the decayed ones, so adding
+# a booking never touches the other rows. The decay job moves the landmark up to
+# now and rescales every score once, which keeps the numbers small.
+
+
+def decay_rate(half_life_days):
+    # Per second
+    return math.log(2) / (half_life_days * 86400)
+
+
+def show_weight(created_at, start_time, upcoming_days, upcoming_bonus):
+    # Every booking counts 1; a show starting within upcoming_days of being booked
+    # counts upcoming_bonus more, as a sign of what is busy now
+    if created_at <= start_time and (start_time - created_at).total_seconds() <= upcoming_days * 86400:
+        return 1.0 + upcoming_bonus
+    return 1.0
+
+
+def scaled(weight, at, landmark, rate):
+    return weight * math.exp(rate * (at - landmark).total_seconds())
+
+
+def decayed(score, landmark, now, rate):
+    # A stored score as of now
+    return score * math.exp(-rate * (now - landmark).total_seconds())
+
+
+def show_contributions(shows, landmark, rate, upcoming_days, upcoming_bonus, sign=1):
+    # {venue_id: delta}, {artist_id: delta} for (venue_id, artist_id, created_at, start_time)
+    # rows; sign=-1 takes them back out
+    venues, artists = {}, {}
+    for venue_id, artist_id, created_at, start_time in shows:
+        delta = sign * scaled(show_weight(created_at, start_time, upcoming_days, upcoming_bonus),
+                              created_at, landmark, rate)
+        venues[venue_id] = venues.get(venue_id, 0.0) + delta
+        artists[artist_id] = artists.get(artist_id, 0.0) + delta
+    return venues, artists
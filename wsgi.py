@@ -0,0 +1,8 @@
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:app
+from app import app, preload_templates
+
+# Runs once in the gunicorn master (preload_app), so every worker forks with all
+# templates already compiled
+preload_templates()
+
+application = app